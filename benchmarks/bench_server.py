@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Benchmark del server di irrigazione per dimensione dell'installazione
+
+Per ogni dimensione (default 10, 100, 1k e 10k valvole) avvia in un processo
+separato ProfessionalIrrigationServer su una porta effimera, con un'installazione
+generata di stazioni da due valvole, e misura:
+    - tempo di avvio (creazione dei tipi e dell'AddressSpace)
+    - durata del tick di aggiornamento (10% delle valvole in irrigazione)
+    - tempo di scoperta dei nodi del monitor (_discover_nodes)
+    - tempo di lettura dello stato completo (read_system_status)
+    - memoria residente per valvola (rispetto a un server senza stazioni)
+
+I risultati sono scritti in JSON insieme al commit e alle versioni usate, così
+esecuzioni su commit diversi possono essere confrontate con --compare.
+
+UTILIZZO:
+    python benchmarks/bench_server.py [-o FILE] [--sizes 10,100,1000] [--ticks N] [--compare OLD.json]
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "server"))
+sys.path.insert(0, os.path.join(REPO_DIR, "client"))
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+VALVES_PER_STATION = 2
+# Frazione delle valvole avviate prima di misurare i tick
+ACTIVE_FRACTION = 0.1
+# Metriche confrontate da --compare (valori più alti = peggio)
+COMPARED_METRICS = ("startup_s", "tick_ms_p50", "tick_ms_p95", "discover_s", "read_status_s", "rss_bytes_per_valve")
+
+def generate_installation(valves: int) -> List[Dict]:
+    """Installazione sintetica di stazioni da VALVES_PER_STATION valvole (l'ultima può averne meno)"""
+    configs = []
+    station = 0
+    while valves > 0:
+        station += 1
+        count = min(VALVES_PER_STATION, valves)
+        configs.append({"id": f"Station{station}", "description": f"Zona {station}", "valves": count})
+        valves -= count
+    return configs
+
+def rss_bytes() -> int:
+    """Memoria residente del processo (Linux: /proc; altrove il picco da getrusage)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+async def bench_size(valves: int, ticks: int) -> Dict:
+    """Esegue il benchmark per una dimensione (da chiamare in un processo dedicato)"""
+    from irrigation_server import ProfessionalIrrigationServer
+    from monitor_client import ProfessionalIrrigationMonitor
+
+    configs = generate_installation(valves)
+    rss_before = rss_bytes()
+    full_ids = [f"{c['id']}_Valve{n}" for c in configs for n in range(1, c["valves"] + 1)]
+    active_ids = full_ids[::max(1, int(1 / ACTIVE_FRACTION))]
+    # Coda e limite di frequenza dimensionati perché tutti gli avvii siano accettati
+    srv = ProfessionalIrrigationServer(sim_workers=0, station_configs=configs, state_dir=None,
+                                       endpoint="opc.tcp://127.0.0.1:0/irrigation", audit_dir=None,
+                                       command_queue_size=len(active_ids), command_rate=float(len(active_ids)))
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        await srv.init_server()
+        await srv.server.start()
+    startup_s = time.perf_counter() - started
+    rss_growth = rss_bytes() - rss_before
+    url = f"opc.tcp://127.0.0.1:{srv.server.bserver.port}/irrigation"
+
+    try:
+        # Avvia una parte delle valvole perché i tick abbiano delta da pubblicare
+        # (dalla coda dei comandi: le scritture interne sui nodi Commands.* non vi entrano)
+        for full_valve_id in active_ids:
+            srv.queue_command(full_valve_id, "start", 3600, "", None, "bench")
+
+        tick_ms = []
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            # Tick non misurati finché la coda non è vuota e gli avvii sono applicati
+            while srv.command_queue.depth:
+                await srv.update_nodes()
+            await srv.update_nodes()
+            irrigating = sum(srv.irrigation_system.get_valve(full_valve_id).is_irrigating
+                             for full_valve_id in active_ids)
+            if irrigating != len(active_ids):
+                raise RuntimeError(f"{irrigating} valvole in irrigazione su {len(active_ids)} avviate")
+            for _ in range(ticks):
+                await srv.update_nodes()
+                tick_ms.append(srv.metrics.last_tick_ms)
+                await asyncio.sleep(0.01)
+
+        monitor = ProfessionalIrrigationMonitor(url)
+        await monitor.client.connect()
+        try:
+            monitor.ns_idx = await monitor.client.get_namespace_index(srv.namespace_uri)
+            started = time.perf_counter()
+            await monitor._discover_nodes()
+            discover_s = time.perf_counter() - started
+
+            read_times = []
+            for _ in range(3):
+                started = time.perf_counter()
+                status = await monitor.read_system_status()
+                read_times.append(time.perf_counter() - started)
+            read_valves = sum(len(station["valves"]) for station in status["stations"].values())
+        finally:
+            await monitor.client.disconnect()
+    finally:
+        await srv.server.stop()
+
+    return {
+        "valves": valves,
+        "stations": len(configs),
+        "nodes": len(srv.server.iserver.aspace.keys()),
+        "startup_s": round(startup_s, 4),
+        "tick_ms_mean": round(statistics.fmean(tick_ms), 3),
+        "tick_ms_p50": round(percentile(tick_ms, 0.5), 3),
+        "tick_ms_p95": round(percentile(tick_ms, 0.95), 3),
+        "tick_ms_max": round(max(tick_ms), 3),
+        "discover_s": round(discover_s, 4),
+        "read_status_s": round(statistics.median(read_times), 4),
+        "read_status_valves": read_valves,
+        "rss_bytes": rss_growth,
+    }
+
+def run_size(valves: int, ticks: int) -> Dict:
+    """Esegue una dimensione in un sottoprocesso (memoria e stato dell'event loop isolati)"""
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--single", str(valves), "--ticks", str(ticks)],
+                            capture_output=True, text=True, check=False)
+    if result.returncode != 0:
+        raise RuntimeError(f"benchmark {valves} valvole fallito:\n{result.stderr.strip()}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def environment() -> Dict:
+    import asyncua
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "asyncua": getattr(asyncua, "__version__", None),
+        "platform": platform.platform(),
+    }
+
+def compare(old: Dict, new: Dict):
+    """Stampa il rapporto nuovo/vecchio per le metriche principali"""
+    old_by_size = {r["valves"]: r for r in old["results"]}
+    print(f"\n📊 Confronto con {old['environment'].get('commit') or 'risultati precedenti'}")
+    for result in new["results"]:
+        before = old_by_size.get(result["valves"])
+        if before is None:
+            continue
+        ratios = []
+        for metric in COMPARED_METRICS:
+            if before.get(metric):
+                ratio = result[metric] / before[metric]
+                flag = " ⚠️" if ratio > 1.2 else ""
+                ratios.append(f"{metric} x{ratio:.2f}{flag}")
+        print(f"   {result['valves']:>6} valvole: " + ", ".join(ratios))
+
+def print_result(result: Dict):
+    print(f"   {result['valves']:>6} valvole: avvio {result['startup_s']:.2f}s, "
+          f"tick p50 {result['tick_ms_p50']:.2f}ms p95 {result['tick_ms_p95']:.2f}ms, "
+          f"discover {result['discover_s']:.2f}s, read {result['read_status_s']:.3f}s, "
+          f"{result['rss_bytes_per_valve'] / 1024:.1f} KiB/valvola")
+
+def main():
+    args = sys.argv[1:]
+    ticks = 20
+    if "--ticks" in args:
+        try:
+            ticks = int(args[args.index("--ticks") + 1])
+        except (ValueError, IndexError):
+            print("❌ Errore: numero di tick non valido dopo --ticks")
+            return
+
+    if "--single" in args:
+        logging.basicConfig(level=logging.ERROR)
+        valves = int(args[args.index("--single") + 1])
+        print(json.dumps(asyncio.run(bench_size(valves, ticks))))
+        return
+
+    sizes = DEFAULT_SIZES
+    if "--sizes" in args:
+        try:
+            sizes = tuple(int(size) for size in args[args.index("--sizes") + 1].split(","))
+        except (ValueError, IndexError):
+            print("❌ Errore: dimensioni non valide dopo --sizes (es. 10,100,1000)")
+            return
+
+    output = "benchmark_results.json"
+    if "-o" in args:
+        try:
+            output = args[args.index("-o") + 1]
+        except IndexError:
+            print("❌ Errore: file non specificato dopo -o")
+            return
+
+    baseline: Optional[Dict] = None
+    if "--compare" in args:
+        try:
+            with open(args[args.index("--compare") + 1], encoding="utf-8") as f:
+                baseline = json.load(f)
+        except (IndexError, OSError, ValueError) as e:
+            print(f"❌ Errore: risultati da confrontare non leggibili: {e}")
+            return
+
+    report = {"environment": environment(), "results": []}
+    print(f"⏱️  Benchmark server ({', '.join(str(s) for s in sizes)} valvole, {ticks} tick)")
+    # Memoria di un server senza stazioni: costo fisso da sottrarre a ogni dimensione
+    base_rss = run_size(0, 1)["rss_bytes"]
+    for valves in sizes:
+        result = run_size(valves, ticks)
+        result["rss_bytes_per_valve"] = round(max(0, result["rss_bytes"] - base_rss) / valves)
+        report["results"].append(result)
+        print_result(result)
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Risultati salvati in {output}")
+
+    if baseline is not None:
+        compare(baseline, report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Regole di allarme incrementali sui cambi di stato delle valvole
+
+Il motore indicizza le regole per variabile (per ora IsIrrigating): una notifica
+della sottoscrizione raggiunge solo le regole che dipendono da quella variabile e
+solo se il valore cambia. Le regole tengono contatori e timer propri e non
+rileggono mai lo stato completo:
+    - valvola in irrigazione da più di VALVE_CONFIG["max_duration"]: un timer per
+      valvola aperta, armato all'apertura e cancellato alla chiusura
+    - stazione mai irrigata oggi: insieme delle stazioni irrigate nella giornata,
+      controllato da un timer all'ora limite di ogni giorno
+    - più di N valvole aperte: un contatore aggiornato a ogni transizione
+Gli allarmi si attivano e si chiudono nella stessa notifica (o allo scadere del
+timer), non al prossimo giro di lettura.
+
+Come per le statistiche, tutto è relativo al periodo osservato dal monitor: una
+valvola già aperta all'avvio conta da quando viene vista.
+"""
+
+import asyncio
+import collections
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+# Allarmi conclusi conservati per la visualizzazione
+ALERT_HISTORY_SIZE = 100
+
+class Alert:
+    """Allarme attivo o concluso (istanti epoch, secondi)"""
+
+    __slots__ = ("rule", "key", "message", "raised_at", "cleared_at")
+
+    def __init__(self, rule: str, key: str, message: str, raised_at: float):
+        self.rule = rule
+        self.key = key
+        self.message = message
+        self.raised_at = raised_at
+        self.cleared_at: Optional[float] = None
+
+class AlertRule(ABC):
+    """Regola: `variables` sono le variabili di valvola che la riguardano (chiavi dell'indice)"""
+
+    name = ""
+    variables: Tuple[str, ...] = ()
+
+    def attach(self, engine: "AlertEngine"):
+        self.engine = engine
+
+    def start(self, now: float):
+        """Motore avviato nel loop: timer periodici della regola"""
+
+    @abstractmethod
+    def on_change(self, full_valve_id: str, variable: str, value, previous, now: float):
+        """Variabile `variable` della valvola passata da `previous` a `value`"""
+
+class ValveRuntimeRule(AlertRule):
+    """Valvola in irrigazione da più di `max_seconds`"""
+
+    name = "valve_runtime"
+    variables = ("irrigating",)
+
+    def __init__(self, max_seconds: float):
+        self.max_seconds = max_seconds
+
+    def on_change(self, full_valve_id: str, variable: str, value, previous, now: float):
+        engine = self.engine
+        if value:
+            engine.schedule((self.name, full_valve_id), now + self.max_seconds, lambda fired_at: engine.raise_alert(
+                self.name, full_valve_id, f"{full_valve_id} irriga da più di {self.max_seconds / 60:.0f} min", fired_at))
+        else:
+            engine.cancel((self.name, full_valve_id))
+            engine.clear_alert(self.name, full_valve_id, now)
+
+class OpenValvesRule(AlertRule):
+    """Più di `limit` valvole in irrigazione contemporaneamente"""
+
+    name = "open_valves"
+    variables = ("irrigating",)
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.open = 0
+
+    def on_change(self, full_valve_id: str, variable: str, value, previous, now: float):
+        if value:
+            self.open += 1
+        elif previous:
+            self.open -= 1
+        else:
+            return
+        if self.open > self.limit:
+            # Il messaggio segue il conteggio; l'istante di attivazione resta il primo
+            self.engine.raise_alert(self.name, "system", f"{self.open} valvole aperte (limite {self.limit})", now)
+        else:
+            self.engine.clear_alert(self.name, "system", now)
+
+class StationNotWateredRule(AlertRule):
+    """Stazione che non ha irrigato entro l'ora limite della giornata"""
+
+    name = "station_not_watered"
+    variables = ("irrigating",)
+
+    def __init__(self, deadline: str):
+        hours, minutes = (int(part) for part in deadline.split(":"))
+        self.deadline = timedelta(hours=hours, minutes=minutes)
+        self.deadline_text = deadline
+        self.stations = set()
+        # Stazioni che hanno iniziato a irrigare nel giorno `day`
+        self.watered = set()
+        self.day = None
+
+    def start(self, now: float):
+        # Il primo controllo è la prossima ora limite: prima dell'avvio non si sa nulla
+        self._schedule_next(now)
+
+    def _schedule_next(self, now: float):
+        midnight = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+        check = midnight + self.deadline
+        if check.timestamp() <= now:
+            check += timedelta(days=1)
+        self.engine.schedule((self.name, None), check.timestamp(), self._check)
+
+    def _check(self, now: float):
+        watered = self.watered if self.day == datetime.fromtimestamp(now).date() else set()
+        for station_id in self.stations - watered:
+            # Restano attivi fino alla prima irrigazione della stazione
+            self.engine.raise_alert(self.name, station_id,
+                                    f"{station_id} non ha irrigato oggi entro le {self.deadline_text}", now)
+        self._schedule_next(now)
+
+    def on_change(self, full_valve_id: str, variable: str, value, previous, now: float):
+        station_id = full_valve_id.split("_", 1)[0]
+        self.stations.add(station_id)
+        if value:
+            today = datetime.fromtimestamp(now).date()
+            if today != self.day:
+                self.day = today
+                self.watered = set()
+            self.watered.add(station_id)
+            self.engine.clear_alert(self.name, station_id, now)
+
+class AlertEngine:
+    """Regole indicizzate per variabile, allarmi attivi e timer delle regole"""
+
+    def __init__(self, rules: List[AlertRule], on_alert: Optional[Callable[[Alert], None]] = None):
+        self.rules = rules
+        self.on_alert = on_alert
+        self.active: Dict[Tuple[str, str], Alert] = {}
+        self.history = collections.deque(maxlen=ALERT_HISTORY_SIZE)
+        self._index: Dict[str, List[AlertRule]] = collections.defaultdict(list)
+        self._values: Dict[Tuple[str, str], object] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._started = False
+        for rule in rules:
+            rule.attach(self)
+            for variable in rule.variables:
+                self._index[variable].append(rule)
+
+    def start(self, now: Optional[float] = None):
+        """Da chiamare nel loop asyncio (i timer delle regole usano loop.call_later)"""
+        if not self._started:
+            self._started = True
+            for rule in self.rules:
+                rule.start(time.time() if now is None else now)
+
+    def observe(self, full_valve_id: str, variable: str, value, now: Optional[float] = None):
+        """Valore osservato (notifica o lettura); solo i cambiamenti raggiungono le regole"""
+        key = (full_valve_id, variable)
+        previous = self._values.get(key)
+        if previous == value:
+            return
+        self._values[key] = value
+        now = time.time() if now is None else now
+        for rule in self._index.get(variable, ()):
+            rule.on_change(full_valve_id, variable, value, previous, now)
+
+    def schedule(self, key: Hashable, at: float, callback: Callable[[float], None]):
+        """Timer della regola (sostituisce quello con la stessa chiave); `at` in epoch"""
+        self.cancel(key)
+
+        def fire():
+            del self._timers[key]
+            callback(time.time())
+
+        self._timers[key] = asyncio.get_running_loop().call_later(max(0.0, at - time.time()), fire)
+
+    def cancel(self, key: Hashable):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+    def raise_alert(self, rule: str, key: str, message: str, now: float):
+        alert = self.active.get((rule, key))
+        if alert is not None:
+            alert.message = message
+            return
+        alert = self.active[(rule, key)] = Alert(rule, key, message, now)
+        if self.on_alert is not None:
+            self.on_alert(alert)
+
+    def clear_alert(self, rule: str, key: str, now: float):
+        alert = self.active.pop((rule, key), None)
+        if alert is None:
+            return
+        alert.cleared_at = now
+        self.history.append(alert)
+        if self.on_alert is not None:
+            self.on_alert(alert)
+
+    def stop(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+
+def default_rules(max_duration: float, max_open_valves: int, watering_deadline: str) -> List[AlertRule]:
+    return [ValveRuntimeRule(max_duration), OpenValvesRule(max_open_valves),
+            StationNotWateredRule(watering_deadline)]
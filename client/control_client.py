@@ -5,22 +5,53 @@ Compatibile con la struttura gerarchica: Stations/StationX/ValveY
 """
 
 import asyncio
+import csv
+import json
+import random
 import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
 from asyncua import Client, ua
 
+from session_recovery import SessionRecovery, recovering_client
+
+# Attesa massima della conferma di un comando (Status.LastCommandId)
+ROUND_TRIP_TIMEOUT = 10.0
+ROUND_TRIP_POLL = 0.05
+# Rifiuti temporanei della coda dei comandi del server: tentativi e primo intervallo (secondi)
+BUSY_STATUS_CODES = (ua.StatusCodes.BadServerTooBusy, ua.StatusCodes.BadTooManyOperations)
+BUSY_RETRIES = 5
+BUSY_RETRY_DELAY = 0.05
+# Richieste di scrittura contemporanee nella modalità batch
+DEFAULT_BATCH_WINDOW = 32
+BATCH_ACTIONS = ("start", "stop")
+
 class ProfessionalIrrigationController:
     """Client professionale per la struttura con ObjectTypes"""
     
-    def __init__(self, server_url: str = "opc.tcp://localhost:48400/irrigation"):
+    def __init__(self, server_url: str = "opc.tcp://localhost:48400/irrigation", quiet: bool = False,
+                 timeout: float = 4, auto_reconnect: bool = True):
         self.server_url = server_url
-        self.client = Client(server_url)
+        # auto_reconnect: riconnessione con backoff e risincronizzazione (vedi session_recovery.py);
+        # chi gestisce da sé le sessioni (fleet_controller.py, load_generator.py) la disattiva
+        self.auto_reconnect = auto_reconnect
+        self.client = recovering_client(server_url, timeout) if auto_reconnect else Client(server_url, timeout=timeout)
+        self.recovery = None
         self.ns_idx = None
         self.nodes = {}
+        # quiet: nessun messaggio per singolo comando (uso da strumenti come load_generator.py)
+        self.quiet = quiet
+        
+    def _log(self, message: str):
+        if not self.quiet:
+            print(message)
         
     async def connect(self):
         """Connette al server"""
         await self.client.connect()
-        print(f"✅ Connesso al server: {self.server_url}")
+        self._log(f"✅ Connesso al server: {self.server_url}")
         
         # Trova namespace
         namespaces = await self.client.get_namespace_array()
@@ -31,7 +62,27 @@ class ProfessionalIrrigationController:
                 
         # Scopri nodi
         await self._discover_nodes()
-        print("✅ Sistema professionale scoperto")
+        self._log("✅ Sistema professionale scoperto")
+        
+        if self.auto_reconnect and self.recovery is None:
+            self.recovery = SessionRecovery(self.client, self.resync, self._log)
+            self.recovery.start()
+    
+    async def resync(self) -> int:
+        """
+        Dopo una riconnessione: verifica i nodi in cache con una sola Read in blocco.
+        Riscopre l'AddressSpace solo se il server non li conosce più (installazione cambiata).
+        """
+        nodes = [self.nodes["system_state"]]
+        for valve_id, valve in self.nodes.items():
+            if valve_id != "system_state":
+                nodes += [valve["irrigating"], valve["mode"], valve["remaining"]]
+        values = await self.client.read_attributes(nodes)
+        if any(value.StatusCode.value == ua.StatusCodes.BadNodeIdUnknown for value in values):
+            self.nodes = {}
+            await self._discover_nodes()
+            self._log("🔍 Installazione cambiata: nodi riscoperti")
+        return len(values)
         
     async def _discover_nodes(self):
         """Scopre i nodi del sistema professionale"""
@@ -46,13 +97,10 @@ class ProfessionalIrrigationController:
         # Stations folder
         stations_folder = await irrigation_system.get_child([f"{self.ns_idx}:Stations"])
         
-        # Stazioni e valvole
-        station_ids = ["Station1", "Station2", "Station3"]
-        
-        for station_id in station_ids:
+        # Stazioni e valvole: quelle presenti nel server (l'installazione può essere configurata)
+        for station_node in await stations_folder.get_children():
+            station_id = (await station_node.read_browse_name()).Name
             try:
-                station_node = await stations_folder.get_child([f"{self.ns_idx}:{station_id}"])
-                
                 # StationInfo
                 station_info = await station_node.get_child([f"{self.ns_idx}:StationInfo"])
                 valve_count_node = await station_info.get_child([f"{self.ns_idx}:ValveCount"])
@@ -71,12 +119,14 @@ class ProfessionalIrrigationController:
                         is_irrigating = await status_folder.get_child([f"{self.ns_idx}:IsIrrigating"])
                         mode = await status_folder.get_child([f"{self.ns_idx}:Mode"])
                         remaining_time = await status_folder.get_child([f"{self.ns_idx}:RemainingTime"])
+                        last_command_id = await status_folder.get_child([f"{self.ns_idx}:LastCommandId"])
                         
                         # Commands
                         commands_folder = await valve_node.get_child([f"{self.ns_idx}:Commands"])
                         duration_cmd = await commands_folder.get_child([f"{self.ns_idx}:CommandDuration"])
                         start_cmd = await commands_folder.get_child([f"{self.ns_idx}:CommandStart"])
                         stop_cmd = await commands_folder.get_child([f"{self.ns_idx}:CommandStop"])
+                        command_id = await commands_folder.get_child([f"{self.ns_idx}:CommandId"])
                         
                         # Description
                         description = await valve_node.get_child([f"{self.ns_idx}:Description"])
@@ -90,6 +140,8 @@ class ProfessionalIrrigationController:
                             "duration_cmd": duration_cmd,
                             "start_cmd": start_cmd,
                             "stop_cmd": stop_cmd,
+                            "command_id": command_id,
+                            "last_command_id": last_command_id,
                             "station": station_id,
                             "valve": valve_id
                         }
@@ -97,7 +149,7 @@ class ProfessionalIrrigationController:
                         pass  # Valvola non trovata
                         
             except:
-                pass  # Stazione non trovata
+                pass  # Non è una stazione
                 
     async def get_system_state(self) -> bool:
         """Stato del sistema"""
@@ -107,43 +159,101 @@ class ProfessionalIrrigationController:
         """Imposta stato sistema"""
         await self.nodes["system_state"].write_value(on)
         status = "🟢 ACCESO" if on else "🔴 SPENTO"
-        print(f"Sistema: {status}")
+        self._log(f"Sistema: {status}")
         
+    async def _send_command(self, valve: dict, values: list) -> str:
+        """
+        Scrive id di correlazione e variabili del comando in una sola richiesta, con il
+        timestamp del client come SourceTimestamp: il server traccia il comando end-to-end.
+        """
+        correlation_id = uuid.uuid4().hex[:16]
+        now = datetime.now(timezone.utc)
+        nodes = [valve["command_id"]] + [node for node, _ in values]
+        variants = [ua.Variant(correlation_id, ua.VariantType.String)] + [variant for _, variant in values]
+        data_values = [ua.DataValue(variant, SourceTimestamp=now) for variant in variants]
+        # Coda del server piena o limite di frequenza: riprova con backoff, poi rinuncia
+        delay = BUSY_RETRY_DELAY
+        for attempt in range(BUSY_RETRIES + 1):
+            try:
+                await self.client.write_values(nodes, data_values)
+                return correlation_id
+            except ua.UaStatusCodeError as e:
+                if e.code not in BUSY_STATUS_CODES or attempt == BUSY_RETRIES:
+                    raise
+            await asyncio.sleep(delay * (0.5 + random.random()))
+            delay *= 2
+    
+    async def _report_round_trip(self, valve: dict, correlation_id: str, sent: float):
+        """Attende che il server pubblichi l'id del comando e stampa il tempo di andata e ritorno"""
+        if self.quiet:
+            return
+        deadline = sent + ROUND_TRIP_TIMEOUT
+        while time.perf_counter() < deadline:
+            if await valve["last_command_id"].read_value() == correlation_id:
+                self._log(f"⏱️  Round trip: {(time.perf_counter() - sent) * 1000:.0f} ms (id {correlation_id})")
+                return
+            await asyncio.sleep(ROUND_TRIP_POLL)
+        self._log(f"⚠️  Nessuna conferma del comando {correlation_id} entro {ROUND_TRIP_TIMEOUT:.0f}s")
+    
+    async def send_command(self, valve_id: str, action: str, duration: int = 0) -> str:
+        """
+        Invia un comando start/stop senza attendere la conferma (usato dalla modalità batch).
+        Restituisce l'id di correlazione; solleva ValueError se il comando non è valido.
+        """
+        valve = self.nodes.get(valve_id)
+        if valve is None or valve_id == "system_state":
+            raise ValueError(f"valvola {valve_id} non trovata")
+        if action == "start":
+            if duration <= 0:
+                raise ValueError("durata mancante o non positiva")
+            return await self._send_command(valve, [
+                (valve["duration_cmd"], ua.Variant(duration, ua.VariantType.Int32)),
+                (valve["start_cmd"], ua.Variant(True, ua.VariantType.Boolean)),
+            ])
+        if action == "stop":
+            return await self._send_command(valve, [
+                (valve["stop_cmd"], ua.Variant(True, ua.VariantType.Boolean)),
+            ])
+        raise ValueError(f"azione '{action}' non valida (start, stop)")
+    
     async def start_irrigation(self, valve_id: str, duration: int) -> bool:
         """Avvia irrigazione tramite variabili"""
         if valve_id not in self.nodes:
-            print(f"❌ Valvola {valve_id} non trovata")
+            self._log(f"❌ Valvola {valve_id} non trovata")
             return False
             
         try:
             valve = self.nodes[valve_id]
             
             # Imposta durata e comando start (con tipi OPC-UA corretti)
-            await valve["duration_cmd"].write_value(ua.Variant(duration, ua.VariantType.Int32))
-            await valve["start_cmd"].write_value(True)
+            sent = time.perf_counter()
+            correlation_id = await self.send_command(valve_id, "start", duration)
             
             mins, secs = divmod(duration, 60)
-            print(f"✅ Comando inviato: {valve['description']} per {mins:02d}:{secs:02d}")
+            self._log(f"✅ Comando inviato: {valve['description']} per {mins:02d}:{secs:02d}")
+            await self._report_round_trip(valve, correlation_id, sent)
             return True
             
         except Exception as e:
-            print(f"❌ Errore: {e}")
+            self._log(f"❌ Errore: {e}")
             return False
             
     async def stop_irrigation(self, valve_id: str) -> bool:
         """Ferma irrigazione"""
         if valve_id not in self.nodes:
-            print(f"❌ Valvola {valve_id} non trovata")
+            self._log(f"❌ Valvola {valve_id} non trovata")
             return False
             
         try:
             valve = self.nodes[valve_id]
-            await valve["stop_cmd"].write_value(True)
-            print(f"✅ Stop inviato: {valve['description']}")
+            sent = time.perf_counter()
+            correlation_id = await self.send_command(valve_id, "stop")
+            self._log(f"✅ Stop inviato: {valve['description']}")
+            await self._report_round_trip(valve, correlation_id, sent)
             return True
             
         except Exception as e:
-            print(f"❌ Errore: {e}")
+            self._log(f"❌ Errore: {e}")
             return False
             
     async def get_valve_status(self, valve_id: str):
@@ -189,8 +299,30 @@ class ProfessionalIrrigationController:
         
     async def disconnect(self):
         """Disconnette"""
+        if self.recovery is not None:
+            await self.recovery.stop()
         await self.client.disconnect()
-        print("✅ Disconnesso")
+        self._log("✅ Disconnesso")
+
+def start_console_reader(loop: asyncio.AbstractEventLoop) -> asyncio.Queue:
+    """
+    Legge stdin in un thread (daemon) e passa le righe al loop: mentre si aspetta
+    un comando l'event loop resta libero per keep-alive e riconnessione.
+    """
+    lines: asyncio.Queue = asyncio.Queue()
+    
+    def reader():
+        while True:
+            try:
+                line = input()
+            except EOFError:
+                line = None
+            loop.call_soon_threadsafe(lines.put_nowait, line)
+            if line is None:
+                return
+    
+    threading.Thread(target=reader, name="console", daemon=True).start()
+    return lines
 
 async def interactive_mode(controller):
     """Modalità interattiva professionale"""
@@ -198,10 +330,15 @@ async def interactive_mode(controller):
     print("   Struttura: IrrigationSystem/Controller + Stations/StationX/ValveY")
     print("   Comandi: help, status, list, on, off, start <valvola> <durata>, stop <valvola>, exit")
     print()
+    lines = start_console_reader(asyncio.get_running_loop())
     
     while True:
         try:
-            command = input("🌿 > ").strip()
+            print("🌿 > ", end="", flush=True)
+            command = await lines.get()
+            if command is None:
+                break
+            command = command.strip()
             if not command:
                 continue
                 
@@ -281,9 +418,128 @@ async def interactive_mode(controller):
         except Exception as e:
             print(f"❌ Errore: {e}")
 
+def parse_batch_line(line: str) -> dict:
+    """
+    Riga di comando batch: JSON ({"valve": ..., "action": ..., "duration": ...})
+    oppure CSV (valvola,azione[,durata]). Solleva ValueError se la riga non è valida.
+    """
+    if line.startswith("{"):
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"JSON non valido: {e.msg}")
+        valve_id, action, duration = data.get("valve"), data.get("action"), data.get("duration", 0)
+    else:
+        fields = [field.strip() for field in next(csv.reader([line]))]
+        if len(fields) < 2:
+            raise ValueError("attesi valvola,azione[,durata]")
+        valve_id, action = fields[0], fields[1]
+        duration = fields[2] if len(fields) > 2 and fields[2] else 0
+    try:
+        duration = int(duration or 0)
+    except (TypeError, ValueError):
+        raise ValueError(f"durata '{duration}' non valida")
+    if not valve_id or not action:
+        raise ValueError("valvola o azione mancante")
+    return {"valve": str(valve_id), "action": str(action).lower(), "duration": duration}
+
+async def batch_mode(controller, stream, output, window: int = DEFAULT_BATCH_WINDOW) -> dict:
+    """
+    Esegue i comandi letti da stream (file o stdin) con al massimo `window` scritture
+    in corso sulla stessa sessione. Per ogni riga scrive su output un risultato JSON
+    (in ordine di completamento, con il numero di riga): il client non aspetta una
+    risposta prima di inviare il comando successivo, quindi il limite è il server.
+    """
+    slots = asyncio.Semaphore(window)
+    summary = {"commands": 0, "ok": 0, "errors": 0}
+    pending = set()
+    
+    def report(result: dict):
+        summary["commands"] += 1
+        summary["ok" if result["ok"] else "errors"] += 1
+        output.write(json.dumps(result) + "\n")
+    
+    async def run(line_number: int, command: dict):
+        started = time.perf_counter()
+        try:
+            correlation_id = await controller.send_command(command["valve"], command["action"], command["duration"])
+            report({"line": line_number, **command, "ok": True, "id": correlation_id,
+                    "ms": round((time.perf_counter() - started) * 1000, 3)})
+        except Exception as e:
+            report({"line": line_number, **command, "ok": False, "error": str(e) or type(e).__name__})
+        finally:
+            slots.release()
+    
+    started = time.perf_counter()
+    line_number = 0
+    while True:
+        # Lettura fuori dal loop: stdin può essere un flusso lento senza bloccare le risposte
+        line = await asyncio.to_thread(stream.readline)
+        if not line:
+            break
+        line_number += 1
+        line = line.strip()
+        if not line or line.startswith("#") or line.lower().replace(" ", "").startswith("valve,action"):
+            continue
+        try:
+            command = parse_batch_line(line)
+            if command["action"] not in BATCH_ACTIONS:
+                raise ValueError(f"azione '{command['action']}' non valida (start, stop)")
+        except ValueError as e:
+            report({"line": line_number, "ok": False, "error": str(e)})
+            continue
+        await slots.acquire()
+        task = asyncio.create_task(run(line_number, command))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.gather(*pending)
+    output.flush()
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    return summary
+
+def print_help():
+    print("Uso: python control_client.py [--batch FILE|-] [--window N] [-o RISULTATI] [--url URL]")
+    print()
+    print("Senza opzioni avvia la modalità interattiva.")
+    print("  --batch FILE   esegue i comandi del file (- = stdin), uno per riga:")
+    print('                 JSON: {"valve": "Station1_Valve1", "action": "start", "duration": 60}')
+    print("                 CSV:  Station1_Valve1,start,60  /  Station1_Valve1,stop")
+    print(f"  --window N     scritture contemporanee (default {DEFAULT_BATCH_WINDOW})")
+    print("  -o FILE        risultati per riga in JSON lines (default stdout)")
+    print("  --url URL      endpoint del server")
+
 async def main():
     """Main"""
-    controller = ProfessionalIrrigationController()
+    args = sys.argv[1:]
+    if "--help" in args or "-h" in args:
+        print_help()
+        return
+    
+    server_url = "opc.tcp://localhost:48400/irrigation"
+    batch_file = None
+    results_file = None
+    window = DEFAULT_BATCH_WINDOW
+    try:
+        if "--url" in args:
+            server_url = args[args.index("--url") + 1]
+        if "--batch" in args:
+            batch_file = args[args.index("--batch") + 1]
+        if "-o" in args:
+            results_file = args[args.index("-o") + 1]
+        if "--window" in args:
+            window = int(args[args.index("--window") + 1])
+            if window < 1:
+                raise ValueError
+    except (IndexError, ValueError):
+        print("❌ Errore: opzioni non valide (vedi --help)")
+        return
+    
+    if batch_file is not None:
+        await run_batch(server_url, batch_file, results_file, window)
+        return
+    
+    controller = ProfessionalIrrigationController(server_url)
     
     try:
         print("🔌 Connessione al server professionale...")
@@ -297,5 +553,31 @@ async def main():
         except:
             pass
 
+async def run_batch(server_url: str, batch_file: str, results_file, window: int):
+    """Modalità batch: i messaggi vanno su stderr, stdout resta per i risultati"""
+    controller = ProfessionalIrrigationController(server_url, quiet=True)
+    try:
+        stream = sys.stdin if batch_file == "-" else open(batch_file, encoding="utf-8")
+        output = sys.stdout if results_file is None else open(results_file, "w", encoding="utf-8")
+    except OSError as e:
+        print(f"❌ Errore: {e}", file=sys.stderr)
+        return
+    try:
+        await controller.connect()
+        summary = await batch_mode(controller, stream, output, window)
+        rate = summary["commands"] / summary["seconds"] if summary["seconds"] else 0.0
+        print(f"✅ {summary['commands']} comandi in {summary['seconds']:.2f}s ({rate:.0f}/s), "
+              f"{summary['errors']} errori", file=sys.stderr)
+    except Exception as e:
+        print(f"❌ Errore: {e}", file=sys.stderr)
+    finally:
+        for f in (stream, output):
+            if f not in (sys.stdin, sys.stdout):
+                f.close()
+        try:
+            await controller.disconnect()
+        except:
+            pass
+
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Controller di flotta: molti server di irrigazione (uno per sito) da un solo processo
+
+Per ogni sito mantiene una sessione persistente (ProfessionalIrrigationController)
+controllata periodicamente e riaperta quando cade. La scoperta dei nodi si fa una
+volta sola: i NodeId sono deterministici, quindi alla riconnessione i nodi vengono
+ricollegati dalla cache senza sfogliare di nuovo l'AddressSpace.
+
+Letture di stato e comandi di sito sono eseguiti su tutti i siti in parallelo, con
+un timeout per sito: lo stato di un sito è una sola richiesta Read, quindi leggere
+100 siti costa circa un round trip, non 100 connessioni in sequenza.
+
+UTILIZZO:
+    python client/fleet_controller.py siti.json status
+    python client/fleet_controller.py siti.json stop-all [--sites a,b]
+    python client/fleet_controller.py siti.json on|off
+    python client/fleet_controller.py siti.json start SITO Station1_Valve1 300
+
+siti.json: {"nome": "opc.tcp://host:48400/irrigation", ...} oppure una lista di URL
+"""
+
+import asyncio
+import json
+import logging
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from asyncua import ua
+
+from control_client import ProfessionalIrrigationController
+
+logging.basicConfig(level=logging.ERROR)
+
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_HEALTH_INTERVAL = 10.0
+# Connessioni aperte contemporaneamente all'avvio della flotta
+CONNECT_CONCURRENCY = 50
+# Nodi di stato letti per valvola, nell'ordine della richiesta Read
+STATUS_KEYS = ("irrigating", "mode", "remaining")
+# Stati che indicano una sessione persa; gli altri (es. BadServerTooBusy) sono rifiuti
+# della singola operazione e lasciano la sessione in uso
+SESSION_LOST_STATUS_CODES = (
+    ua.StatusCodes.BadConnectionClosed, ua.StatusCodes.BadSecureChannelClosed,
+    ua.StatusCodes.BadSecureChannelIdInvalid, ua.StatusCodes.BadSessionClosed,
+    ua.StatusCodes.BadSessionIdInvalid, ua.StatusCodes.BadSessionNotActivated,
+    ua.StatusCodes.BadCommunicationError, ua.StatusCodes.BadNotConnected,
+    ua.StatusCodes.BadServerNotConnected, ua.StatusCodes.BadServerHalted, ua.StatusCodes.BadShutdown,
+)
+
+class SiteSession:
+    """Sessione persistente verso un sito, con cache dei nodi scoperti"""
+
+    def __init__(self, name: str, url: str, timeout: float = DEFAULT_TIMEOUT):
+        self.name = name
+        self.url = url
+        self.timeout = timeout
+        self.controller: Optional[ProfessionalIrrigationController] = None
+        self.healthy = False
+        self.last_error: Optional[str] = None
+        self.connects = 0
+        # Cache della scoperta: namespace e NodeId (o valori statici) per valvola
+        self._ns_idx: Optional[int] = None
+        self._node_ids: Dict = {}
+        self._lock = asyncio.Lock()
+
+    @property
+    def valve_ids(self) -> List[str]:
+        return [valve_id for valve_id in self._node_ids if valve_id != "system_state"]
+
+    async def ensure_connected(self) -> ProfessionalIrrigationController:
+        """Restituisce la sessione attiva, riaprendola (senza riscoperta) se necessario"""
+        if self.healthy and self.controller is not None:
+            return self.controller
+        async with self._lock:
+            if self.healthy and self.controller is not None:
+                return self.controller
+            await self._close()
+            controller = ProfessionalIrrigationController(self.url, quiet=True, timeout=self.timeout,
+                                                          auto_reconnect=False)
+            try:
+                if self._node_ids:
+                    await asyncio.wait_for(controller.client.connect(), self.timeout)
+                    self._rebind(controller)
+                else:
+                    await asyncio.wait_for(controller.connect(), self.timeout)
+                    self._remember(controller)
+            except BaseException:
+                try:
+                    await controller.client.disconnect()
+                except Exception:
+                    pass
+                raise
+            self.connects += 1
+            self.controller = controller
+            self.healthy = True
+            self.last_error = None
+            return controller
+
+    def _remember(self, controller: ProfessionalIrrigationController):
+        self._ns_idx = controller.ns_idx
+        self._node_ids = {"system_state": controller.nodes["system_state"].nodeid}
+        for valve_id, valve in controller.nodes.items():
+            if valve_id != "system_state":
+                self._node_ids[valve_id] = {key: value.nodeid if hasattr(value, "nodeid") else value
+                                            for key, value in valve.items()}
+
+    def _rebind(self, controller: ProfessionalIrrigationController):
+        client = controller.client
+        controller.ns_idx = self._ns_idx
+        controller.nodes["system_state"] = client.get_node(self._node_ids["system_state"])
+        for valve_id in self.valve_ids:
+            controller.nodes[valve_id] = {key: client.get_node(value) if isinstance(value, ua.NodeId) else value
+                                          for key, value in self._node_ids[valve_id].items()}
+
+    def forget_nodes(self):
+        """Invalida la cache (installazione del sito cambiata): la prossima connessione riscopre"""
+        self._node_ids = {}
+        self.healthy = False
+
+    @property
+    def reconnects(self) -> int:
+        return max(0, self.connects - 1)
+
+    def mark_failed(self, error: BaseException):
+        self.healthy = False
+        self.last_error = str(error) or type(error).__name__
+
+    async def check(self) -> bool:
+        """Controllo di salute: una lettura di SystemState entro il timeout"""
+        try:
+            controller = await self.ensure_connected()
+            await asyncio.wait_for(controller.nodes["system_state"].read_value(), self.timeout)
+            return True
+        except ua.UaStatusCodeError as e:
+            # Nodi non più validi: riscoperta alla prossima connessione
+            if e.code == ua.StatusCodes.BadNodeIdUnknown:
+                self.forget_nodes()
+            self.mark_failed(e)
+        except Exception as e:
+            self.mark_failed(e)
+        return False
+
+    async def _close(self):
+        if self.controller is not None:
+            controller, self.controller = self.controller, None
+            try:
+                await asyncio.wait_for(controller.client.disconnect(), self.timeout)
+            except Exception:
+                pass
+
+    async def close(self):
+        async with self._lock:
+            await self._close()
+            self.healthy = False
+
+class FleetController:
+    """Pool di sessioni verso molti siti, con operazioni parallele e timeout per sito"""
+
+    def __init__(self, sites: Dict[str, str], timeout: float = DEFAULT_TIMEOUT,
+                 health_interval: float = DEFAULT_HEALTH_INTERVAL):
+        self.sessions: Dict[str, SiteSession] = {name: SiteSession(name, url, timeout) for name, url in sites.items()}
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self._health_task: Optional[asyncio.Task] = None
+
+    async def connect(self) -> Dict[str, Dict]:
+        """Apre tutte le sessioni (con concorrenza limitata) e avvia i controlli di salute"""
+        async def connect_site(session: SiteSession, controller):
+            return {"valves": len(session.valve_ids)}
+
+        results = await self.run(connect_site, concurrency=CONNECT_CONCURRENCY)
+        if self.health_interval > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+        return results
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        await asyncio.gather(*(session.close() for session in self.sessions.values()))
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await asyncio.gather(*(session.check() for session in self.sessions.values()))
+
+    async def run(self, operation: Callable[[SiteSession, ProfessionalIrrigationController], Awaitable],
+                  sites: Optional[List[str]] = None, concurrency: Optional[int] = None) -> Dict[str, Dict]:
+        """
+        Esegue operation(sessione, controller) su tutti i siti (o su quelli indicati) in
+        parallelo, riaprendo le sessioni cadute. Ogni sito ha il proprio timeout; il
+        risultato per sito contiene ok, ms e il valore restituito oppure l'errore.
+        """
+        names = list(self.sessions) if sites is None else sites
+        slots = asyncio.Semaphore(concurrency or max(1, len(names)))
+
+        async def run_site(name: str) -> Dict:
+            session = self.sessions.get(name)
+            if session is None:
+                return {"ok": False, "error": "sito sconosciuto"}
+            async def attempt():
+                return await operation(session, await session.ensure_connected())
+
+            async with slots:
+                started = time.perf_counter()
+                try:
+                    result = await asyncio.wait_for(attempt(), self.timeout)
+                    return {"ok": True, "ms": round((time.perf_counter() - started) * 1000, 1), "result": result}
+                except ValueError as e:
+                    # Comando non valido: la sessione resta buona
+                    error = str(e)
+                except ua.UaStatusCodeError as e:
+                    if e.code in SESSION_LOST_STATUS_CODES:
+                        session.mark_failed(e)
+                    elif e.code == ua.StatusCodes.BadNodeIdUnknown:
+                        # Nodi non più validi: riscoperta alla prossima connessione
+                        session.forget_nodes()
+                    # Rifiuto del server (coda piena, limite...): il sito è raggiungibile
+                    error = ua.StatusCode(e.code).name
+                except Exception as e:
+                    session.mark_failed(e)
+                    error = session.last_error
+                return {"ok": False, "ms": round((time.perf_counter() - started) * 1000, 1), "error": error}
+
+        results = await asyncio.gather(*(run_site(name) for name in names))
+        return dict(zip(names, results))
+
+    async def status(self, sites: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """Stato di ogni sito con una sola richiesta Read per sito"""
+
+        async def read_site(session: SiteSession, controller):
+            valve_ids = session.valve_ids
+            nodes = [controller.nodes["system_state"]]
+            for valve_id in valve_ids:
+                nodes.extend(controller.nodes[valve_id][key] for key in STATUS_KEYS)
+            values = await controller.client.read_values(nodes)
+            valves = {}
+            for index, valve_id in enumerate(valve_ids):
+                irrigating, mode, remaining = values[1 + index * len(STATUS_KEYS):1 + (index + 1) * len(STATUS_KEYS)]
+                valves[valve_id] = {"irrigating": irrigating, "mode": mode, "remaining": remaining}
+            return {"system_on": values[0], "valves": valves}
+
+        return await self.run(read_site, sites)
+
+    async def set_system_state(self, on: bool, sites: Optional[List[str]] = None) -> Dict[str, Dict]:
+        async def write_site(session: SiteSession, controller):
+            await controller.nodes["system_state"].write_value(on)
+            return on
+        return await self.run(write_site, sites)
+
+    async def start(self, site: str, valve_id: str, duration: int) -> Dict:
+        async def start_valve(session: SiteSession, controller):
+            return await controller.send_command(valve_id, "start", duration)
+        return (await self.run(start_valve, [site]))[site]
+
+    async def stop_all(self, sites: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """
+        Ferma tutte le valvole di ogni sito: una sola richiesta Write per sito. Il server
+        può accettarne solo una parte (limite di frequenza per sessione): il risultato
+        riporta le valvole fermate e quelle rifiutate con il loro stato.
+        """
+
+        async def stop_site(session: SiteSession, controller):
+            now = datetime.now(timezone.utc)
+            correlation_id = uuid.uuid4().hex[:16]
+            nodes, values = [], []
+            for index, valve_id in enumerate(session.valve_ids):
+                valve = controller.nodes[valve_id]
+                nodes += [valve["command_id"], valve["stop_cmd"]]
+                values += [ua.DataValue(ua.Variant(f"{correlation_id}/{index}", ua.VariantType.String), SourceTimestamp=now),
+                           ua.DataValue(ua.Variant(True, ua.VariantType.Boolean), SourceTimestamp=now)]
+            results = (await controller.client.write_values(nodes, values, raise_on_partial_error=False)
+                       if nodes else [])
+            failed = {}
+            for index, valve_id in enumerate(session.valve_ids):
+                status = results[2 * index + 1]
+                if not status.is_good():
+                    failed[valve_id] = status.name
+            return {"stopped": len(session.valve_ids) - len(failed), "failed": failed}
+
+        return await self.run(stop_site, sites)
+
+def load_sites(filename: str) -> Dict[str, str]:
+    """Siti da JSON: oggetto nome → URL oppure lista di URL (nome = URL)"""
+    with open(filename, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return {url: url for url in data}
+    if isinstance(data, dict):
+        return {str(name): str(url) for name, url in data.items()}
+    raise ValueError("atteso un oggetto nome → URL o una lista di URL")
+
+def print_results(title: str, results: Dict[str, Dict], verbose: bool = False):
+    ok = sum(1 for result in results.values() if result["ok"])
+    print(f"\n{title}: {ok}/{len(results)} siti OK")
+    for name, result in results.items():
+        if not result["ok"]:
+            print(f"   ❌ {name}: {result['error']}")
+            continue
+        value = result["result"]
+        if isinstance(value, dict) and "valves" in value and "system_on" in value:
+            active = [valve_id for valve_id, valve in value["valves"].items() if valve["irrigating"]]
+            state = "🟢" if value["system_on"] else "🔴"
+            detail = f"{state} {len(active)}/{len(value['valves'])} valvole in irrigazione"
+            if verbose and active:
+                detail += ": " + ", ".join(active)
+        elif isinstance(value, dict) and "stopped" in value:
+            detail = f"{value['stopped']} valvole fermate"
+            if value["failed"]:
+                codes = sorted(set(value["failed"].values()))
+                detail += f", ⚠️  {len(value['failed'])} rifiutate ({', '.join(codes)})"
+                if verbose:
+                    detail += ": " + ", ".join(value["failed"])
+        else:
+            detail = str(value)
+        print(f"   ✅ {name} ({result['ms']:.0f} ms): {detail}")
+
+def print_help():
+    print("Uso: python fleet_controller.py SITI.json COMANDO [argomenti] [opzioni]")
+    print()
+    print("Comandi:")
+    print("  status                          stato di tutti i siti")
+    print("  on | off                        accende/spegne il sistema dei siti")
+    print("  stop-all                        ferma tutte le valvole dei siti")
+    print("  start SITO VALVOLA DURATA       avvia una valvola di un sito")
+    print()
+    print("Opzioni:")
+    print("  --sites a,b        solo i siti indicati")
+    print(f"  --timeout S        timeout per sito in secondi (default {DEFAULT_TIMEOUT:.0f})")
+    print("  --watch S          ripete status ogni S secondi sulle stesse sessioni")
+    print("  --json             risultati in JSON")
+    print("  -v                 elenca le valvole attive (o non fermate da stop-all)")
+
+async def main():
+    args = sys.argv[1:]
+    if len(args) < 2 or "--help" in args or "-h" in args:
+        print_help()
+        return
+
+    timeout = DEFAULT_TIMEOUT
+    sites_filter = None
+    watch = None
+    try:
+        if "--timeout" in args:
+            timeout = float(args[args.index("--timeout") + 1])
+        if "--sites" in args:
+            sites_filter = [s for s in args[args.index("--sites") + 1].split(",") if s]
+        if "--watch" in args:
+            watch = float(args[args.index("--watch") + 1])
+    except (IndexError, ValueError):
+        print("❌ Errore: opzioni non valide (vedi --help)")
+        return
+
+    try:
+        sites = load_sites(args[0])
+    except (OSError, ValueError) as e:
+        print(f"❌ Errore: siti non leggibili: {e}")
+        return
+    command = args[1]
+
+    fleet = FleetController(sites, timeout=timeout, health_interval=DEFAULT_HEALTH_INTERVAL if watch else 0)
+    try:
+        started = time.perf_counter()
+        connected = await fleet.connect()
+        ok = sum(1 for result in connected.values() if result["ok"])
+        print(f"🔌 {ok}/{len(sites)} siti connessi in {time.perf_counter() - started:.2f}s")
+
+        if command == "status":
+            while True:
+                started = time.perf_counter()
+                results = await fleet.status(sites_filter)
+                elapsed = time.perf_counter() - started
+                if "--json" in args:
+                    print(json.dumps(results))
+                else:
+                    print_results(f"📊 Stato ({elapsed * 1000:.0f} ms)", results, "-v" in args)
+                if watch is None:
+                    break
+                await asyncio.sleep(watch)
+        elif command in ("on", "off"):
+            print_results(f"⚙️  Sistema {command}", await fleet.set_system_state(command == "on", sites_filter))
+        elif command == "stop-all":
+            print_results("🛑 Stop di tutte le valvole", await fleet.stop_all(sites_filter), "-v" in args)
+        elif command == "start":
+            if len(args) < 5:
+                print("❌ Uso: start SITO VALVOLA DURATA")
+                return
+            result = await fleet.start(args[2], args[3], int(args[4]))
+            print_results("💧 Avvio", {args[2]: result})
+        else:
+            print(f"❌ Comando '{command}' non riconosciuto")
+    except KeyboardInterrupt:
+        print("\n🛑 Uscita")
+    finally:
+        await fleet.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
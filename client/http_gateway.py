@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Gateway HTTP/JSON locale per HMI web e app
+
+Una sola sessione OPC-UA (ProfessionalIrrigationController) tiene uno specchio in
+memoria di IrrigationSystem alimentato da una sottoscrizione: i consumatori HTTP
+leggono dalla cache, quindi centinaia di client costano al server una sessione.
+Il documento JSON dello stato è serializzato una volta per versione e condiviso.
+
+Endpoint:
+    GET  /state                     stato completo (ETag; If-None-Match → 304)
+    GET  /state?wait=30             long-poll: risponde al primo cambiamento rispetto
+                                    all'ETag inviato (o 304 allo scadere dell'attesa)
+    GET  /valves/Station1_Valve1    stato di una valvola
+    GET  /events                    Server-Sent Events: "state" iniziale, poi "change"
+                                    con le sole valvole cambiate per ogni versione
+    POST /valves/<id>/start         {"duration": 300}  → 202 {"id": correlazione}
+    POST /valves/<id>/stop
+    POST /system                    {"on": true|false}
+
+UTILIZZO:
+    python client/http_gateway.py [-u URL] [--port 8080] [--host 127.0.0.1]
+"""
+
+import asyncio
+import json
+import logging
+import sys
+import time
+from typing import Dict, Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from asyncua import ua
+
+from control_client import BUSY_STATUS_CODES, ProfessionalIrrigationController
+from state_mirror import StateMirror
+
+logging.basicConfig(level=logging.WARNING)
+
+DEFAULT_PORT = 8080
+# Attesa massima del long-poll e intervallo dei commenti keep-alive SSE (secondi)
+MAX_WAIT = 60.0
+SSE_KEEPALIVE = 15.0
+MAX_BODY = 64 * 1024
+
+class HttpGateway:
+    """Server HTTP/1.1 minimale (asyncio) sopra lo specchio e il controller"""
+
+    def __init__(self, mirror: StateMirror, controller: ProfessionalIrrigationController):
+        self.mirror = mirror
+        self.controller = controller
+        self.requests = 0
+        self.sse_clients = 0
+
+    async def serve(self, host: str, port: int) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await self._read_request(reader)
+            if request is None:
+                return
+            self.requests += 1
+            method, path, query, headers, body = request
+            await self._route(writer, method, path, query, headers, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader):
+        request_line = await reader.readline()
+        parts = request_line.decode("latin-1").split()
+        if len(parts) < 2:
+            return None
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = min(int(headers.get("content-length", "0") or 0), MAX_BODY)
+        body = await reader.readexactly(length) if length else b""
+        url = urlsplit(parts[1])
+        return parts[0].upper(), unquote(url.path), parse_qs(url.query), headers, body
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, status: str, body: bytes = b"",
+                    content_type: str = "application/json", extra: Optional[Dict[str, str]] = None):
+        head = f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+        for name, value in (extra or {}).items():
+            head += f"{name}: {value}\r\n"
+        writer.write((head + "Cache-Control: no-cache\r\nConnection: close\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def _send_json(self, writer, status: str, data, extra: Optional[Dict[str, str]] = None):
+        await self._send(writer, status, json.dumps(data).encode("utf-8"), extra=extra)
+
+    async def _route(self, writer, method: str, path: str, query: Dict, headers: Dict, body: bytes):
+        segments = [segment for segment in path.split("/") if segment]
+        if method == "GET" and segments == ["state"]:
+            await self._get_state(writer, query, headers)
+        elif method == "GET" and segments == ["events"]:
+            await self._stream_events(writer, query, headers)
+        elif method == "GET" and len(segments) == 2 and segments[0] == "valves":
+            valve = self.mirror.valves.get(segments[1])
+            if valve is None:
+                await self._send_json(writer, "404 Not Found", {"error": "valvola non trovata"})
+            else:
+                await self._send_json(writer, "200 OK", valve, {"ETag": self.mirror.etag})
+        elif method == "POST":
+            await self._post(writer, segments, body)
+        else:
+            await self._send_json(writer, "404 Not Found", {"error": "risorsa non trovata"})
+
+    async def _get_state(self, writer, query: Dict, headers: Dict):
+        mirror = self.mirror
+        if_none_match = headers.get("if-none-match")
+        if "wait" in query and if_none_match == mirror.etag:
+            try:
+                wait = min(float(query["wait"][0]), MAX_WAIT)
+            except ValueError:
+                wait = MAX_WAIT
+            await mirror.wait_change(mirror.version, wait)
+        if if_none_match == mirror.etag:
+            await self._send(writer, "304 Not Modified", extra={"ETag": mirror.etag})
+        else:
+            await self._send(writer, "200 OK", mirror.rendered(), extra={"ETag": mirror.etag})
+
+    async def _stream_events(self, writer, query: Dict, headers: Dict):
+        """Server-Sent Events: stato completo, poi solo le differenze di ogni versione"""
+        mirror = self.mirror
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        self.sse_clients += 1
+        try:
+            # Last-Event-ID (riconnessione del browser): riprende dalle differenze se possibile
+            last = headers.get("last-event-id", "")
+            version = int(last) if last.isdigit() else -1
+            changes = mirror.changes_since(version) if version >= 0 else None
+            if changes is None:
+                version = mirror.version
+                writer.write(b"event: state\nid: %d\ndata: " % version + mirror.rendered() + b"\n\n")
+                changes = []
+            while True:
+                for change in changes:
+                    writer.write(f"event: change\nid: {change['version']}\ndata: {json.dumps(change)}\n\n".encode("utf-8"))
+                    version = change["version"]
+                await writer.drain()
+                if not await mirror.wait_change(version, SSE_KEEPALIVE):
+                    writer.write(b": keep-alive\n\n")
+                    changes = []
+                    continue
+                changes = mirror.changes_since(version)
+                if changes is None:
+                    # Consumatore troppo lento: riparte dallo stato completo
+                    version = mirror.version
+                    writer.write(b"event: state\nid: %d\ndata: " % version + mirror.rendered() + b"\n\n")
+                    changes = []
+        finally:
+            self.sse_clients -= 1
+
+    async def _post(self, writer, segments: list, body: bytes):
+        """Scritture inoltrate al controller (una sola sessione OPC-UA)"""
+        try:
+            data = json.loads(body) if body else {}
+            if not isinstance(data, dict):
+                raise ValueError("atteso un oggetto JSON")
+            if segments == ["system"]:
+                on = data.get("on")
+                if not isinstance(on, bool):
+                    raise ValueError("campo 'on' booleano mancante")
+                await self.controller.nodes["system_state"].write_value(on)
+                await self._send_json(writer, "202 Accepted", {"on": on})
+                return
+            if len(segments) == 3 and segments[0] == "valves" and segments[2] in ("start", "stop"):
+                duration = int(data.get("duration", 0))
+                correlation_id = await self.controller.send_command(segments[1], segments[2], duration)
+                await self._send_json(writer, "202 Accepted", {"id": correlation_id})
+                return
+            await self._send_json(writer, "404 Not Found", {"error": "risorsa non trovata"})
+        except (ValueError, TypeError) as e:
+            await self._send_json(writer, "400 Bad Request", {"error": str(e)})
+        except ConnectionError as e:
+            await self._send_json(writer, "503 Service Unavailable", {"error": str(e)})
+        except ua.UaStatusCodeError as e:
+            # Coda dei comandi del server piena o limite di frequenza: il client può riprovare
+            if e.code in BUSY_STATUS_CODES:
+                await self._send_json(writer, "503 Service Unavailable", {"error": str(e)}, {"Retry-After": "1"})
+            else:
+                await self._send_json(writer, "502 Bad Gateway", {"error": str(e)})
+
+def print_help():
+    print("Uso: python http_gateway.py [-u URL] [--port PORTA] [--host HOST]")
+    print()
+    print("  -u URL        server OPC-UA (default opc.tcp://localhost:48400/irrigation)")
+    print(f"  --port PORTA  porta HTTP (default {DEFAULT_PORT})")
+    print("  --host HOST   indirizzo di ascolto (default 127.0.0.1)")
+
+async def main():
+    args = sys.argv[1:]
+    if "-h" in args or "--help" in args:
+        print_help()
+        return
+    server_url = "opc.tcp://localhost:48400/irrigation"
+    host, port = "127.0.0.1", DEFAULT_PORT
+    try:
+        if "-u" in args:
+            server_url = args[args.index("-u") + 1]
+        if "--port" in args:
+            port = int(args[args.index("--port") + 1])
+        if "--host" in args:
+            host = args[args.index("--host") + 1]
+    except (IndexError, ValueError):
+        print("❌ Errore: opzioni non valide (vedi --help)")
+        return
+
+    controller = ProfessionalIrrigationController(server_url)
+    http_server = None
+    try:
+        print("🔌 Connessione al server OPC-UA...")
+        await controller.connect()
+        mirror = StateMirror(controller)
+        started = time.perf_counter()
+        await mirror.start()
+        print(f"🪞 Specchio di {len(mirror.valves)} valvole pronto in {time.perf_counter() - started:.2f}s")
+        gateway = HttpGateway(mirror, controller)
+        http_server = await gateway.serve(host, port)
+        print(f"🌐 Gateway HTTP su http://{host}:{port}/state (Ctrl+C per uscire)")
+        await http_server.serve_forever()
+    except ConnectionError:
+        print("❌ Impossibile connettersi al server OPC-UA")
+    except OSError as e:
+        print(f"❌ Errore: {e}")
+    finally:
+        if http_server is not None:
+            http_server.close()
+        try:
+            await controller.disconnect()
+        except Exception:
+            pass
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n🛑 Gateway fermato")
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Statistiche incrementali di irrigazione per valvola e per stazione
+
+Alimentate dai cambi di stato di IsIrrigating (notifiche della sottoscrizione del
+monitor o letture successive): ogni evento costa O(1), la storia non viene mai
+riletta. Per ogni valvola e stazione:
+    - numero di irrigazioni (avvii osservati)
+    - tempo di irrigazione cumulativo (irrigazione in corso compresa)
+    - duty cycle su finestre mobili di 1 ora e 24 ore
+    - durata media delle irrigazioni concluse
+
+Le finestre mobili tengono le irrigazioni concluse in una deque ordinata con la
+somma delle durate: le irrigazioni uscite dalla finestra vengono scartate dalla
+testa (O(1) ammortizzato) e solo la più vecchia può essere tagliata dal bordo.
+Questo vale perché le finestre sono per valvola, dove le irrigazioni non si
+sovrappongono; il duty cycle di una stazione somma le finestre delle sue valvole.
+"""
+
+import collections
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Finestre del duty cycle: etichetta → secondi
+DUTY_WINDOWS = {"1h": 3600.0, "24h": 86400.0}
+
+class SlidingRunWindow:
+    """Tempo di irrigazione negli ultimi `seconds` secondi (irrigazioni concluse, non sovrapposte)"""
+
+    __slots__ = ("seconds", "runs", "total")
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.runs = collections.deque()
+        self.total = 0.0
+
+    def add(self, start: float, end: float):
+        self.runs.append((start, end))
+        self.total += end - start
+
+    def busy(self, now: float) -> float:
+        """Secondi di irrigazione conclusa dentro la finestra che termina in `now`"""
+        window_start = now - self.seconds
+        runs = self.runs
+        while runs and runs[0][1] <= window_start:
+            start, end = runs.popleft()
+            self.total -= end - start
+        if not runs:
+            self.total = 0.0
+            return 0.0
+        # Solo l'irrigazione più vecchia può iniziare prima del bordo della finestra
+        return self.total - max(0.0, window_start - runs[0][0])
+
+class RunStats:
+    """Contatori di una valvola o (aggregati) di una stazione"""
+
+    __slots__ = ("count", "completed", "runtime", "windows")
+
+    def __init__(self, windowed: bool = True):
+        self.count = 0
+        self.completed = 0
+        self.runtime = 0.0
+        # Solo le valvole: le irrigazioni delle valvole di una stazione si sovrappongono
+        self.windows = ({label: SlidingRunWindow(seconds) for label, seconds in DUTY_WINDOWS.items()}
+                        if windowed else {})
+
+    def run_finished(self, start: float, end: float):
+        self.completed += 1
+        self.runtime += end - start
+        for window in self.windows.values():
+            window.add(start, end)
+
+    def average_duration(self) -> float:
+        return self.runtime / self.completed if self.completed else 0.0
+
+class IrrigationStatistics:
+    """Statistiche per valvola e per stazione aggiornate a ogni cambio di stato"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.valves: Dict[str, RunStats] = {}
+        self.stations: Dict[str, RunStats] = {}
+        # Valvole per stazione (finestre e denominatore del duty cycle di stazione)
+        self.station_valves: Dict[str, int] = collections.Counter()
+        self._valves_by_station: Dict[str, List[RunStats]] = collections.defaultdict(list)
+        # full_valve_id → inizio dell'irrigazione in corso, e valvole aperte per stazione
+        self._open: Dict[str, float] = {}
+        self._open_by_station: Dict[str, set] = collections.defaultdict(set)
+        # Stato noto (None = valvola mai osservata)
+        self._state: Dict[str, bool] = {}
+
+    def _valve(self, full_valve_id: str) -> Tuple[RunStats, RunStats]:
+        stats = self.valves.get(full_valve_id)
+        station_id = full_valve_id.split("_", 1)[0]
+        if stats is None:
+            stats = self.valves[full_valve_id] = RunStats()
+            self.station_valves[station_id] += 1
+            self._valves_by_station[station_id].append(stats)
+            if station_id not in self.stations:
+                self.stations[station_id] = RunStats(windowed=False)
+        return stats, self.stations[station_id]
+
+    def observe(self, full_valve_id: str, irrigating: bool, now: Optional[float] = None):
+        """Stato osservato di una valvola; solo le transizioni modificano le statistiche"""
+        irrigating = bool(irrigating)
+        previous = self._state.get(full_valve_id)
+        if previous == irrigating:
+            return
+        now = time.time() if now is None else now
+        valve, station = self._valve(full_valve_id)
+        station_id = full_valve_id.split("_", 1)[0]
+        self._state[full_valve_id] = irrigating
+        if irrigating:
+            # Una valvola già aperta alla prima osservazione conta dal momento in cui la vediamo
+            valve.count += 1
+            station.count += 1
+            self._open[full_valve_id] = now
+            self._open_by_station[station_id].add(full_valve_id)
+        elif previous:
+            self._open_by_station[station_id].discard(full_valve_id)
+            start = self._open.pop(full_valve_id, now)
+            valve.run_finished(start, now)
+            station.run_finished(start, now)
+
+    def _open_time(self, valve_ids, now: float, since: float) -> float:
+        return sum(now - max(self._open[valve_id], since) for valve_id in valve_ids if valve_id in self._open)
+
+    def _summary(self, stats: RunStats, members: List[RunStats], valve_ids, valve_count: int, now: float) -> Dict:
+        # Le finestre non possono superare il periodo di osservazione
+        observed = max(now - self.started_at, 1e-9)
+        summary = {
+            "count": stats.count,
+            "runtime": stats.runtime + self._open_time(valve_ids, now, 0.0),
+            "average_duration": stats.average_duration(),
+        }
+        for label, seconds in DUTY_WINDOWS.items():
+            span = min(seconds, observed)
+            busy = (sum(member.windows[label].busy(now) for member in members)
+                    + self._open_time(valve_ids, now, now - seconds))
+            summary[f"duty_{label}"] = min(1.0, busy / (span * max(1, valve_count)))
+        return summary
+
+    def valve_summary(self, full_valve_id: str, now: Optional[float] = None) -> Optional[Dict]:
+        stats = self.valves.get(full_valve_id)
+        if stats is None:
+            return None
+        return self._summary(stats, [stats], (full_valve_id,), 1, time.time() if now is None else now)
+
+    def station_summary(self, station_id: str, now: Optional[float] = None) -> Optional[Dict]:
+        stats = self.stations.get(station_id)
+        if stats is None:
+            return None
+        # Valvole aperte della stazione: al più valve_count elementi, non la storia
+        return self._summary(stats, self._valves_by_station[station_id], self._open_by_station.get(station_id, ()),
+                             self.station_valves[station_id], time.time() if now is None else now)
+
+def format_duration(seconds: float) -> str:
+    hours, rest = divmod(int(seconds), 3600)
+    mins, secs = divmod(rest, 60)
+    return f"{hours}:{mins:02d}:{secs:02d}" if hours else f"{mins:02d}:{secs:02d}"
+
+def format_summary(summary: Dict) -> str:
+    """Riga compatta per la visualizzazione del monitor"""
+    duty = " ".join(f"{label} {summary[f'duty_{label}'] * 100:.0f}%" for label in DUTY_WINDOWS)
+    return (f"{summary['count']} irrigazioni, {format_duration(summary['runtime'])} totali, "
+            f"media {format_duration(summary['average_duration'])}, duty {duty}")
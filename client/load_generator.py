@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Generatore di carico: molte sessioni di controllo concorrenti sul server reale
+
+Apre N sessioni ProfessionalIrrigationController verso il server, ciascuna con
+una sottoscrizione allo stato IsIrrigating delle proprie valvole, e invia comandi
+start/stop casuali a un rate complessivo fissato (arrivi di Poisson). Per ogni
+comando che deve cambiare lo stato misura il tempo fino alla notifica del
+cambiamento; alla fine stampa percentili di latenza e tassi di errore.
+
+Le valvole sono ripartite tra le sessioni (con più sessioni che valvole alcune
+valvole sono condivise): ogni sessione comanda solo le proprie.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from typing import Dict, List, Optional
+
+from asyncua import ua
+
+from control_client import ProfessionalIrrigationController
+
+logging.basicConfig(level=logging.ERROR)
+
+class LoadStats:
+    """Contatori e latenze dell'intera prova"""
+
+    def __init__(self):
+        self.sessions = 0
+        self.connect_errors = 0
+        self.commands = 0
+        self.starts = 0
+        self.stops = 0
+        self.command_errors = 0
+        self.timeouts = 0
+        self.latencies_ms: List[float] = []
+        # full_valve_id → (istante dell'invio, stato IsIrrigating atteso)
+        self.pending: Dict[str, tuple] = {}
+
+    def observe(self, full_valve_id: str, is_irrigating: bool):
+        pending = self.pending.get(full_valve_id)
+        if pending is not None and pending[1] == is_irrigating:
+            del self.pending[full_valve_id]
+            self.latencies_ms.append((time.monotonic() - pending[0]) * 1000.0)
+
+    def expire(self, timeout: float):
+        """Conta come timeout i comandi senza cambiamento di stato entro timeout secondi"""
+        deadline = time.monotonic() - timeout
+        for full_valve_id, (sent_at, _) in list(self.pending.items()):
+            if sent_at < deadline:
+                del self.pending[full_valve_id]
+                self.timeouts += 1
+
+    def report(self, elapsed: float) -> Dict:
+        latencies = sorted(self.latencies_ms)
+
+        def percentile(q: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(round(q * (len(latencies) - 1))))], 2)
+
+        errors = self.command_errors + self.timeouts
+        return {
+            "sessions": self.sessions,
+            "connect_errors": self.connect_errors,
+            "elapsed_s": round(elapsed, 2),
+            "commands": self.commands,
+            "starts": self.starts,
+            "stops": self.stops,
+            "rate_per_s": round(self.commands / elapsed, 2) if elapsed > 0 else 0.0,
+            "status_changes": len(latencies),
+            "latency_ms": {
+                "p50": percentile(0.50),
+                "p90": percentile(0.90),
+                "p99": percentile(0.99),
+                "max": round(latencies[-1], 2) if latencies else None,
+            },
+            "command_errors": self.command_errors,
+            "timeouts": self.timeouts,
+            "error_rate": round(errors / self.commands, 4) if self.commands else 0.0,
+        }
+
+class StatusHandler:
+    """Handler della sottoscrizione di una sessione: aggiorna lo stato osservato"""
+
+    def __init__(self, session: "LoadSession"):
+        self.session = session
+
+    def datachange_notification(self, node, val, data):
+        full_valve_id = self.session.valve_by_node.get(node.nodeid)
+        if full_valve_id is not None:
+            self.session.observed[full_valve_id] = bool(val)
+            self.session.stats.observe(full_valve_id, bool(val))
+
+class LoadSession:
+    """Una sessione di controllo con le sue valvole"""
+
+    def __init__(self, controller: ProfessionalIrrigationController, valves: List[str], stats: LoadStats):
+        self.controller = controller
+        self.valves = valves
+        self.stats = stats
+        self.observed: Dict[str, bool] = {}
+        self.valve_by_node: Dict[ua.NodeId, str] = {}
+        self.subscription = None
+
+    async def subscribe(self, publishing_ms: int):
+        self.subscription = await self.controller.client.create_subscription(publishing_ms, StatusHandler(self))
+        nodes = []
+        for full_valve_id in self.valves:
+            node = self.controller.nodes[full_valve_id]["irrigating"]
+            self.valve_by_node[node.nodeid] = full_valve_id
+            nodes.append(node)
+        await self.subscription.subscribe_data_change(nodes)
+
+    async def issue(self, rng: random.Random, start_ratio: float, min_duration: int, max_duration: int):
+        """Invia un comando casuale che cambia lo stato di una valvola della sessione"""
+        want_start = rng.random() < start_ratio
+        idle = [v for v in self.valves if not self.observed.get(v, False) and v not in self.stats.pending]
+        busy = [v for v in self.valves if self.observed.get(v, False) and v not in self.stats.pending]
+        if want_start and not idle or not want_start and not busy:
+            want_start = not want_start
+        candidates = idle if want_start else busy
+        if not candidates:
+            return
+        full_valve_id = rng.choice(candidates)
+
+        self.stats.commands += 1
+        self.stats.pending[full_valve_id] = (time.monotonic(), want_start)
+        if want_start:
+            self.stats.starts += 1
+            ok = await self.controller.start_irrigation(full_valve_id, rng.randint(min_duration, max_duration))
+        else:
+            self.stats.stops += 1
+            ok = await self.controller.stop_irrigation(full_valve_id)
+        if not ok:
+            self.stats.command_errors += 1
+            self.stats.pending.pop(full_valve_id, None)
+
+def clone_nodes(source: ProfessionalIrrigationController, target: ProfessionalIrrigationController):
+    """Copia i nodi scoperti da una sessione in un'altra (stessi NodeId, client diverso)"""
+    client = target.client
+    target.ns_idx = source.ns_idx
+    target.nodes["system_state"] = client.get_node(source.nodes["system_state"].nodeid)
+    for full_valve_id, valve in source.nodes.items():
+        if full_valve_id == "system_state":
+            continue
+        target.nodes[full_valve_id] = {
+            key: client.get_node(value.nodeid) if hasattr(value, "nodeid") else value
+            for key, value in valve.items()
+        }
+
+async def open_sessions(server_url: str, count: int, max_valves: Optional[int], publishing_ms: int,
+                        stats: LoadStats, connect_concurrency: int = 20) -> List[LoadSession]:
+    """Apre le sessioni: la prima scopre i nodi, le altre li riusano"""
+    first = ProfessionalIrrigationController(server_url, quiet=True, auto_reconnect=False)
+    await first.connect()
+    valve_ids = [v for v in first.nodes if v != "system_state"]
+    if max_valves is not None:
+        valve_ids = valve_ids[:max_valves]
+    if not valve_ids:
+        raise RuntimeError("nessuna valvola trovata nel server")
+
+    # Il sistema deve essere acceso perché i comandi abbiano effetto
+    await first.set_system_state(True)
+
+    controllers: List[Optional[ProfessionalIrrigationController]] = [first]
+    semaphore = asyncio.Semaphore(connect_concurrency)
+
+    async def connect_one() -> Optional[ProfessionalIrrigationController]:
+        controller = ProfessionalIrrigationController(server_url, quiet=True, auto_reconnect=False)
+        async with semaphore:
+            try:
+                await controller.client.connect()
+            except Exception:
+                stats.connect_errors += 1
+                return None
+        clone_nodes(first, controller)
+        return controller
+
+    controllers += await asyncio.gather(*(connect_one() for _ in range(count - 1)))
+    controllers = [c for c in controllers if c is not None]
+
+    sessions = []
+    for index, controller in enumerate(controllers):
+        if len(controllers) <= len(valve_ids):
+            valves = valve_ids[index::len(controllers)]
+        else:
+            valves = [valve_ids[index % len(valve_ids)]]
+        sessions.append(LoadSession(controller, valves, stats))
+    for session in sessions:
+        await session.subscribe(publishing_ms)
+    stats.sessions = len(sessions)
+    return sessions
+
+async def run_session(session: LoadSession, rate: float, until: float, seed: int,
+                      start_ratio: float, min_duration: int, max_duration: int):
+    """Comandi della sessione con intervalli esponenziali (rate comandi/s)"""
+    rng = random.Random(seed)
+    while True:
+        delay = rng.expovariate(rate)
+        if time.monotonic() + delay >= until:
+            return
+        await asyncio.sleep(delay)
+        await session.issue(rng, start_ratio, min_duration, max_duration)
+
+async def run_load(server_url: str, sessions_count: int, rate: float, duration: float,
+                   start_ratio: float = 0.6, min_duration: int = 30, max_duration: int = 300,
+                   max_valves: Optional[int] = None, publishing_ms: int = 100, timeout: float = 10.0,
+                   seed: int = 1) -> Dict:
+    """Esegue la prova di carico e restituisce il report"""
+    stats = LoadStats()
+    print(f"🔌 Apertura di {sessions_count} sessioni verso {server_url}...")
+    sessions = await open_sessions(server_url, sessions_count, max_valves, publishing_ms, stats)
+    print(f"✅ {stats.sessions} sessioni attive ({stats.connect_errors} connessioni fallite)")
+
+    # Lascia arrivare le notifiche iniziali (stato corrente delle valvole)
+    await asyncio.sleep(publishing_ms / 1000.0 * 3)
+
+    print(f"🚀 Carico: {rate} comandi/s per {duration}s")
+    started = time.monotonic()
+    until = started + duration
+    per_session = rate / len(sessions)
+
+    async def expire_loop():
+        while time.monotonic() < until + timeout:
+            await asyncio.sleep(0.5)
+            stats.expire(timeout)
+
+    expirer = asyncio.create_task(expire_loop())
+    await asyncio.gather(*(
+        run_session(session, per_session, until, seed + index, start_ratio, min_duration, max_duration)
+        for index, session in enumerate(sessions)
+    ))
+    elapsed = time.monotonic() - started
+
+    # Attendi le ultime notifiche (o il timeout dei comandi ancora in sospeso)
+    drain_until = time.monotonic() + timeout
+    while stats.pending and time.monotonic() < drain_until:
+        await asyncio.sleep(0.1)
+    stats.expire(0)
+    expirer.cancel()
+
+    for session in sessions:
+        try:
+            await session.controller.client.disconnect()
+        except Exception:
+            pass
+    return stats.report(elapsed)
+
+def print_report(report: Dict):
+    latency = report["latency_ms"]
+    print("\n📊 Risultati")
+    print(f"   Sessioni: {report['sessions']} (connessioni fallite: {report['connect_errors']})")
+    print(f"   Comandi: {report['commands']} ({report['starts']} start, {report['stops']} stop) "
+          f"in {report['elapsed_s']}s = {report['rate_per_s']}/s")
+    print(f"   Cambi di stato osservati: {report['status_changes']}")
+    if latency["p50"] is not None:
+        print(f"   Latenza comando → stato: p50 {latency['p50']}ms, p90 {latency['p90']}ms, "
+              f"p99 {latency['p99']}ms, max {latency['max']}ms")
+    print(f"   Errori: {report['command_errors']} comandi, {report['timeouts']} timeout "
+          f"(tasso {report['error_rate'] * 100:.2f}%)")
+
+def print_help():
+    print("""
+🌱 Load Generator - Sessioni di controllo concorrenti
+
+UTILIZZO:
+    python client/load_generator.py [OPZIONI]
+
+OPZIONI:
+    -h, --help          Mostra questo messaggio di aiuto
+    -u URL              URL del server OPC-UA (default: opc.tcp://localhost:48400/irrigation)
+    -n SESSIONI         Numero di sessioni concorrenti (default: 200)
+    -r RATE             Comandi al secondo complessivi (default: 20)
+    -d SECONDI          Durata della prova (default: 60)
+    --start-ratio R     Frazione di comandi start sul totale (default: 0.6)
+    --valves N          Usa solo le prime N valvole
+    --publish-ms MS     Intervallo di pubblicazione delle sottoscrizioni (default: 100)
+    --timeout SECONDI   Attesa massima del cambio di stato (default: 10)
+    --seed N            Seme dei numeri casuali (default: 1)
+    -o FILE             Salva il report in JSON
+
+ESEMPIO:
+    python client/load_generator.py -n 200 -r 50 -d 120 -o load.json
+    """)
+
+async def main():
+    """Funzione principale"""
+    args = sys.argv[1:]
+    if "-h" in args or "--help" in args:
+        print_help()
+        return
+
+    options = {"-u": "opc.tcp://localhost:48400/irrigation", "-n": 200, "-r": 20.0, "-d": 60.0,
+               "--start-ratio": 0.6, "--valves": None, "--publish-ms": 100, "--timeout": 10.0,
+               "--seed": 1, "-o": None}
+    types = {"-n": int, "-r": float, "-d": float, "--start-ratio": float, "--valves": int,
+             "--publish-ms": int, "--timeout": float, "--seed": int}
+    for option in options:
+        if option in args:
+            try:
+                value = args[args.index(option) + 1]
+                options[option] = types.get(option, str)(value)
+            except (ValueError, IndexError):
+                print(f"❌ Errore: valore non valido dopo {option}")
+                return
+    if options["-n"] < 1 or options["-r"] <= 0:
+        print("❌ Errore: servono almeno una sessione e un rate positivo")
+        return
+
+    try:
+        report = await run_load(options["-u"], options["-n"], options["-r"], options["-d"],
+                                start_ratio=options["--start-ratio"], max_valves=options["--valves"],
+                                publishing_ms=options["--publish-ms"], timeout=options["--timeout"],
+                                seed=options["--seed"])
+    except (OSError, RuntimeError) as e:
+        print(f"❌ Errore: {e}")
+        return
+
+    print_report(report)
+    if options["-o"]:
+        with open(options["-o"], "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Report salvato in {options['-o']}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
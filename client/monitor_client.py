@@ -4,26 +4,117 @@ Monitor client professionale per il server con ObjectTypes
 """
 
 import asyncio
+import collections
 import logging
 import os
+import sys
+import time
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
 
-from asyncua import Client
+from asyncua import ua
+from asyncua.client.ua_client import UaClientState
 from asyncua.common.node import Node
 
+# Moduli condivisi con il server (configurazione ed endpoint OpenMetrics)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.server_config import ALERT_CONFIG, VALVE_CONFIG
+from server.openmetrics import Histogram, MetricsRegistry, labels, serve_metrics
+from alert_rules import AlertEngine, default_rules
+from irrigation_stats import IrrigationStatistics, format_summary
+from session_recovery import SessionRecovery, recovering_client
+from control_client import ProfessionalIrrigationController
+from fleet_controller import load_sites
+from session_replay import SessionReplay
+from state_mirror import StateMirror
+
 # Configurazione logging
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
+# Limiti (ms) dell'istogramma della durata di una lettura completa dello stato
+REFRESH_HISTOGRAM_BOUNDS_MS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+class MonitorMetrics:
+    """
+    Metriche del monitor per l'endpoint OpenMetrics, aggiornate durante le letture:
+    una serie viene riscritta solo quando il valore letto cambia.
+    """
+    
+    def __init__(self, flow_rate: float = VALVE_CONFIG["water_flow_rate"]):
+        self.flow_rate = flow_rate  # litri/minuto
+        registry = self.registry = MetricsRegistry()
+        self.irrigating = registry.gauge("irrigation_monitor_valve_irrigating", "Valvola in irrigazione (1) o ferma (0)")
+        self.remaining = registry.gauge("irrigation_monitor_valve_remaining_seconds", "Tempo di irrigazione rimanente",
+                                        unit="seconds")
+        self.water = registry.counter("irrigation_monitor_valve_water_liters",
+                                      "Acqua stimata dalle irrigazioni osservate", unit="liters")
+        self.refresh_histogram = Histogram(REFRESH_HISTOGRAM_BOUNDS_MS)
+        registry.histogram("irrigation_monitor_refresh_duration_seconds", "Durata della lettura completa dello stato",
+                           self.refresh_histogram, unit="seconds", scale=0.001)
+        self.reads = 0
+        registry.counter_callback("irrigation_monitor_opcua_reads", "Letture OPC-UA inviate al server",
+                                  lambda: self.reads)
+        self.reconnects = 0
+        registry.counter_callback("irrigation_monitor_reconnects", "Riconnessioni al server riuscite",
+                                  lambda: self.reconnects)
+        # full_valve_id → [etichette, (irrigating, remaining) pubblicati, litri, istante dell'ultima lettura se aperta]
+        self._valves: Dict[str, list] = {}
+        self._refresh_start = 0.0
+    
+    def begin_refresh(self):
+        self._refresh_start = time.perf_counter()
+    
+    def end_refresh(self):
+        self.refresh_histogram.observe((time.perf_counter() - self._refresh_start) * 1000.0)
+    
+    def valve_observed(self, full_valve_id: str, is_irrigating: bool, remaining_time: int):
+        entry = self._valves.get(full_valve_id)
+        if entry is None:
+            station_id, valve_id = full_valve_id.split("_", 1)
+            entry = self._valves[full_valve_id] = [labels(station=station_id, valve=valve_id), None, 0.0, None]
+            self.water.set(entry[0], 0.0)
+        label_set, published, liters, opened_at = entry
+        now = time.monotonic()
+        if opened_at is not None:
+            entry[2] = liters + self.flow_rate * (now - opened_at) / 60.0
+            self.water.set(label_set, round(entry[2], 3))
+        entry[3] = now if is_irrigating else None
+        state = (bool(is_irrigating), remaining_time)
+        if state != published:
+            entry[1] = state
+            self.irrigating.set(label_set, state[0])
+            self.remaining.set(label_set, remaining_time)
+
 class ProfessionalIrrigationMonitor:
     """Monitor per il server professionale con ObjectTypes"""
     
-    def __init__(self, server_url: str = "opc.tcp://localhost:48400/irrigation"):
+    def __init__(self, server_url: str = "opc.tcp://localhost:48400/irrigation",
+                 metrics_port: Optional[int] = None, max_open_valves: int = ALERT_CONFIG["max_open_valves"]):
         self.server_url = server_url
-        self.client = Client(server_url)
+        # Riconnessione automatica con backoff; dopo il ripristino basta una Read in blocco
+        self.client = recovering_client(server_url)
+        self.recovery: Optional[SessionRecovery] = None
         self.ns_idx = None
         self.nodes: Dict[str, Node] = {}
+        self.station_ids: List[str] = []
+        # Nodi non più noti al server nell'ultima lettura (installazione cambiata)
+        self.stale_nodes = False
+        
+        # Statistiche per valvola/stazione dai cambi di stato (sottoscrizione + letture)
+        self.stats = IrrigationStatistics()
+        self._stats_subscription = None
+        self._irrigating_nodeids: Dict = {}
+        
+        # Allarmi valutati in modo incrementale sulle stesse transizioni delle statistiche
+        self.alerts = AlertEngine(default_rules(VALVE_CONFIG["max_duration"], max_open_valves,
+                                                ALERT_CONFIG["station_watering_deadline"]))
+        
+        # Endpoint OpenMetrics opzionale
+        self.metrics_port = metrics_port
+        self.metrics: Optional[MonitorMetrics] = MonitorMetrics() if metrics_port is not None else None
+        self._metrics_http: Optional[asyncio.AbstractServer] = None
         
     async def connect(self):
         """Connette al server"""
@@ -45,6 +136,14 @@ class ProfessionalIrrigationMonitor:
             await self._discover_nodes()
             print("✅ Sistema professionale di irrigazione scoperto")
             
+            if self.recovery is None:
+                self.recovery = SessionRecovery(self.client, self.resync)
+                self.recovery.start()
+            
+            if self.metrics is not None and self._metrics_http is None:
+                self._metrics_http = await serve_metrics(self.metrics.registry, self.metrics_port)
+                print(f"📈 Metriche OpenMetrics su http://127.0.0.1:{self.metrics_port}/metrics")
+            
         except Exception as e:
             print(f"❌ Errore durante la connessione: {e}")
             raise
@@ -64,13 +163,11 @@ class ProfessionalIrrigationMonitor:
         # Stations folder
         stations_folder = await irrigation_system.get_child([f"{self.ns_idx}:Stations"])
         
-        # Stazioni
-        station_ids = ["Station1", "Station2", "Station3"]
-        
-        for station_id in station_ids:
+        # Stazioni: quelle presenti nel server (l'installazione può essere configurata)
+        self.station_ids = []
+        for station_node in await stations_folder.get_children():
+            station_id = (await station_node.read_browse_name()).Name
             try:
-                station_node = await stations_folder.get_child([f"{self.ns_idx}:{station_id}"])
-                
                 # StationInfo
                 station_info = await station_node.get_child([f"{self.ns_idx}:StationInfo"])
                 station_desc = await (await station_info.get_child([f"{self.ns_idx}:Description"])).read_value()
@@ -108,24 +205,38 @@ class ProfessionalIrrigationMonitor:
                         
                     except:
                         pass  # Valvola non trovata
-                        
+                
+                self.station_ids.append(station_id)
             except:
-                pass  # Stazione non trovata
+                pass  # Non è una stazione
                 
     async def read_system_status(self) -> Dict:
-        """Legge lo stato completo del sistema professionale"""
+        """Legge lo stato completo del sistema professionale (una sola richiesta Read)"""
         status = {}
+        if self.metrics is not None:
+            self.metrics.begin_refresh()
+        
+        # Nodi da leggere: stato sistema + (IsIrrigating, Mode, RemainingTime) per valvola
+        nodes = [self.nodes["system_state"]]
+        valves = []
+        for station_id in self.station_ids:
+            if f"{station_id}_info" in self.nodes:
+                for valve_num in range(1, self.nodes[f"{station_id}_info"]["valve_count"] + 1):
+                    full_valve_id = f"{station_id}_Valve{valve_num}"
+                    if f"{full_valve_id}_irrigating" in self.nodes:
+                        valves.append((station_id, f"Valve{valve_num}", full_valve_id))
+                        nodes += [self.nodes[f"{full_valve_id}_irrigating"], self.nodes[f"{full_valve_id}_mode"],
+                                  self.nodes[f"{full_valve_id}_remaining"]]
+        values = await self.client.read_attributes(nodes)
+        self.stale_nodes = any(value.StatusCode.value == ua.StatusCodes.BadNodeIdUnknown for value in values)
         
         # Stato sistema
-        system_on = await self.nodes["system_state"].read_value()
-        status["system"] = {"on": system_on}
+        status["system"] = {"on": values[0].Value.Value if values[0].StatusCode.is_good() else False}
         
         # Stazioni
         status["stations"] = {}
         
-        station_ids = ["Station1", "Station2", "Station3"]
-        
-        for station_id in station_ids:
+        for station_id in self.station_ids:
             if f"{station_id}_info" in self.nodes:
                 station_info = self.nodes[f"{station_id}_info"]
                 
@@ -135,32 +246,66 @@ class ProfessionalIrrigationMonitor:
                     "valve_count": station_info["valve_count"],
                     "valves": {}
                 }
-                
-                # Valvole della stazione
-                for valve_num in range(1, station_info["valve_count"] + 1):
-                    valve_id = f"Valve{valve_num}"
-                    full_valve_id = f"{station_id}_{valve_id}"
-                    
-                    if f"{full_valve_id}_irrigating" in self.nodes:
-                        try:
-                            description = await self.nodes[f"{full_valve_id}_description"].read_value()
-                            is_irrigating = await self.nodes[f"{full_valve_id}_irrigating"].read_value()
-                            mode = await self.nodes[f"{full_valve_id}_mode"].read_value()
-                            remaining_time = await self.nodes[f"{full_valve_id}_remaining"].read_value()
-                            
-                            status["stations"][station_id]["valves"][valve_id] = {
-                                "description": description,
-                                "irrigating": is_irrigating,
-                                "mode": mode,
-                                "remaining_time": remaining_time
-                            }
-                        except:
-                            pass
-                    
+        
+        # Valvole delle stazioni
+        for index, (station_id, valve_id, full_valve_id) in enumerate(valves):
+            valve_values = values[1 + 3 * index:4 + 3 * index]
+            if not all(value.StatusCode.is_good() for value in valve_values):
+                continue
+            is_irrigating, mode, remaining_time = (value.Value.Value for value in valve_values)
+            
+            status["stations"][station_id]["valves"][valve_id] = {
+                # Descrizione letta una volta in _discover_nodes
+                "description": self.nodes[f"{full_valve_id}_description"],
+                "irrigating": is_irrigating,
+                "mode": mode,
+                "remaining_time": remaining_time
+            }
+            if self.metrics is not None:
+                self.metrics.valve_observed(full_valve_id, is_irrigating, remaining_time)
+            self.stats.observe(full_valve_id, is_irrigating)
+            self.alerts.observe(full_valve_id, "irrigating", is_irrigating)
+        
+        if self.metrics is not None:
+            self.metrics.reads += len(nodes)
+            self.metrics.end_refresh()
         return status
+    
+    async def resync(self) -> int:
+        """
+        Dopo una riconnessione: stato completo con una Read in blocco sui nodi in cache;
+        l'AddressSpace viene riscoperto solo se il server non li conosce più.
+        """
+        await self.read_system_status()
+        if self.stale_nodes:
+            self.nodes = {}
+            await self._discover_nodes()
+            await self.read_system_status()
+            print("🔍 Installazione cambiata: nodi riscoperti")
+        if self.metrics is not None:
+            self.metrics.reconnects += 1
+        return 1 + 3 * sum(1 for key in self.nodes if key.endswith("_irrigating"))
         
-    def format_status_display(self, status: Dict) -> str:
-        """Formatta lo stato per la visualizzazione professionale"""
+    async def subscribe_statistics(self, publishing_ms: int = 500):
+        """Sottoscrive IsIrrigating di tutte le valvole: le statistiche seguono ogni transizione"""
+        self._irrigating_nodeids = {self.nodes[key].nodeid: key[:-len("_irrigating")]
+                                    for key in self.nodes if key.endswith("_irrigating")}
+        if not self._irrigating_nodeids:
+            return
+        self._stats_subscription = await self.client.create_subscription(publishing_ms, self)
+        await self._stats_subscription.subscribe_data_change(
+            [self.client.get_node(nodeid) for nodeid in self._irrigating_nodeids])
+    
+    def datachange_notification(self, node, value, data):
+        """Handler della sottoscrizione (O(1) per notifica)"""
+        full_valve_id = self._irrigating_nodeids.get(node.nodeid)
+        if full_valve_id is not None:
+            self.stats.observe(full_valve_id, value)
+            self.alerts.observe(full_valve_id, "irrigating", value)
+    
+    def format_status_display(self, status: Dict, now: Optional[float] = None) -> str:
+        """Formatta lo stato per la visualizzazione professionale (now: ora delle statistiche)"""
+        now = time.time() if now is None else now
         output = []
         output.append("=" * 80)
         output.append("        🌱 SISTEMA IRRIGAZIONE PROFESSIONALE - ObjectTypes 🌱")
@@ -171,6 +316,14 @@ class ProfessionalIrrigationMonitor:
         output.append(f"🏠 Sistema: {system_state}")
         output.append("")
         
+        # Allarmi attivi e ultimi rientrati
+        if self.alerts.active or self.alerts.history:
+            for alert in sorted(self.alerts.active.values(), key=lambda alert: alert.raised_at):
+                output.append(f"🚨 {alert.message} (dalle {datetime.fromtimestamp(alert.raised_at):%H:%M:%S})")
+            for alert in list(self.alerts.history)[-3:]:
+                output.append(f"✅ Rientrato alle {datetime.fromtimestamp(alert.cleared_at):%H:%M:%S}: {alert.message}")
+            output.append("")
+        
         # Architettura
         output.append("🏗️  Architettura: IrrigationSystem → Controller + Stations → StationX → ValveY")
         output.append("🔧 ObjectTypes: IrrigationSystemType, IrrigationStationType, IrrigationValveType")
@@ -183,6 +336,9 @@ class ProfessionalIrrigationMonitor:
                 
             output.append(f"📁 {station_id} - {station_data['description']}")
             output.append(f"   Tipo: {station_data['type']} ({station_data['valve_count']} valvole)")
+            station_stats = self.stats.station_summary(station_id, now)
+            if station_stats is not None:
+                output.append(f"   📈 {format_summary(station_stats)}")
             output.append("-" * 70)
             
             for valve_id, valve_data in station_data["valves"].items():
@@ -209,9 +365,15 @@ class ProfessionalIrrigationMonitor:
                 if valve_data["irrigating"]:
                     mins, secs = divmod(valve_data["remaining_time"], 60)
                     output.append(f"      ⏱️  Tempo rimanente: {mins:02d}:{secs:02d}")
+                
+                valve_stats = self.stats.valve_summary(f"{station_id}_{valve_id}", now)
+                if valve_stats is not None:
+                    output.append(f"      📈 {format_summary(valve_stats)}")
                         
                 output.append("")
-                
+        
+        observed = now - self.stats.started_at
+        output.append(f"📈 Statistiche osservate dall'avvio del monitor ({observed / 60:.0f} min)")
         output.append("=" * 80)
         return "\n".join(output)
         
@@ -226,6 +388,8 @@ class ProfessionalIrrigationMonitor:
         print("   Premi Ctrl+C per uscire")
         print("")
         input("Premi INVIO per iniziare...")
+        await self.subscribe_statistics()
+        self.alerts.start()
         
         try:
             while True:
@@ -260,11 +424,212 @@ class ProfessionalIrrigationMonitor:
         now = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
         print(f"🕐 Stato letto il: {now}")
         
+    def _replay_status(self, replay: SessionReplay) -> Dict:
+        """Stato della registrazione nella forma di read_system_status"""
+        status = {"system": {"on": replay.system_on}, "stations": {}}
+        for full_valve_id, valve in replay.valves.items():
+            station = status["stations"].setdefault(valve["station"], {
+                "description": valve["description"].rsplit(" - Valvola", 1)[0], "valve_count": 0, "valves": {}})
+            station["valve_count"] += 1
+            station["type"] = "DoubleValve" if station["valve_count"] > 1 else "SingleValve"
+            station["valves"][valve["valve"]] = {
+                "description": valve["description"],
+                "irrigating": valve.get("irrigating", False),
+                "mode": valve.get("mode", "Off"),
+                "remaining_time": int(valve.get("remaining") or 0),
+            }
+        return status
+    
+    async def monitor_replay(self, path: str, speed: float, interval: int = 2):
+        """Riproduce una registrazione (session_replay.py) nella visualizzazione del monitor"""
+        replay = SessionReplay(path, speed)
+        # Statistiche sul tempo della registrazione, non su quello della riproduzione
+        self.stats = IrrigationStatistics()
+        self.stats.started_at = replay.started
+        for full_valve_id, valve in replay.valves.items():
+            self.stats.observe(full_valve_id, valve.get("irrigating", False), replay.started)
+        
+        async def observe(record: Dict):
+            for full_valve_id, values in record["valves"].items():
+                if "irrigating" in values:
+                    self.stats.observe(full_valve_id, values["irrigating"], record["ts"])
+        
+        playback = asyncio.create_task(replay.run(observe))
+        try:
+            while True:
+                self.clear_screen()
+                now = replay.now()
+                print(self.format_status_display(self._replay_status(replay), now))
+                recorded = datetime.fromtimestamp(now).strftime("%d/%m/%Y %H:%M:%S")
+                print(f"⏯️  Riproduzione {replay.speed:g}x di {path} ({replay.url})")
+                print(f"🕐 Ora registrata: {recorded} - {replay.applied} record applicati")
+                if playback.done():
+                    playback.result()
+                    print("⏹️  Registrazione terminata")
+                    break
+                await asyncio.wait([playback], timeout=interval)
+        finally:
+            playback.cancel()
+    
     async def disconnect(self):
         """Disconnette dal server"""
+        if self._metrics_http is not None:
+            self._metrics_http.close()
+        self.alerts.stop()
+        if self.recovery is not None:
+            await self.recovery.stop()
         await self.client.disconnect()
         print("✅ Disconnesso dal server")
 
+# Monitor multi-sito: oltre questi secondi senza Publish (nemmeno keep-alive) i dati sono "vecchi"
+STALE_AFTER = 5.0
+# Limite del backoff per i siti non raggiungibili all'avvio (secondi)
+SITE_RETRY_MAX_DELAY = 30.0
+
+class FanInMonitor:
+    """
+    Vista unica di più server: una sessione e una sottoscrizione per sito, tutte
+    nello stesso event loop. Lo stato di ogni sito è uno StateMirror aggiornato
+    dalle notifiche, quindi il disegno della vista non fa richieste ai server e
+    memoria e CPU crescono con il numero di valvole, non con la frequenza di refresh.
+    """
+
+    def __init__(self, sites: Dict[str, str], timeout: float = 5.0):
+        self.sites = sites
+        self.timeout = timeout
+        self.mirrors: Dict[str, Optional[StateMirror]] = {name: None for name in sites}
+        self.errors: Dict[str, str] = {}
+        # Siti per cui il primo tentativo di connessione si è concluso (riuscito o no)
+        self._attempted: Dict[str, asyncio.Event] = {name: asyncio.Event() for name in sites}
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        """Avvia la connessione di tutti i siti in parallelo (senza attenderla)"""
+        self._tasks = [asyncio.create_task(self._keep_site(name, url)) for name, url in self.sites.items()]
+
+    async def wait_ready(self, timeout: float) -> int:
+        """Attende il primo tentativo di connessione di ogni sito (al più `timeout`); ritorna i siti connessi"""
+        waits = [asyncio.create_task(event.wait()) for event in self._attempted.values()]
+        if waits:
+            await asyncio.wait(waits, timeout=timeout)
+            for wait in waits:
+                wait.cancel()
+        return sum(1 for mirror in self.mirrors.values() if mirror is not None)
+
+    async def _keep_site(self, name: str, url: str):
+        """Prima connessione con backoff; poi le riconnessioni sono del client (auto_reconnect)"""
+        delay = 1.0
+        while True:
+            controller = ProfessionalIrrigationController(url, quiet=True, timeout=self.timeout)
+            try:
+                await asyncio.wait_for(controller.connect(), self.timeout * 2)
+                mirror = StateMirror(controller, change_log=0, heartbeat=True)
+                await mirror.start()
+                self.mirrors[name] = mirror
+                self.errors.pop(name, None)
+                return
+            except Exception as e:
+                self.errors[name] = str(e) or type(e).__name__
+                try:
+                    await controller.disconnect()
+                except Exception:
+                    pass
+            finally:
+                self._attempted[name].set()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, SITE_RETRY_MAX_DELAY)
+
+    def site_health(self, name: str) -> Dict:
+        """Stato della connessione e secondi dall'ultima notizia del server"""
+        mirror = self.mirrors[name]
+        if mirror is None:
+            return {"state": "offline", "staleness": None, "error": self.errors.get(name, "connessione in corso")}
+        staleness = mirror.staleness()
+        if mirror.controller.client.state != UaClientState.CONNECTED:
+            state = "reconnecting"
+        elif staleness is not None and staleness > STALE_AFTER:
+            state = "stale"
+        else:
+            state = "connected"
+        return {"state": state, "staleness": staleness, "error": None}
+
+    def merged_state(self) -> Dict:
+        """Stato unificato sito → stazione → valvola (letto solo dagli specchi in memoria)"""
+        merged = {}
+        for name, mirror in self.mirrors.items():
+            site = {"url": self.sites[name], "health": self.site_health(name), "system_on": None, "stations": {}}
+            if mirror is not None:
+                site["system_on"] = mirror.system_on
+                for valve in mirror.valves.values():
+                    site["stations"].setdefault(valve["station"], {})[valve["valve"]] = valve
+            merged[name] = site
+        return merged
+
+    def format_display(self) -> str:
+        """Una riga per sito (salute, dati, valvole aperte) e una per stazione"""
+        icons = {"connected": "🟢", "stale": "🟡", "reconnecting": "🟠", "offline": "🔴"}
+        merged = self.merged_state()
+        output = ["=" * 80, f"        🌱 MONITOR MULTI-SITO - {len(merged)} siti 🌱", "=" * 80]
+        totals = collections.Counter()
+        for name, site in merged.items():
+            health = site["health"]
+            totals[health["state"]] += 1
+            if health["state"] == "offline":
+                output.append(f"{icons['offline']} {name} ({site['url']}): non raggiungibile - {health['error']}")
+                output.append("")
+                continue
+            valves = [valve for station in site["stations"].values() for valve in station.values()]
+            active = sum(1 for valve in valves if valve.get("irrigating"))
+            age = f"{health['staleness']:.1f}s fa" if health["staleness"] is not None else "mai"
+            system = "ACCESO" if site["system_on"] else "SPENTO"
+            state = {"connected": "aggiornato", "stale": "DATI VECCHI, aggiornato",
+                     "reconnecting": "RICONNESSIONE, dati di"}[health["state"]]
+            output.append(f"{icons[health['state']]} {name}: sistema {system}, "
+                          f"💧 {active}/{len(valves)} valvole in irrigazione ({state} {age})")
+            for station_id, station in sorted(site["stations"].items()):
+                cells = []
+                for valve_id, valve in sorted(station.items()):
+                    if valve.get("irrigating"):
+                        mins, secs = divmod(int(valve.get("remaining") or 0), 60)
+                        cells.append(f"💧{valve_id} {mins:02d}:{secs:02d}")
+                    elif valve.get("mode") == "Automatic":
+                        cells.append(f"⏰{valve_id}")
+                    else:
+                        cells.append(f"⭕{valve_id}")
+                output.append(f"   📁 {station_id}: " + "  ".join(cells))
+            output.append("")
+        summary = ", ".join(f"{icons[state]} {totals[state]}" for state in icons if totals[state])
+        output.append(f"📡 Siti: {summary}")
+        output.append("=" * 80)
+        return "\n".join(output)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await asyncio.gather(*(mirror.controller.disconnect() for mirror in self.mirrors.values()
+                               if mirror is not None), return_exceptions=True)
+
+async def monitor_sites(sites: Dict[str, str], single_mode: bool, interval: int):
+    """Monitor multi-sito: lettura singola o vista continua (Ctrl+C per uscire)"""
+    monitor = FanInMonitor(sites)
+    await monitor.start()
+    try:
+        print(f"🔌 Connessione a {len(sites)} siti...")
+        connected = await monitor.wait_ready(monitor.timeout * 2)
+        print(f"✅ {connected}/{len(sites)} siti connessi")
+        if single_mode:
+            print(monitor.format_display())
+            return
+        while True:
+            os.system('cls' if os.name == 'nt' else 'clear')
+            print(monitor.format_display())
+            now = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+            print(f"🕐 Ultimo aggiornamento: {now} (ogni {interval}s, Ctrl+C per uscire)")
+            await asyncio.sleep(interval)
+    finally:
+        await monitor.stop()
+
 def print_help():
     """Mostra l'help del programma"""
     print("""
@@ -278,7 +643,13 @@ OPZIONI:
     -s, --single        Esegue una lettura singola dello stato
     -c, --continuous    Monitoraggio continuo (default)
     -i INTERVAL         Intervallo di aggiornamento in secondi (default: 2)
-    -u URL              URL del server OPC-UA (default: opc.tcp://localhost:48400/irrigation)
+    -u URL              URL del server OPC-UA (default: opc.tcp://localhost:48400/irrigation);
+                        ripetuto per monitorare più server nella stessa vista
+    --sites FILE        Siti da file JSON (nome → URL, come fleet_controller.py)
+    --replay FILE       Riproduce una registrazione di session_replay.py (nessun server)
+    --speed N           Velocità della riproduzione, 1-1000 (default: 1)
+    --metrics-port PORT Espone le metriche OpenMetrics su http://127.0.0.1:PORT/metrics
+    --max-open N        Allarme se irrigano più di N valvole insieme (default: config ALERT_CONFIG)
 
 STRUTTURA PROFESSIONALE:
     IrrigationSystem/
@@ -296,6 +667,10 @@ ESEMPI:
     python professional_monitor_client.py                     # Monitoraggio continuo
     python professional_monitor_client.py -s                  # Lettura singola
     python professional_monitor_client.py -c -i 5             # Monitoraggio ogni 5 secondi
+    python professional_monitor_client.py -u opc.tcp://a:48400/irrigation -u opc.tcp://b:48400/irrigation
+                                                              # Vista multi-sito
+    python professional_monitor_client.py --replay sessione.jsonl.gz --speed 100
+                                                              # Riproduzione 100x
 
 CONTROLLI:
     - Ctrl+C: Esce dal monitoraggio continuo
@@ -304,8 +679,6 @@ CONTROLLI:
 
 async def main():
     """Funzione principale"""
-    import sys
-    
     # Parse argomenti semplice
     args = sys.argv[1:]
     
@@ -318,13 +691,24 @@ async def main():
     single_mode = "-s" in args or "--single" in args
     interval = 2
     
-    # Parse URL
-    if "-u" in args:
+    # Parse URL (-u ripetibile: più server → monitor multi-sito)
+    urls = []
+    for index, arg in enumerate(args):
+        if arg == "-u":
+            if index + 1 >= len(args):
+                print("❌ Errore: URL non specificato dopo -u")
+                return
+            urls.append(args[index + 1])
+    if urls:
+        server_url = urls[0]
+    
+    # Siti da file JSON (nome → URL)
+    sites: Dict[str, str] = {}
+    if "--sites" in args:
         try:
-            url_index = args.index("-u")
-            server_url = args[url_index + 1]
-        except (ValueError, IndexError):
-            print("❌ Errore: URL non specificato dopo -u")
+            sites = load_sites(args[args.index("--sites") + 1])
+        except (IndexError, OSError, ValueError) as e:
+            print(f"❌ Errore: file dei siti non valido ({e})")
             return
             
     # Parse interval
@@ -336,7 +720,52 @@ async def main():
             print("❌ Errore: Intervallo non valido dopo -i")
             return
     
-    monitor = ProfessionalIrrigationMonitor(server_url)
+    # Parse porta metriche
+    metrics_port = None
+    if "--metrics-port" in args:
+        try:
+            metrics_port = int(args[args.index("--metrics-port") + 1])
+        except (ValueError, IndexError):
+            print("❌ Errore: porta non valida dopo --metrics-port")
+            return
+    
+    # Riproduzione di una registrazione (session_replay.py), senza server
+    if "--replay" in args:
+        try:
+            replay_file = args[args.index("--replay") + 1]
+            speed = float(args[args.index("--speed") + 1]) if "--speed" in args else 1.0
+        except (ValueError, IndexError):
+            print("❌ Errore: opzioni di riproduzione non valide")
+            return
+        try:
+            await ProfessionalIrrigationMonitor(server_url).monitor_replay(replay_file, speed, interval)
+        except (OSError, ValueError) as e:
+            print(f"❌ Errore: {e}")
+        except KeyboardInterrupt:
+            print("\n🛑 Riproduzione interrotta dall'utente")
+        return
+    
+    for url in urls:
+        sites.setdefault(urlsplit(url).netloc or url, url)
+    if len(sites) > 1:
+        try:
+            await monitor_sites(sites, single_mode, interval)
+        except KeyboardInterrupt:
+            print("\n🛑 Monitoraggio interrotto dall'utente")
+        return
+    if sites:
+        server_url = next(iter(sites.values()))
+    
+    # Soglia dell'allarme sulle valvole aperte contemporaneamente
+    max_open_valves = ALERT_CONFIG["max_open_valves"]
+    if "--max-open" in args:
+        try:
+            max_open_valves = int(args[args.index("--max-open") + 1])
+        except (ValueError, IndexError):
+            print("❌ Errore: numero non valido dopo --max-open")
+            return
+    
+    monitor = ProfessionalIrrigationMonitor(server_url, metrics_port, max_open_valves)
     
     try:
         print("🔌 Connessione al server OPC-UA professionale...")
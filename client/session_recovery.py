@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Ripristino automatico della sessione per i client
+
+I client aprono la connessione con la riconnessione automatica di asyncua: un
+watchdog legge lo stato del server ogni RECOVERY_WATCHDOG secondi e, se la
+connessione cade (keep-alive perso, server riavviato), riprova con backoff
+esponenziale limitato a RECOVERY_MAX_DELAY. Sulla nuova connessione la sessione
+viene riattivata se il server la conserva ancora (link caduto) e le
+sottoscrizioni ripristinate; dopo un riavvio del server se ne crea una nuova.
+
+SessionRecovery misura il tempo di ripristino e, a riconnessione avvenuta, chiama
+la risincronizzazione del client: i NodeId sono deterministici, quindi bastano i
+nodi in cache e una sola Read in blocco, senza riscoperta dell'AddressSpace.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from asyncua import Client
+from asyncua.client.ua_client import UaClientState
+
+# Intervallo del controllo di vita della connessione (secondi)
+RECOVERY_WATCHDOG = 0.5
+# Limite del backoff tra i tentativi di riconnessione (secondi)
+RECOVERY_MAX_DELAY = 1.0
+
+def recovering_client(server_url: str, timeout: float = 4) -> Client:
+    """Client asyncua con riconnessione automatica e watchdog rapido"""
+    return Client(server_url, timeout=timeout, watchdog_intervall=RECOVERY_WATCHDOG,
+                  auto_reconnect=True, reconnect_max_delay=RECOVERY_MAX_DELAY)
+
+class SessionRecovery:
+    """Osserva le riconnessioni di un client, risincronizza e misura il tempo di ripristino"""
+
+    def __init__(self, client: Client, resync: Callable[[], Awaitable[int]],
+                 log: Callable[[str], None] = print):
+        self.client = client
+        self.resync = resync
+        self.log = log
+        # Tempi di ripristino (ms): dalla perdita della connessione alla fine della risincronizzazione
+        self.recoveries: List[float] = []
+        self.lost_at: Optional[float] = None
+        self._token = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.client.connection_lost_callback = self._connection_lost
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _connection_lost(self, exc: Exception):
+        self.lost_at = time.perf_counter()
+        self._token = self.client.uaclient.session.authentication_token
+        self.log(f"⚠️  Connessione persa ({exc or type(exc).__name__}): riconnessione in corso...")
+
+    async def _watch(self):
+        while True:
+            async with self.client.subscribe_state() as states:
+                await states.wait_for_state(UaClientState.RECONNECTING)
+                await states.wait_for_state(UaClientState.CONNECTED)
+            connected_at = time.perf_counter()
+            lost_at = self.lost_at if self.lost_at is not None else connected_at
+            reused = self._token is not None and self._token == self.client.uaclient.session.authentication_token
+            try:
+                values = await self.resync()
+            except Exception as e:
+                self.log(f"⚠️  Risincronizzazione fallita: {e}")
+                continue
+            now = time.perf_counter()
+            recovery_ms = (now - lost_at) * 1000.0
+            self.recoveries.append(recovery_ms)
+            self.lost_at = None
+            session = "sessione riattivata" if reused else "nuova sessione"
+            self.log(f"🔄 Riconnesso dopo {recovery_ms:.0f} ms di interruzione ({session}, "
+                     f"{values} valori risincronizzati in {(now - connected_at) * 1000:.0f} ms)")
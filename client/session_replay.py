@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Registrazione e riproduzione delle sessioni di irrigazione
+
+Registrazione: una sessione (StateMirror) sottoscrive lo stato del server e ogni
+versione dello stato diventa una riga JSON con il timestamp di ricezione. Il file
+(gzip se termina in .gz) si legge in streaming: la riproduzione tiene in memoria
+solo lo stato corrente, mai la registrazione intera.
+
+Riproduzione a velocità 1x-1000x:
+    - nel monitor (python client/monitor_client.py --replay FILE --speed 60)
+    - in un server OPC-UA sostitutivo con lo stesso AddressSpace del server reale,
+      a cui collegare monitor, gateway HTTP o altri consumatori senza impianto
+
+Formato (JSON lines):
+    {"t": "h", "format": 1, "ts": 1718000000.0, "url": "...", "on": true,
+     "valves": {"Station1_Valve1": {"station": ..., "valve": ..., "description": ...,
+                                    "irrigating": false, "mode": "Off", "remaining": 0, ...}}}
+    {"t": "c", "ts": 1718000001.2, "on": false, "valves": {"Station1_Valve1": {"irrigating": true, ...}}}
+(nei record "c" la chiave "on" è presente solo se SystemState è cambiato)
+
+UTILIZZO:
+    python client/session_replay.py record FILE [-u URL]
+    python client/session_replay.py play FILE [--speed N] [--endpoint URL]
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import sys
+import time
+from typing import Awaitable, Callable, Dict, Iterator, Optional
+
+from state_mirror import MIRRORED_KEYS
+
+RECORDING_FORMAT = 1
+MAX_SPEED = 1000.0
+STAND_IN_ENDPOINT = "opc.tcp://127.0.0.1:48401/irrigation"
+# Scrittura su disco della registrazione (secondi)
+RECORD_FLUSH_INTERVAL = 1.0
+
+def open_recording(path: str, mode: str = "r"):
+    """File di testo della registrazione, compresso gzip se il nome termina in .gz"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def read_records(path: str) -> Iterator[Dict]:
+    """Record della registrazione uno alla volta (il primo è l'intestazione)"""
+    with open_recording(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise ValueError(f"{path}:{number}: riga non valida") from None
+
+class SessionRecorder:
+    """Listener di StateMirror: scrive l'intestazione e una riga per versione dello stato"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = 0
+        self._file = open_recording(path, "w")
+
+    def write_header(self, mirror, url: str):
+        valves = {valve_id: dict(valve) for valve_id, valve in mirror.valves.items()}
+        self._write({"t": "h", "format": RECORDING_FORMAT, "ts": time.time(), "url": url,
+                     "on": mirror.system_on, "valves": valves})
+
+    def __call__(self, change: Dict):
+        # Solo le variabili di stato: stazione, valvola e descrizione sono nell'intestazione
+        record = {"t": "c", "ts": time.time(),
+                  "valves": {valve_id: {key: valve[key] for key in MIRRORED_KEYS if key in valve}
+                             for valve_id, valve in change["valves"].items()}}
+        if "system" in change:
+            record["on"] = change["system"]["on"]
+        self._write(record)
+
+    def _write(self, record: Dict):
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.records += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class SessionReplay:
+    """
+    Riproduce una registrazione rispettando i tempi registrati divisi per `speed`.
+    Lo stato corrente (system_on, valves) segue i record applicati; now() è l'ora
+    della registrazione corrispondente all'istante di riproduzione.
+    """
+
+    def __init__(self, path: str, speed: float = 1.0):
+        if not 0 < speed <= MAX_SPEED:
+            raise ValueError(f"velocità non valida: {speed} (1-{MAX_SPEED:.0f}x)")
+        self.path = path
+        self.speed = speed
+        self._records = read_records(path)
+        header = next(self._records, None)
+        if header is None or header.get("t") != "h":
+            raise ValueError(f"{path}: intestazione della registrazione mancante")
+        if header.get("format") != RECORDING_FORMAT:
+            raise ValueError(f"{path}: formato {header.get('format')} non supportato")
+        self.url = header.get("url", "")
+        self.started = header["ts"]
+        self.system_on = header["on"]
+        self.valves: Dict[str, Dict] = header["valves"]
+        self.position = self.started
+        self.applied = 0
+        self.finished = False
+        self._wall_start: Optional[float] = None
+
+    def station_configs(self):
+        """Installazione registrata nel formato di installation_config.py"""
+        stations: Dict[str, Dict] = {}
+        for valve in self.valves.values():
+            # Descrizione della valvola: "<descrizione stazione> - Valvola N"
+            station = stations.setdefault(valve["station"], {
+                "id": valve["station"], "description": valve["description"].rsplit(" - Valvola", 1)[0],
+                "valves": 0})
+            station["valves"] += 1
+        return list(stations.values())
+
+    def now(self) -> float:
+        if self._wall_start is None or self.finished:
+            return self.position
+        return self.started + (time.monotonic() - self._wall_start) * self.speed
+
+    async def run(self, on_record: Callable[[Dict], Awaitable[None]]):
+        """Applica i record in tempo (accelerato) e chiama `on_record` dopo ognuno"""
+        self._wall_start = time.monotonic()
+        for record in self._records:
+            if record.get("t") != "c":
+                continue
+            delay = self._wall_start + (record["ts"] - self.started) / self.speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if "on" in record:
+                self.system_on = record["on"]
+            for valve_id, values in record["valves"].items():
+                valve = self.valves.get(valve_id)
+                if valve is not None:
+                    valve.update(values)
+            self.position = record["ts"]
+            self.applied += 1
+            await on_record(record)
+        self.finished = True
+
+async def record_session(server_url: str, path: str):
+    """Registra le variabili di stato del server finché non si preme Ctrl+C"""
+    from control_client import ProfessionalIrrigationController
+    from state_mirror import StateMirror
+
+    controller = ProfessionalIrrigationController(server_url, quiet=True)
+    recorder = None
+    try:
+        await controller.connect()
+        mirror = StateMirror(controller, change_log=0)
+        await mirror.start()
+        recorder = SessionRecorder(path)
+        recorder.write_header(mirror, server_url)
+        mirror.listeners.append(recorder)
+        print(f"⏺️  Registrazione di {len(mirror.valves)} valvole in {path} (Ctrl+C per fermare)")
+        while True:
+            await asyncio.sleep(RECORD_FLUSH_INTERVAL)
+            recorder.flush()
+    finally:
+        if recorder is not None:
+            recorder.close()
+            print(f"💾 {recorder.records} record salvati in {path}")
+        try:
+            await controller.disconnect()
+        except Exception:
+            pass
+
+async def serve_replay(replay: SessionReplay, endpoint: str):
+    """Server OPC-UA sostitutivo: AddressSpace del server reale, valori dalla registrazione"""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"))
+    from asyncua import ua
+    from irrigation_server import ProfessionalIrrigationServer
+
+    # Nessuna simulazione né persistenza: i nodi cambiano solo con i record riprodotti
+    stand_in = ProfessionalIrrigationServer(sim_workers=0, station_configs=replay.station_configs(),
+                                            state_dir=None, endpoint=endpoint, audit_dir=None)
+    await stand_in.init_server()
+    nodes = stand_in.nodes
+
+    async def publish(record: Dict):
+        if "on" in record:
+            await nodes["system_state"].write_value(replay.system_on)
+        for valve_id, values in record["valves"].items():
+            if f"{valve_id}_irrigating" not in nodes:
+                continue
+            if "irrigating" in values:
+                await nodes[f"{valve_id}_irrigating"].write_value(bool(values["irrigating"]))
+            if "mode" in values:
+                await nodes[f"{valve_id}_mode"].write_value(values["mode"])
+            if "remaining" in values:
+                await nodes[f"{valve_id}_remaining"].write_value(ua.Variant(int(values["remaining"]), ua.VariantType.Int32))
+            if values.get("last_command_id") is not None:
+                await nodes[f"{valve_id}_last_command_id"].write_value(values["last_command_id"])
+
+    # Stato iniziale dall'intestazione
+    await publish({"on": replay.system_on, "valves": replay.valves})
+    async with stand_in.server:
+        print(f"▶️  Server sostitutivo su {endpoint}: riproduzione di {replay.path} a {replay.speed:g}x")
+        started = time.perf_counter()
+        await replay.run(publish)
+        recorded = replay.position - replay.started
+        print(f"⏹️  {replay.applied} record ({recorded:.0f}s registrati) riprodotti in "
+              f"{time.perf_counter() - started:.1f}s; stato finale servito (Ctrl+C per uscire)")
+        while True:
+            await asyncio.sleep(3600)
+
+def print_help():
+    print("Uso: python session_replay.py record FILE [-u URL]")
+    print("     python session_replay.py play FILE [--speed N] [--endpoint URL]")
+    print()
+    print("  record FILE      registra i cambi di stato del server (FILE.gz = compresso)")
+    print("  play FILE        riproduce la registrazione in un server OPC-UA sostitutivo")
+    print("  -u URL           server da registrare (default opc.tcp://localhost:48400/irrigation)")
+    print(f"  --speed N        velocità di riproduzione, 1-{MAX_SPEED:.0f} (default 1)")
+    print(f"  --endpoint URL   endpoint del server sostitutivo (default {STAND_IN_ENDPOINT})")
+    print()
+    print("Per riprodurre nel monitor: python monitor_client.py --replay FILE --speed N")
+
+async def main():
+    args = sys.argv[1:]
+    if "-h" in args or "--help" in args or len(args) < 2 or args[0] not in ("record", "play"):
+        print_help()
+        return
+    command, path = args[0], args[1]
+    try:
+        server_url = args[args.index("-u") + 1] if "-u" in args else "opc.tcp://localhost:48400/irrigation"
+        speed = float(args[args.index("--speed") + 1]) if "--speed" in args else 1.0
+        endpoint = args[args.index("--endpoint") + 1] if "--endpoint" in args else STAND_IN_ENDPOINT
+    except (IndexError, ValueError):
+        print("❌ Errore: opzioni non valide (vedi --help)")
+        return
+
+    try:
+        if command == "record":
+            await record_session(server_url, path)
+        else:
+            await serve_replay(SessionReplay(path, speed), endpoint)
+    except ConnectionError:
+        print("❌ Impossibile connettersi al server OPC-UA")
+    except (OSError, ValueError) as e:
+        print(f"❌ Errore: {e}")
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n🛑 Fermato")
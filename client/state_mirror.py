@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Specchio in memoria di IrrigationSystem alimentato da una sottoscrizione
+
+Una sessione (ProfessionalIrrigationController) sottoscrive SystemState e le
+variabili di stato di ogni valvola; le notifiche di una stessa Publish diventano
+una sola versione dello stato, con il registro delle differenze per versione.
+Dopo una riconnessione lo stato viene riletto con una sola Read in blocco.
+
+Usato dal gateway HTTP (http_gateway.py) e dal monitor multi-sito (monitor_client.py).
+"""
+
+import asyncio
+import collections
+import json
+import logging
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+from asyncua import ua
+
+from control_client import ProfessionalIrrigationController
+
+# Intervallo di pubblicazione della sottoscrizione (ms)
+PUBLISHING_INTERVAL_MS = 100
+# Versioni conservate per inviare solo le differenze (stream SSE)
+CHANGE_LOG_SIZE = 1000
+# Variabili della valvola rispecchiate: chiave nello stato JSON → chiave in controller.nodes
+MIRRORED_KEYS = {"irrigating": "irrigating", "mode": "mode", "remaining": "remaining",
+                 "last_command_id": "last_command_id"}
+
+class StateMirror:
+    """Specchio di IrrigationSystem aggiornato dalle notifiche della sottoscrizione"""
+
+    def __init__(self, controller: ProfessionalIrrigationController, change_log: int = CHANGE_LOG_SIZE,
+                 heartbeat: bool = False):
+        self.controller = controller
+        # heartbeat: sottoscrive anche Server/ServerStatus/CurrentTime (aggiornato ogni secondo dal
+        # server), così staleness() distingue un sito fermo da un sito senza cambiamenti
+        self.heartbeat = heartbeat
+        self.system_on = False
+        self.valves: Dict[str, Dict] = {}
+        self.version = 0
+        # Prefisso dell'ETag: le versioni ripartono a ogni avvio del gateway
+        self.boot_id = uuid.uuid4().hex[:8]
+        self.notifications = 0
+        # Chiamati con ogni nuova versione (es. registrazione della sessione, session_replay.py)
+        self.listeners: List[Callable[[Dict], None]] = []
+        # Ultimo aggiornamento dal server (monotonic): notifiche o lettura completa
+        self.updated_at: Optional[float] = None
+        self._subscription = None
+        # NodeId → (valvola o None per SystemState, chiave)
+        self._by_nodeid: Dict = {}
+        self._pending: Dict[str, Dict] = {}
+        self._pending_system = False
+        self._flush_scheduled = False
+        # change_log=0 quando servono solo lo stato corrente e le notifiche (monitor multi-sito)
+        self._changes = collections.deque(maxlen=change_log)
+        self._changed = asyncio.Event()
+        self._rendered: Tuple[int, bytes] = (-1, b"")
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.boot_id}-{self.version}"'
+
+    async def start(self):
+        """Legge lo stato iniziale in blocco dai nodi scoperti e sottoscrive tutte le variabili"""
+        controller = self.controller
+        self._by_nodeid = {controller.nodes["system_state"].nodeid: (None, "on")}
+        nodes = [controller.nodes["system_state"]]
+        for valve_id, valve in controller.nodes.items():
+            if valve_id == "system_state":
+                continue
+            self.valves[valve_id] = {"station": valve["station"], "valve": valve["valve"],
+                                     "description": valve["description"]}
+            for key, node_key in MIRRORED_KEYS.items():
+                self._by_nodeid[valve[node_key].nodeid] = (valve_id, key)
+                nodes.append(valve[node_key])
+        await self.resync()
+        if self.heartbeat:
+            nodes.append(controller.client.get_node(ua.NodeId(ua.ObjectIds.Server_ServerStatus_CurrentTime)))
+        self._subscription = await controller.client.create_subscription(PUBLISHING_INTERVAL_MS, self)
+        await self._subscription.subscribe_data_change(nodes)
+        if controller.recovery is not None:
+            # Dopo una riconnessione: stato completo con una Read, poi di nuovo le notifiche
+            controller.recovery.resync = self.resync
+
+    async def resync(self) -> int:
+        """Rilegge tutte le variabili rispecchiate con una sola richiesta Read"""
+        nodeids = list(self._by_nodeid)
+        client = self.controller.client
+        values = await client.read_attributes([client.get_node(nodeid) for nodeid in nodeids])
+        for nodeid, value in zip(nodeids, values):
+            if value.StatusCode.is_good():
+                self._apply(nodeid, value.Value.Value)
+        self._flush()
+        self.updated_at = time.monotonic()
+        return len(values)
+
+    def staleness(self) -> Optional[float]:
+        """Secondi dall'ultima notizia del server: Publish (anche solo keep-alive) o lettura"""
+        last = self.updated_at
+        published = getattr(self._subscription, "last_publish_at", None)
+        if published is not None:
+            last = published if last is None else max(last, published)
+        return None if last is None else time.monotonic() - last
+
+    # Handler della sottoscrizione asyncua
+    def datachange_notification(self, node, value, data):
+        self.updated_at = time.monotonic()
+        if node.nodeid not in self._by_nodeid:
+            return
+        self.notifications += 1
+        self._apply(node.nodeid, value)
+        if not self._flush_scheduled:
+            # Le notifiche di una stessa Publish diventano una sola versione
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def status_change_notification(self, status):
+        logging.getLogger(__name__).warning("Sottoscrizione: %s", status)
+
+    def _apply(self, nodeid, value):
+        target = self._by_nodeid.get(nodeid)
+        if target is None:
+            return
+        valve_id, key = target
+        if valve_id is None:
+            if value != self.system_on:
+                self.system_on = bool(value)
+                self._pending_system = True
+            return
+        valve = self.valves[valve_id]
+        if valve.get(key) != value:
+            valve[key] = value
+            self._pending[valve_id] = valve
+
+    def _flush(self):
+        self._flush_scheduled = False
+        if not self._pending and not self._pending_system:
+            return
+        self.version += 1
+        change = {"version": self.version,
+                  "valves": {valve_id: dict(valve) for valve_id, valve in self._pending.items()}}
+        if self._pending_system:
+            change["system"] = {"on": self.system_on}
+        self._changes.append(change)
+        for listener in self.listeners:
+            listener(change)
+        self._pending = {}
+        self._pending_system = False
+        # Sveglia chi attende (long-poll e SSE) e prepara l'evento per il prossimo cambiamento
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def snapshot(self) -> Dict:
+        return {"version": self.version, "system": {"on": self.system_on}, "valves": self.valves}
+
+    def rendered(self) -> bytes:
+        """JSON dello stato serializzato una volta per versione"""
+        if self._rendered[0] != self.version:
+            self._rendered = (self.version, json.dumps(self.snapshot()).encode("utf-8"))
+        return self._rendered[1]
+
+    async def wait_change(self, version: int, timeout: float) -> bool:
+        """Attende una versione successiva a `version`; False allo scadere del timeout"""
+        if self.version != version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def changes_since(self, version: int) -> Optional[list]:
+        """Cambiamenti successivi a `version`, o None se non più nel registro"""
+        if version == self.version:
+            return []
+        if not self._changes or self._changes[0]["version"] > version + 1:
+            return None
+        return [change for change in self._changes if change["version"] > version]
@@ -65,6 +65,15 @@ VALVE_CONFIG = {
     "water_flow_rate": 5.0,  # litri/minuto
 }
 
+# Regole di allarme del monitor (client/alert_rules.py)
+ALERT_CONFIG = {
+    # Allarme se più valvole di queste irrigano contemporaneamente
+    "max_open_valves": 3,
+    
+    # Ora (HH:MM) entro cui ogni stazione deve aver irrigato nella giornata
+    "station_watering_deadline": "20:00",
+}
+
 # Configurazione Client 
 CLIENT_CONFIG = {
     # Server di default
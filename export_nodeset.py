@@ -5,159 +5,21 @@ SOLO per UAModeler - Server e client rimangono invariati
 """
 
 import asyncio
+import hashlib
+import json
 import os
-from asyncua import Server, ua
-from asyncua.common.node import Node
+import shutil
+import sys
+import time
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional
+from xml.sax.saxutils import escape
 
-async def create_custom_object_types(server, ns_idx):
-    """Crea gli ObjectTypes personalizzati per il sistema di irrigazione"""
-    
-    # Ottieni il nodo BaseObjectType
-    base_object_type = server.get_node(ua.ObjectIds.BaseObjectType)
-    
-    print("🏗️  Creazione ObjectTypes personalizzati...")
-    
-    # =============================================================================
-    # 1. IrrigationValveType - Tipo personalizzato per le valvole
-    # =============================================================================
-    irrigation_valve_type = await base_object_type.add_object_type(ns_idx, "IrrigationValveType")
-    
-    # Descrizione del tipo (rimuoviamo set_description non supportato)
-    
-    # Status folder nel tipo
-    status_folder = await irrigation_valve_type.add_object(ns_idx, "Status")
-    await status_folder.add_variable(ns_idx, "IsIrrigating", False, ua.VariantType.Boolean)
-    await status_folder.add_variable(ns_idx, "Mode", "Off", ua.VariantType.String)
-    await status_folder.add_variable(ns_idx, "RemainingTime", 0, ua.VariantType.Int32)
-    await status_folder.add_variable(ns_idx, "NextScheduledStart", None, ua.VariantType.DateTime)
-    
-    # Commands folder nel tipo
-    commands_folder = await irrigation_valve_type.add_object(ns_idx, "Commands")
-    duration_var = await commands_folder.add_variable(ns_idx, "CommandDuration", 0, ua.VariantType.Int32)
-    start_var = await commands_folder.add_variable(ns_idx, "CommandStart", False, ua.VariantType.Boolean)
-    stop_var = await commands_folder.add_variable(ns_idx, "CommandStop", False, ua.VariantType.Boolean)
-    
-    # Rendi scrivibili i comandi nel tipo
-    await duration_var.set_writable()
-    await start_var.set_writable()
-    await stop_var.set_writable()
-    
-    # Info valvola nel tipo
-    await irrigation_valve_type.add_variable(ns_idx, "Description", "", ua.VariantType.String)
-    
-    # =============================================================================
-    # 2. IrrigationStationType - Tipo personalizzato per le stazioni
-    # =============================================================================
-    irrigation_station_type = await base_object_type.add_object_type(ns_idx, "IrrigationStationType")
-    
-    # StationInfo nel tipo
-    station_info = await irrigation_station_type.add_object(ns_idx, "StationInfo")
-    await station_info.add_variable(ns_idx, "StationId", "", ua.VariantType.String)
-    await station_info.add_variable(ns_idx, "StationType", "", ua.VariantType.String)
-    await station_info.add_variable(ns_idx, "ValveCount", 0, ua.VariantType.Int32)
-    await station_info.add_variable(ns_idx, "Location", "", ua.VariantType.String)
-    
-    # =============================================================================
-    # 3. IrrigationSystemType - Tipo personalizzato per il sistema
-    # =============================================================================
-    irrigation_system_type = await base_object_type.add_object_type(ns_idx, "IrrigationSystemType")
-    
-    # Controller nel tipo sistema
-    controller_folder = await irrigation_system_type.add_object(ns_idx, "Controller")
-    system_state_var = await controller_folder.add_variable(ns_idx, "SystemState", True, ua.VariantType.Boolean)
-    await system_state_var.set_writable()
-    
-    # Stations folder nel tipo sistema
-    stations_folder = await irrigation_system_type.add_object(ns_idx, "Stations")
-    
-    print(f"✅ ObjectTypes creati:")
-    print(f"   • IrrigationValveType")
-    print(f"   • IrrigationStationType") 
-    print(f"   • IrrigationSystemType")
-    
-    return {
-        "valve_type": irrigation_valve_type,
-        "station_type": irrigation_station_type,
-        "system_type": irrigation_system_type
-    }
-
-async def create_professional_addressspace(server, ns_idx, object_types):
-    """Crea l'AddressSpace usando gli ObjectTypes personalizzati"""
-    
-    objects = server.get_objects_node()
-    
-    print("🏗️  Creazione AddressSpace con ObjectTypes...")
-    
-    # Root del sistema usando il tipo personalizzato
-    irrigation_system = await objects.add_object(ns_idx, "IrrigationSystem", 
-                                                objecttype=object_types["system_type"])
-    
-    # Crea manualmente la struttura (gli ObjectTypes definiscono il template, ma le istanze vanno create)
-    controller = await irrigation_system.add_object(ns_idx, "Controller")
-    system_state = await controller.add_variable(ns_idx, "SystemState", True, ua.VariantType.Boolean)
-    await system_state.set_writable()
-    
-    stations_folder = await irrigation_system.add_object(ns_idx, "Stations")
-    
-    # Lista per tenere traccia di tutti i nodi
-    created_nodes = [irrigation_system, controller, system_state, stations_folder]
-    
-    # Configurazione stazioni
-    station_configs = [
-        {"id": "Station1", "location": "Giardino Anteriore", "valves": 2, "type": "DoubleValve"},
-        {"id": "Station2", "location": "Aiuole Laterali", "valves": 1, "type": "SingleValve"},
-        {"id": "Station3", "location": "Giardino Posteriore", "valves": 2, "type": "DoubleValve"}
-    ]
-    
-    # Crea stazioni usando il tipo personalizzato
-    for config in station_configs:
-        station = await stations_folder.add_object(ns_idx, config["id"], 
-                                                 objecttype=object_types["station_type"])
-        created_nodes.append(station)
-        
-        # Crea manualmente StationInfo
-        station_info = await station.add_object(ns_idx, "StationInfo")
-        station_id_var = await station_info.add_variable(ns_idx, "StationId", config["id"], ua.VariantType.String)
-        station_type_var = await station_info.add_variable(ns_idx, "StationType", config["type"], ua.VariantType.String)
-        valve_count_var = await station_info.add_variable(ns_idx, "ValveCount", config["valves"], ua.VariantType.Int32)
-        location_var = await station_info.add_variable(ns_idx, "Location", config["location"], ua.VariantType.String)
-        
-        created_nodes.extend([station_info, station_id_var, station_type_var, valve_count_var, location_var])
-        
-        # Crea valvole usando il tipo personalizzato
-        for valve_num in range(1, config["valves"] + 1):
-            valve_name = f"Valve{valve_num}"
-            valve = await station.add_object(ns_idx, valve_name, 
-                                           objecttype=object_types["valve_type"])
-            created_nodes.append(valve)
-            
-            # Crea manualmente la struttura della valvola
-            description = f"{config['location']} - Valvola {valve_num}"
-            desc_var = await valve.add_variable(ns_idx, "Description", description, ua.VariantType.String)
-            
-            # Status folder
-            status_folder = await valve.add_object(ns_idx, "Status")
-            is_irrigating = await status_folder.add_variable(ns_idx, "IsIrrigating", False, ua.VariantType.Boolean)
-            mode = await status_folder.add_variable(ns_idx, "Mode", "Off", ua.VariantType.String)
-            remaining_time = await status_folder.add_variable(ns_idx, "RemainingTime", 0, ua.VariantType.Int32)
-            next_scheduled = await status_folder.add_variable(ns_idx, "NextScheduledStart", None, ua.VariantType.DateTime)
-            
-            # Commands folder
-            commands_folder = await valve.add_object(ns_idx, "Commands")
-            duration_cmd = await commands_folder.add_variable(ns_idx, "CommandDuration", 0, ua.VariantType.Int32)
-            start_cmd = await commands_folder.add_variable(ns_idx, "CommandStart", False, ua.VariantType.Boolean)
-            stop_cmd = await commands_folder.add_variable(ns_idx, "CommandStop", False, ua.VariantType.Boolean)
-            
-            # Rendi scrivibili i comandi
-            await duration_cmd.set_writable()
-            await start_cmd.set_writable()
-            await stop_cmd.set_writable()
-            
-            created_nodes.extend([desc_var, status_folder, is_irrigating, mode, remaining_time, next_scheduled,
-                                commands_folder, duration_cmd, start_cmd, stop_cmd])
-    
-    print(f"✅ AddressSpace creato con {len(created_nodes)} nodi")
-    return created_nodes
+from asyncua import Server
+
+from config.server_config import INSTALLATION_CONFIG
+from server.information_model import (NAMESPACE_URI, TYPE_NODEIDS, Instance, Member, NodeBatch,
+                                      compile_type, iter_instances, valve_count)
 
 async def export_professional_nodeset():
     """Funzione principale di export con ObjectTypes"""
@@ -176,18 +38,18 @@ async def export_professional_nodeset():
         server.set_server_name("Professional Irrigation Export Server")
         
         # Registra namespace
-        namespace_uri = "http://mvlabs.it/irrigation"
-        ns_idx = await server.register_namespace(namespace_uri)
-        print(f"📋 Namespace registrato: {namespace_uri} (index: {ns_idx})")
+        ns_idx = await server.register_namespace(NAMESPACE_URI)
+        print(f"📋 Namespace registrato: {NAMESPACE_URI} (index: {ns_idx})")
         
-        # Crea ObjectTypes personalizzati
-        object_types = await create_custom_object_types(server, ns_idx)
-        
-        # Crea AddressSpace usando i tipi
-        created_nodes = await create_professional_addressspace(server, ns_idx, object_types)
-        
-        # Aggiungi ObjectTypes alla lista per l'export
-        all_nodes = list(object_types.values()) + created_nodes
+        # ObjectTypes e istanze dal modello condiviso con il server (AddNodes in batch)
+        batch = NodeBatch(ns_idx)
+        batch.add_types()
+        type_count = len(TYPE_NODEIDS)
+        for block in iter_instances(INSTALLATION_CONFIG["stations"]):
+            for instance in block:
+                batch.add_instance(instance)
+        all_nodes = [server.get_node(item.RequestedNewNodeId) for item in batch.nodes]
+        await batch.commit(server)
         
         # Avvia server temporaneamente
         print("🚀 Avvio server temporaneo...")
@@ -203,9 +65,8 @@ async def export_professional_nodeset():
         print(f"📁 File creato: {os.path.abspath(output_file)}")
         
         # Statistiche
-        type_count = len(object_types)
-        instance_count = len(created_nodes)
         total_count = len(all_nodes)
+        stations = INSTALLATION_CONFIG["stations"]
         
         print("\n" + "=" * 80)
         print("📊 CONTENUTO NODESET PROFESSIONALE:")
@@ -214,10 +75,10 @@ async def export_professional_nodeset():
         print(f"   • IrrigationSystemType")
         print(f"   • IrrigationStationType") 
         print(f"   • IrrigationValveType")
-        print(f"📦 Istanze create: {instance_count}")
+        print(f"📦 Istanze create:")
         print(f"   • 1 Sistema di irrigazione")
-        print(f"   • 3 Stazioni (Station1, Station2, Station3)")
-        print(f"   • 5 Valvole totali")
+        print(f"   • {len(stations)} Stazioni ({', '.join(config['id'] for config in stations)})")
+        print(f"   • {sum(valve_count(config) for config in stations)} Valvole totali")
         print(f"📋 Nodi totali esportati: {total_count}")
         
         print("\n" + "=" * 80)
@@ -256,7 +117,437 @@ async def export_professional_nodeset():
     
     return True
 
+# =============================================================================
+# Generatore NodeSet senza server
+# =============================================================================
+
+# NodeId XML degli ObjectTypes (il namespace del modello è sempre ns=1 nel file)
+TYPE_XML_IDS = {type_name: f"ns=1;i={number}" for type_name, number in TYPE_NODEIDS.items()}
+
+DATA_TYPE_ALIASES = {"Boolean": "i=1", "Int32": "i=6", "UInt32": "i=7", "Double": "i=11", "String": "i=12",
+                     "DateTime": "i=13"}
+REFERENCE_ALIASES = {
+    "Organizes": "i=35", "HasModellingRule": "i=37", "HasTypeDefinition": "i=40",
+    "HasSubtype": "i=45", "HasComponent": "i=47",
+}
+BASE_OBJECT_TYPE = "i=58"
+BASE_DATA_VARIABLE_TYPE = "i=63"
+OBJECTS_FOLDER = "i=85"
+MODELLING_RULE_MANDATORY = "i=78"
+
+_FORWARD = {True: "", False: ' IsForward="false"'}
+
+def _scalar_xml(data_type: str, value) -> str:
+    if data_type == "Boolean":
+        text = "true" if value else "false"
+    elif data_type == "String":
+        text = escape(value)
+    else:
+        text = str(value)
+    return f"<uax:{data_type}>{text}</uax:{data_type}>"
+
+def _value_xml(data_type: str, value) -> str:
+    """Valore di una variabile in formato NodeSet2 (tipo "X[]" = array)"""
+    if value is None:
+        return ""
+    if data_type.endswith("[]"):
+        data_type = data_type[:-2]
+        items = "".join(_scalar_xml(data_type, item) for item in value)
+        return f"<Value><uax:ListOf{data_type}>{items}</uax:ListOf{data_type}></Value>"
+    return f"<Value>{_scalar_xml(data_type, value)}</Value>"
+
+def _xml_text(text: str) -> str:
+    """Testo sicuro per attributi e contenuti XML"""
+    return escape(text, {'"': "&quot;"})
+
+def _node_xml(tag: str, nodeid: str, name: str, parent: Optional[str], references: List[tuple],
+              data_type: Optional[str] = None, value=None, writable: bool = False) -> str:
+    """Serializza un singolo nodo (nodeid, name e parent già in formato XML sicuro)"""
+    attrs = f'NodeId="{nodeid}" BrowseName="1:{name}"'
+    if parent is not None:
+        attrs += f' ParentNodeId="{parent}"'
+    if data_type is not None:
+        if data_type.endswith("[]"):
+            attrs += f' DataType="{data_type[:-2]}" ValueRank="1" ArrayDimensions="0"'
+        else:
+            attrs += f' DataType="{data_type}"'
+        if writable:
+            attrs += ' AccessLevel="3" UserAccessLevel="3"'
+    refs = "".join(
+        f'<Reference ReferenceType="{ref_type}"{_FORWARD[forward]}>{target}</Reference>'
+        for ref_type, target, forward in references
+    )
+    value_xml = _value_xml(data_type, value) if data_type is not None else ""
+    return (f"  <{tag} {attrs}>\n"
+            f"    <DisplayName>{name}</DisplayName>\n"
+            f"    <References>{refs}</References>\n"
+            f"{('    ' + value_xml + chr(10)) if value_xml else ''}"
+            f"  </{tag}>\n")
+
+# Segnaposto del NodeId base nei template dei membri
+_BASE = "\x00"
+
+def _member_xml(base_id: str, type_name: str, member: Member, value, is_type: bool) -> str:
+    """Serializza un membro di un tipo o di una sua istanza, con NodeId derivato dal percorso"""
+    nodeid = f"{base_id}.{member.path}"
+    parent = f"{base_id}.{member.parent}" if member.parent else base_id
+    if is_type and not member.parent:
+        parent = TYPE_XML_IDS[type_name]
+    references = [("HasComponent", parent, False)]
+    if is_type:
+        references.append(("HasModellingRule", MODELLING_RULE_MANDATORY, True))
+    if member.node_class == "Object":
+        references.append(("HasTypeDefinition", "i=61", True))  # FolderType
+        return _node_xml("UAObject", nodeid, member.name, parent, references)
+    references.append(("HasTypeDefinition", BASE_DATA_VARIABLE_TYPE, True))
+    return _node_xml("UAVariable", nodeid, member.name, parent, references,
+                     member.data_type, value, member.writable)
+
+def _node_hash(xml: str) -> str:
+    """Impronta compatta di un nodo serializzato"""
+    return hashlib.blake2b(xml.encode("utf-8"), digest_size=8).hexdigest()
+
+@lru_cache(maxsize=None)
+def _member_template(type_name: str, is_type: bool, overridden: frozenset) -> tuple:
+    """
+    Membri con valori di default, serializzati una sola volta per tipo:
+    ((percorso, xml, impronta), ...). L'xml di un nodo è determinato dal template e
+    dal NodeId, quindi l'impronta del template vale per tutte le istanze.
+    """
+    templates = []
+    for member in compile_type(type_name):
+        if member.path not in overridden:
+            xml = _member_xml(_BASE, type_name, member, member.default, is_type)
+            templates.append((member.path, xml, _node_hash(xml)))
+    return tuple(templates)
+
+def _member_nodes(base_id: str, type_name: str, values: Dict, is_type: bool) -> List[tuple]:
+    """Tutti i membri di un tipo o di un'istanza come (NodeId, xml, impronta): template + valori specifici"""
+    nodes = [(f"{base_id}.{path}", xml.replace(_BASE, base_id), digest)
+             for path, xml, digest in _member_template(type_name, is_type, frozenset(values))]
+    for member in compile_type(type_name):
+        if member.path in values:
+            xml = _member_xml(base_id, type_name, member, values[member.path], is_type)
+            nodes.append((f"{base_id}.{member.path}", xml, _node_hash(xml)))
+    return nodes
+
+@lru_cache(maxsize=None)
+def _member_block_template(type_name: str, is_type: bool, overridden: frozenset) -> str:
+    """Template dei membri già concatenato (export senza indice: una replace per istanza)"""
+    return "".join(xml for _, xml, _ in _member_template(type_name, is_type, overridden))
+
+def _member_block_xml(base_id: str, type_name: str, values: Dict, is_type: bool) -> str:
+    """Come _member_nodes, ma solo il testo dei membri (stesso ordine)"""
+    parts = [_member_block_template(type_name, is_type, frozenset(values)).replace(_BASE, base_id)]
+    for member in compile_type(type_name):
+        if member.path in values:
+            parts.append(_member_xml(base_id, type_name, member, values[member.path], is_type))
+    return "".join(parts)
+
+def header_xml(namespace_uri: str = NAMESPACE_URI, extensions: str = "") -> str:
+    """Intestazione del NodeSet: namespace, alias ed eventuali estensioni"""
+    aliases = "".join(f'    <Alias Alias="{name}">{nodeid}</Alias>\n'
+                      for name, nodeid in {**DATA_TYPE_ALIASES, **REFERENCE_ALIASES}.items())
+    return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<UANodeSet xmlns="http://opcfoundation.org/UA/2011/03/UANodeSet.xsd" '
+            'xmlns:uax="http://opcfoundation.org/UA/2008/02/Types.xsd">\n'
+            f"  <NamespaceUris>\n    <Uri>{escape(namespace_uri)}</Uri>\n  </NamespaceUris>\n"
+            f"  <Aliases>\n{aliases}  </Aliases>\n"
+            f"{extensions}")
+
+FOOTER_XML = "</UANodeSet>\n"
+
+def _type_root_xml(type_name: str, type_nodeid: str) -> str:
+    return _node_xml("UAObjectType", type_nodeid, type_name, None, [("HasSubtype", BASE_OBJECT_TYPE, False)])
+
+def _instance_root(instance: Instance) -> tuple:
+    """Nodo radice tipizzato di un'istanza: (NodeId, xml)"""
+    nodeid = f"ns=1;s={_xml_text(instance.path)}"
+    if instance.parent is None:
+        parent = OBJECTS_FOLDER
+        references = [("Organizes", OBJECTS_FOLDER, False)]
+    else:
+        parent = f"ns=1;s={_xml_text(instance.parent)}"
+        references = [("HasComponent", parent, False)]
+    references.append(("HasTypeDefinition", TYPE_XML_IDS[instance.type_name], True))
+    return nodeid, _node_xml("UAObject", nodeid, _xml_text(instance.name), parent, references)
+
+def _instance_nodes(instance: Instance) -> List[tuple]:
+    """Istanza di un tipo: nodo radice tipizzato + membri del tipo con i valori dell'istanza"""
+    nodeid, xml = _instance_root(instance)
+    return [(nodeid, xml, _node_hash(xml))] + _member_nodes(nodeid, instance.type_name, instance.values,
+                                                             is_type=False)
+
+def iter_node_blocks(stations: List[Dict]) -> Iterator[List[tuple]]:
+    """
+    Nodi del modello come blocchi di (NodeId, xml, impronta): uno per tipo, uno per il
+    sistema e uno per stazione. I NodeId sono deterministici (derivati dal percorso).
+    """
+    # ObjectTypes
+    for type_name, type_nodeid in TYPE_XML_IDS.items():
+        xml = _type_root_xml(type_name, type_nodeid)
+        yield ([(type_nodeid, xml, _node_hash(xml))]
+               + _member_nodes(f"ns=1;s={type_name}", type_name, {}, is_type=True))
+
+    # Istanze: il sistema, poi una stazione (con le sue valvole) per blocco
+    for instances in iter_instances(stations):
+        block = []
+        for instance in instances:
+            block.extend(_instance_nodes(instance))
+        yield block
+
+def generate_nodeset(stations: List[Dict], namespace_uri: str = NAMESPACE_URI) -> Iterator[str]:
+    """
+    Genera il NodeSet2 XML del sistema di irrigazione senza avviare un server.
+    Produce blocchi di testo (uno per stazione) per scrivere in streaming con memoria limitata.
+    Stesso testo di iter_node_blocks, senza separare i nodi né calcolarne le impronte.
+    """
+    yield header_xml(namespace_uri)
+    for type_name, type_nodeid in TYPE_XML_IDS.items():
+        yield (_type_root_xml(type_name, type_nodeid)
+               + _member_block_xml(f"ns=1;s={type_name}", type_name, {}, is_type=True))
+    for instances in iter_instances(stations):
+        parts = []
+        for instance in instances:
+            nodeid, xml = _instance_root(instance)
+            parts.append(xml)
+            parts.append(_member_block_xml(nodeid, instance.type_name, instance.values, is_type=False))
+        yield "".join(parts)
+    yield FOOTER_XML
+
+def synthetic_installation(valve_count: int, valves_per_station: int = 2) -> Iterator[Dict]:
+    """Installazione generata con il numero di valvole richiesto (per test di scala)"""
+    station_num = 0
+    while valve_count > 0:
+        station_num += 1
+        count = min(valves_per_station, valve_count)
+        valve_count -= count
+        yield {
+            "id": f"Station{station_num}",
+            "description": f"Zona {station_num}",
+            "valve_count": count,
+            "type": "DoubleValve" if count > 1 else "SingleValve",
+        }
+
+def index_path(output_file: str) -> str:
+    """Indice delle impronte salvato accanto al NodeSet"""
+    return output_file + ".index"
+
+# Formato dell'indice: una riga di intestazione JSON, poi una riga per blocco
+# "<NodeId radice JSON>\t{NodeId: impronta, ...}", nello stesso ordine del NodeSet
+INDEX_FORMAT = 2
+
+def _block_hashes(block: List[tuple]) -> Dict[str, str]:
+    return {nodeid: digest for nodeid, _, digest in block}
+
+class IndexWriter:
+    """Scrive l'indice in streaming, un blocco alla volta (file temporaneo finché non è completo)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path + ".tmp", "w", encoding="utf-8")
+        self._file.write(json.dumps({"namespace_uri": NAMESPACE_URI, "format": INDEX_FORMAT}) + "\n")
+
+    def write_block(self, key: str, hashes: Dict[str, str]):
+        self._file.write(json.dumps(key) + "\t" + json.dumps(hashes, separators=(",", ":")) + "\n")
+
+    def close(self):
+        self._file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+class PreviousIndex:
+    """
+    Indice di un export precedente letto a blocchi mentre si genera il nuovo NodeSet:
+    con la stessa installazione i blocchi arrivano nello stesso ordine e in memoria
+    c'è un blocco alla volta; si legge in avanti solo per blocchi rimossi o spostati.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, encoding="utf-8")
+        try:
+            header = json.loads(self._file.readline())
+            if not isinstance(header, dict) or header.get("format") != INDEX_FORMAT:
+                raise ValueError(f"{path}: indice di una versione precedente, rigenerare l'export completo")
+            self._pending: Dict[str, Dict[str, str]] = {}
+            self._keys = set()
+            start = self._file.tell()
+            for line in self._file:
+                self._keys.add(json.loads(line.partition("\t")[0]))
+            self._file.seek(start)
+        except ValueError:
+            self._file.close()
+            raise
+
+    def block(self, key: str) -> Dict[str, str]:
+        """Impronte precedenti del blocco con questa radice ({} se il blocco è nuovo)"""
+        hashes = self._pending.pop(key, None)
+        if hashes is not None or key not in self._keys:
+            return hashes or {}
+        for line in self._file:
+            line_key, _, data = line.partition("\t")
+            line_key = json.loads(line_key)
+            if line_key == key:
+                return json.loads(data)
+            # Blocco rimosso o che arriverà più avanti nel nuovo ordine
+            self._pending[line_key] = json.loads(data)
+        return {}
+
+    def release(self, key: str, hashes: Dict[str, str]):
+        """Blocco confrontato: i NodeId rimasti (es. valvole tolte) sono rimossi"""
+        if hashes:
+            self._pending[key] = hashes
+
+    def remaining(self) -> Iterator[str]:
+        """NodeId precedenti non più generati"""
+        for hashes in self._pending.values():
+            yield from hashes
+        self._pending.clear()
+        for line in self._file:
+            yield from json.loads(line.partition("\t")[2])
+
+    def close(self):
+        self._file.close()
+
+def write_nodeset(stations, output_file: str, with_index: bool = False) -> int:
+    """
+    Scrive il NodeSet generato su file, restituisce i byte scritti. Con with_index
+    scrive accanto anche l'indice delle impronte, base per un export --diff successivo.
+    """
+    written = 0
+    with open(output_file, "w", encoding="utf-8") as f:
+        if not with_index:
+            for chunk in generate_nodeset(stations):
+                f.write(chunk)
+                written += len(chunk)
+            return written
+        index = IndexWriter(index_path(output_file))
+        f.write(header_xml())
+        for block in iter_node_blocks(stations):
+            index.write_block(block[0][0], _block_hashes(block))
+            chunk = "".join(node[1] for node in block)
+            f.write(chunk)
+            written += len(chunk)
+        f.write(FOOTER_XML)
+    index.close()
+    return written
+
+def _delta_extension(added: List[str], changed: List[str], removed: List[str]) -> str:
+    """Elenco dei NodeId aggiunti, modificati e rimossi (ignorato dagli importer standard)"""
+    def node_list(tag: str, nodeids: List[str]) -> str:
+        items = "".join(f"<NodeId>{nodeid}</NodeId>" for nodeid in nodeids)
+        return f"<{tag}>{items}</{tag}>"
+    return ("  <Extensions>\n    <Extension>\n      <IrrigationDelta>"
+            f"{node_list('Added', added)}{node_list('Changed', changed)}{node_list('Removed', removed)}"
+            "</IrrigationDelta>\n    </Extension>\n  </Extensions>\n")
+
+def write_nodeset_delta(stations, output_file: str, previous: PreviousIndex) -> Dict[str, int]:
+    """
+    Scrive solo i nodi aggiunti o modificati rispetto all'indice di un export
+    precedente, più l'elenco dei nodi rimossi. Se cambia un oggetto viene
+    riscritto anche il suo sottoalbero, così il delta si applica da solo.
+    Il confronto procede blocco per blocco (una stazione alla volta).
+    """
+    added: List[str] = []
+    changed: List[str] = []
+    index = IndexWriter(index_path(output_file))
+    body_path = output_file + ".body"
+    with open(body_path, "w", encoding="utf-8") as body:
+        for block in iter_node_blocks(stations):
+            hashes = _block_hashes(block)
+            index.write_block(block[0][0], hashes)
+            old_hashes = previous.block(block[0][0])
+            replaced_prefix = None
+            for nodeid, xml, digest in block:
+                old = old_hashes.pop(nodeid, None)
+                if old is None:
+                    added.append(nodeid)
+                elif old != digest or (replaced_prefix and nodeid.startswith(replaced_prefix)):
+                    changed.append(nodeid)
+                    if replaced_prefix is None and not xml.startswith("  <UAVariable"):
+                        replaced_prefix = nodeid + "."
+                else:
+                    continue
+                body.write(xml)
+            previous.release(block[0][0], old_hashes)
+    removed = list(previous.remaining())
+    index.close()
+
+    # Intestazione con l'elenco delle modifiche, poi il corpo già serializzato
+    with open(output_file, "w", encoding="utf-8") as f, open(body_path, encoding="utf-8") as body:
+        f.write(header_xml(extensions=_delta_extension(added, changed, removed)))
+        shutil.copyfileobj(body, f)
+        f.write(FOOTER_XML)
+    os.remove(body_path)
+    return {"added": len(added), "changed": len(changed), "removed": len(removed)}
+
+def print_help():
+    """Mostra l'help del programma"""
+    print("""
+🌱 Export NodeSet - Sistema di Irrigazione
+
+UTILIZZO:
+    python export_nodeset.py [OPZIONI]
+
+OPZIONI:
+    -h, --help          Mostra questo messaggio di aiuto
+    -o FILE             File di output (default: irrigation_professional_nodeset.xml)
+    -c FILE             Installazione da file JSON ({"stations": [...]} come INSTALLATION_CONFIG)
+    --valves N          Genera un'installazione sintetica con N valvole
+    --index             Scrive anche l'indice delle impronte dei nodi (FILE.xml.index),
+                        base per un successivo export --diff
+    --diff INDICE       Scrive solo le differenze rispetto all'indice di un export
+                        precedente, applicabili al server in esecuzione con il
+                        metodo ApplyNodeSetDelta (scrive anche il nuovo indice)
+    --via-server        Usa il vecchio export tramite server asyncua temporaneo
+    """)
+
+def main():
+    """Generazione NodeSet senza server"""
+    args = sys.argv[1:]
+
+    if "-h" in args or "--help" in args:
+        print_help()
+        return True
+
+    output_file = "irrigation_professional_nodeset.xml"
+    stations = INSTALLATION_CONFIG["stations"]
+    try:
+        if "-o" in args:
+            output_file = args[args.index("-o") + 1]
+        if "-c" in args:
+            with open(args[args.index("-c") + 1]) as f:
+                stations = json.load(f)["stations"]
+        if "--valves" in args:
+            stations = synthetic_installation(int(args[args.index("--valves") + 1]))
+        previous = PreviousIndex(args[args.index("--diff") + 1]) if "--diff" in args else None
+    except (IndexError, ValueError, OSError, KeyError) as e:
+        print(f"❌ Argomenti non validi: {e}")
+        return False
+
+    started = time.perf_counter()
+    if previous is not None:
+        print(f"🌱 Generazione delta NodeSet in {output_file}...")
+        try:
+            counts = write_nodeset_delta(stations, output_file, previous)
+        finally:
+            previous.close()
+        elapsed = time.perf_counter() - started
+        print(f"✅ Delta generato in {elapsed:.2f}s: {counts['added']} aggiunti, "
+              f"{counts['changed']} modificati, {counts['removed']} rimossi")
+    else:
+        print(f"🌱 Generazione NodeSet in {output_file}...")
+        written = write_nodeset(stations, output_file, with_index="--index" in args)
+        elapsed = time.perf_counter() - started
+        print(f"✅ NodeSet generato in {elapsed:.2f}s ({written / 1_000_000:.1f} MB)")
+    print(f"📁 File creato: {os.path.abspath(output_file)}")
+    if "--index" in args or previous is not None:
+        print(f"🗂️  Indice: {os.path.abspath(index_path(output_file))}")
+    return True
+
 if __name__ == "__main__":
+    if "--via-server" not in sys.argv:
+        sys.exit(0 if main() else 1)
+    
     success = asyncio.run(export_professional_nodeset())
     
     if success:
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Registro di audit dei comandi e delle transizioni di stato
+
+Il loop di aggiornamento (e le valvole) accodano gli eventi in memoria (O(1),
+nessuna scrittura su stdout o su disco); un thread di scrittura li appende in
+batch a un file JSON-lines. Il file corrente viene ruotato quando supera
+`max_bytes` o è aperto da più di `rotate_interval` secondi: è compresso con gzip
+in audit-AAAAMMGG-HHMMSS.jsonl.gz (istante di apertura) e si conservano solo gli
+ultimi `backup_count` file ruotati. All'avvio un file lasciato da un'esecuzione
+precedente viene ruotato subito.
+
+Eventi (ts = epoch secondi, ev = tipo):
+    {"ts": ..., "ev": "command", "valve": "...", "action": "start", "duration": 300,
+     "id": "...", "source": "write"}                          comando accodato
+    {"ts": ..., "ev": "rejected", "valve": "...", "action": "stop", "source": "method",
+     "status": "BadServerTooBusy"}                            comando rifiutato
+    {"ts": ..., "ev": "system", "on": false}                  sistema acceso/spento
+    {"ts": ..., "ev": "start", "valve": "...", "mode": "Manual", "duration": 300}
+    {"ts": ..., "ev": "resume", "valve": "...", "mode": "Automatic", "remaining": 120}
+    {"ts": ..., "ev": "stop", "valve": "...", "remaining": 80}  fermata prima della fine
+    {"ts": ..., "ev": "complete", "valve": "..."}             irrigazione conclusa
+
+Nei worker di simulazione le valvole scrivono in un AuditBuffer, svuotato a ogni
+tick e inviato al server insieme ai delta di stato.
+"""
+
+import collections
+import glob
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+CURRENT_FILE = "audit.jsonl"
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_ROTATE_INTERVAL = 24 * 3600.0
+DEFAULT_BACKUP_COUNT = 30
+
+class AuditBuffer:
+    """Eventi accodati in memoria; deque: append/popleft atomici tra thread"""
+
+    def __init__(self):
+        self._queue = collections.deque()
+
+    def record(self, event: str, ts: Optional[float] = None, **fields):
+        fields["ts"] = time.time() if ts is None else ts
+        fields["ev"] = event
+        self._queue.append(fields)
+
+    def extend(self, records: Iterable[Dict]):
+        """Eventi già formati (da un worker di simulazione)"""
+        self._queue.extend(records)
+
+    def drain(self) -> List[Dict]:
+        records = []
+        while self._queue:
+            records.append(self._queue.popleft())
+        return records
+
+class AuditLog(AuditBuffer):
+    """Registro di audit con scrittura in batch e rotazione compressa in background"""
+
+    def __init__(self, directory: str = "audit", flush_interval: float = 1.0,
+                 max_bytes: int = DEFAULT_MAX_BYTES, rotate_interval: float = DEFAULT_ROTATE_INTERVAL,
+                 backup_count: int = DEFAULT_BACKUP_COUNT):
+        super().__init__()
+        self.directory = directory
+        self.path = os.path.join(directory, CURRENT_FILE)
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.written = 0
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._size = 0
+        self._opened_at = 0.0
+
+    # ------------------------------------------------------------------
+    # Thread di scrittura
+    # ------------------------------------------------------------------
+    def start(self):
+        """Avvia il thread di scrittura (ruota il file lasciato dall'esecuzione precedente)"""
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            self._rotate(os.path.getmtime(self.path))
+        self._open()
+        self._thread = threading.Thread(target=self._writer_loop, name="audit-log", daemon=True)
+        self._thread.start()
+
+    def _open(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+        self._opened_at = time.time()
+
+    def _writer_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self._flush()
+                if self._size and time.time() - self._opened_at >= self.rotate_interval:
+                    self._file.close()
+                    self._rotate(self._opened_at)
+                    self._open()
+            except OSError as e:
+                # Disco pieno o directory non scrivibile: il batch è perso, si riprova al giro dopo
+                print(f"⚠️  Registro di audit non scrivibile: {e}")
+                if self._file.closed:
+                    self._open()
+        self._flush()
+
+    def _flush(self):
+        """Scrive in un unico batch tutti gli eventi accodati; ruota oltre max_bytes"""
+        records = self.drain()
+        if not records:
+            return
+        data = "".join(json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n"
+                       for record in records)
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data.encode("utf-8"))
+        self.written += len(records)
+        if self._size >= self.max_bytes:
+            self._file.close()
+            self._rotate(self._opened_at)
+            self._open()
+
+    def _rotate(self, opened_at: float):
+        """Comprime il file corrente con gzip e scarta i file ruotati più vecchi"""
+        stamp = datetime.fromtimestamp(opened_at).strftime("%Y%m%d-%H%M%S")
+        target = os.path.join(self.directory, f"audit-{stamp}.jsonl.gz")
+        suffix = 1
+        while os.path.exists(target):
+            target = os.path.join(self.directory, f"audit-{stamp}-{suffix}.jsonl.gz")
+            suffix += 1
+        with open(self.path, "rb") as source, gzip.open(target + ".tmp", "wb") as compressed:
+            shutil.copyfileobj(source, compressed)
+        os.replace(target + ".tmp", target)
+        os.remove(self.path)
+
+        rotated = sorted(glob.glob(os.path.join(self.directory, "audit-*.jsonl.gz")), key=os.path.getmtime)
+        for old in rotated[:max(0, len(rotated) - self.backup_count)]:
+            os.remove(old)
+
+    def close(self):
+        """Scrive gli eventi pendenti e ferma il thread"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+        self._file.close()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Orologi iniettabili per la simulazione del sistema di irrigazione
+
+SystemClock usa l'ora reale; VirtualClock viene fatto avanzare dal chiamante
+(simulazione a eventi discreti, test, what-if stagionali).
+"""
+
+from datetime import datetime, timedelta
+
+class SystemClock:
+    """Orologio di sistema (tempo reale)"""
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+class VirtualClock:
+    """Orologio virtuale controllato dal simulatore"""
+
+    def __init__(self, start: datetime):
+        self._now = start
+
+    def now(self) -> datetime:
+        return self._now
+
+    def set(self, when: datetime):
+        """Porta l'orologio a un istante (mai indietro)"""
+        if when > self._now:
+            self._now = when
+
+    def advance(self, seconds: float):
+        """Avanza l'orologio di alcuni secondi"""
+        self._now += timedelta(seconds=seconds)
+
+# Orologio condiviso di default
+SYSTEM_CLOCK = SystemClock()
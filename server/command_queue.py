@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Coda dei comandi del server con coalescenza e contropressione
+
+I comandi arrivano nel momento della scrittura (callback PostWrite sulle variabili
+Commands.*) o della chiamata ai metodi, non più al passaggio del tick: due
+scritture tra un tick e l'altro non si perdono. Il tick ne preleva al più
+`per_tick`.
+
+    - coalescenza per valvola: in coda c'è al più un comando per valvola e l'ultimo
+      sostituisce i precedenti (start seguito da stop = stop), mantenendo il posto;
+      il comando sostituito viene restituito al chiamante, che lo chiude come "coalesced"
+    - equità tra sessioni: una corsia per sessione (scritture e metodi),
+      servite a turno; una sessione che invia migliaia di comandi non ritarda le altre
+    - limite di frequenza per sessione (token bucket): oltre il limite il comando è
+      rifiutato con BadTooManyOperations
+    - coda piena (`capacity` valvole in attesa): rifiutato con BadServerTooBusy
+I contatori (profondità, coalescenze, rifiuti) sono pubblicati in Diagnostics.
+"""
+
+import collections
+import time
+from typing import Dict, Hashable, List, Optional
+
+from asyncua import ua
+
+# Valvole con un comando in attesa oltre le quali la coda è piena
+DEFAULT_CAPACITY = 1000
+# Comandi prelevati per tick
+DEFAULT_PER_TICK = 200
+# Limite per sessione: comandi al secondo; la raffica massima vale BURST_SECONDS secondi di comandi
+DEFAULT_RATE = 500.0
+BURST_SECONDS = 2.0
+# Oltre queste corsie con limite si scartano quelle inattive (sessioni chiuse)
+MAX_BUCKETS = 1000
+
+class QueuedCommand:
+    """Comando in attesa (received = istante di arrivo, epoch)"""
+
+    __slots__ = ("valve_id", "start", "stop", "duration", "correlation_id", "client_time", "source",
+                 "lane", "received")
+
+    def __init__(self, valve_id: str, start: bool, stop: bool, duration: int, correlation_id: str,
+                 client_time: Optional[float], source: str, lane: Hashable):
+        self.valve_id = valve_id
+        self.start = start
+        self.stop = stop
+        self.duration = duration
+        self.correlation_id = correlation_id
+        self.client_time = client_time
+        self.source = source
+        self.lane = lane
+        self.received = time.time()
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+class CommandQueue:
+    """Comandi in attesa per valvola, corsie per sessione servite a turno"""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, per_tick: int = DEFAULT_PER_TICK,
+                 rate: float = DEFAULT_RATE, burst: Optional[float] = None):
+        self.capacity = capacity
+        self.per_tick = per_tick
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate * BURST_SECONDS)
+        # valvola → comando in attesa; corsia → valvole in ordine di arrivo
+        self._pending: Dict[str, QueuedCommand] = {}
+        self._lanes: Dict[Hashable, collections.deque] = collections.OrderedDict()
+        self._buckets: Dict[Hashable, TokenBucket] = {}
+
+        self.submitted = 0
+        self.coalesced = 0
+        self.rejected_busy = 0
+        self.rejected_rate = 0
+        self.dispatched = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def pending(self, valve_id: str) -> Optional[QueuedCommand]:
+        """Comando in attesa per la valvola"""
+        return self._pending.get(valve_id)
+
+    def _bucket(self, lane: Hashable) -> TokenBucket:
+        bucket = self._buckets.get(lane)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._prune_buckets()
+            bucket = self._buckets[lane] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def submit(self, command: QueuedCommand) -> Optional[QueuedCommand]:
+        """
+        Accoda il comando; restituisce quello sostituito (coalescenza) o None.
+        Solleva UaStatusCodeError (BadTooManyOperations, BadServerTooBusy) se rifiutato.
+        """
+        if not self._bucket(command.lane).take():
+            self.rejected_rate += 1
+            raise ua.UaStatusCodeError(ua.StatusCodes.BadTooManyOperations)
+        if command.valve_id not in self._pending and len(self._pending) >= self.capacity:
+            self.rejected_busy += 1
+            raise ua.UaStatusCodeError(ua.StatusCodes.BadServerTooBusy)
+        return self._insert(command)
+
+    def submit_many(self, commands: List[QueuedCommand], rate_limited: bool = True) -> List[QueuedCommand]:
+        """
+        Accoda tutti i comandi o nessuno (metodo ExecuteCommands, ripristino dal journal);
+        restituisce i comandi sostituiti per coalescenza.
+        Il blocco è una sola richiesta: consuma un solo gettone del limite di frequenza.
+        """
+        if rate_limited and commands and not self._bucket(commands[0].lane).take():
+            self.rejected_rate += len(commands)
+            raise ua.UaStatusCodeError(ua.StatusCodes.BadTooManyOperations)
+        new_valves = {command.valve_id for command in commands} - self._pending.keys()
+        if len(self._pending) + len(new_valves) > self.capacity:
+            self.rejected_busy += len(commands)
+            raise ua.UaStatusCodeError(ua.StatusCodes.BadServerTooBusy)
+        replaced = [self._insert(command) for command in commands]
+        return [command for command in replaced if command is not None]
+
+    def _insert(self, command: QueuedCommand) -> Optional[QueuedCommand]:
+        self.submitted += 1
+        previous = self._pending.get(command.valve_id)
+        if previous is not None:
+            # Resta nella corsia e nella posizione del comando sostituito
+            command.lane = previous.lane
+            self._pending[command.valve_id] = command
+            self.coalesced += 1
+            return previous
+        self._pending[command.valve_id] = command
+        lane = self._lanes.get(command.lane)
+        if lane is None:
+            lane = self._lanes[command.lane] = collections.deque()
+        lane.append(command.valve_id)
+        return None
+
+    def drain(self) -> List[QueuedCommand]:
+        """Fino a per_tick comandi, uno per corsia a ogni giro"""
+        commands = []
+        while self._lanes and len(commands) < self.per_tick:
+            for lane_id in list(self._lanes):
+                lane = self._lanes[lane_id]
+                command = self._pending.pop(lane.popleft(), None)
+                if lane:
+                    # In fondo al giro: il prossimo tick riparte dalla corsia successiva
+                    self._lanes.move_to_end(lane_id)
+                else:
+                    del self._lanes[lane_id]
+                if command is not None:
+                    commands.append(command)
+                    if len(commands) >= self.per_tick:
+                        break
+        self.dispatched += len(commands)
+        return commands
+
+    def discard(self, valve_id: str):
+        """Valvola rimossa: il comando in attesa non verrà eseguito (la corsia lo salta)"""
+        self._pending.pop(valve_id, None)
+
+    def _prune_buckets(self):
+        """Toglie i limiti delle corsie inattive: un bucket di nuovo pieno equivale a uno nuovo"""
+        now = time.monotonic()
+        idle = [lane for lane, bucket in self._buckets.items()
+                if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.burst]
+        for lane in idle:
+            del self._buckets[lane]
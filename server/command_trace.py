@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Tracciamento end-to-end dei comandi
+
+Ogni comando (scrittura delle variabili Commands, metodo ExecuteCommand o
+ExecuteCommands) porta un id di correlazione e il timestamp del client. Il server
+annota gli istanti di ricezione, di applicazione alla valvola e di pubblicazione
+dello stato; i record completati finiscono in un ring buffer in memoria
+(deque a lunghezza fissa, O(1) per comando) che si può scaricare su richiesta.
+
+Le latenze end-to-end degli ultimi comandi alimentano i percentili mobili
+pubblicati in IrrigationSystem/Diagnostics.
+"""
+
+import collections
+import copy
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+class CommandTrace:
+    """Istanti (epoch, secondi) di un comando"""
+
+    __slots__ = ("correlation_id", "valve_id", "action", "source", "client_time",
+                 "received", "applied", "published", "coalesced_by")
+
+    def __init__(self, correlation_id: str, valve_id: str, action: str, source: str,
+                 client_time: Optional[float], received: float):
+        self.correlation_id = correlation_id
+        self.valve_id = valve_id
+        self.action = action
+        self.source = source
+        self.client_time = client_time
+        self.received = received
+        self.applied: Optional[float] = None
+        self.published: Optional[float] = None
+        # Id del comando che lo ha sostituito in coda (mai eseguito)
+        self.coalesced_by: Optional[str] = None
+
+    def end_to_end_ms(self) -> Optional[float]:
+        """Dal timestamp del client (o dalla ricezione) alla pubblicazione (o all'applicazione)"""
+        end = self.published if self.published is not None else self.applied
+        if end is None:
+            return None
+        start = self.client_time if self.client_time is not None else self.received
+        return (end - start) * 1000.0
+
+    def to_dict(self) -> Dict:
+        def ms(start, end):
+            return round((end - start) * 1000.0, 3) if start is not None and end is not None else None
+        return {
+            "id": self.correlation_id,
+            "valve": self.valve_id,
+            "action": self.action,
+            "source": self.source,
+            "client_time": self.client_time,
+            "received": self.received,
+            "applied": self.applied,
+            "published": self.published,
+            "client_to_received_ms": ms(self.client_time, self.received),
+            "received_to_applied_ms": ms(self.received, self.applied),
+            "applied_to_published_ms": ms(self.applied, self.published),
+            "end_to_end_ms": round(self.end_to_end_ms(), 3) if self.end_to_end_ms() is not None else None,
+            "coalesced_by": self.coalesced_by,
+        }
+
+def epoch(timestamp: Optional[datetime]) -> Optional[float]:
+    """Timestamp OPC-UA (UTC, con o senza tzinfo) in secondi epoch"""
+    if timestamp is None:
+        return None
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+def new_correlation_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+class CommandTracer:
+    """Comandi in corso per valvola + ring buffer dei comandi completati"""
+
+    def __init__(self, capacity: int = 10000, window: int = 1000):
+        self.records = collections.deque(maxlen=capacity)
+        self._latencies = collections.deque(maxlen=window)
+        self._in_flight: Dict[str, CommandTrace] = {}
+        self._percentiles: Optional[Tuple[float, float, float]] = None
+        self.completed = 0
+
+    def received(self, valve_id: str, action: str, source: str, correlation_id: str = "",
+                 client_time: Optional[float] = None, received: Optional[float] = None) -> CommandTrace:
+        """
+        Comando inoltrato alla valvola (received = arrivo nella coda del server, default adesso);
+        un comando ancora in corso sulla stessa valvola viene chiuso
+        """
+        previous = self._in_flight.pop(valve_id, None)
+        if previous is not None:
+            self._finish(previous)
+        trace = CommandTrace(correlation_id or new_correlation_id(), valve_id, action, source,
+                             client_time, time.time() if received is None else received)
+        self._in_flight[valve_id] = trace
+        return trace
+
+    def coalesced(self, valve_id: str, action: str, source: str, correlation_id: str,
+                  client_time: Optional[float], received: float, replaced_by: Optional[str]) -> CommandTrace:
+        """
+        Comando sostituito in coda da uno successivo sulla stessa valvola: chiuso subito
+        (pubblicato come concluso) senza entrare nei percentili di latenza
+        """
+        trace = CommandTrace(correlation_id, valve_id, action, source, client_time, received)
+        trace.coalesced_by = replaced_by
+        trace.published = time.time()
+        self.records.append(trace)
+        self.completed += 1
+        return trace
+
+    def applied(self, valve_id: str):
+        trace = self._in_flight.get(valve_id)
+        if trace is not None and trace.applied is None:
+            trace.applied = time.time()
+
+    def published(self, valve_id: str) -> Optional[CommandTrace]:
+        """Stato della valvola pubblicato: chiude il comando applicato"""
+        trace = self._in_flight.get(valve_id)
+        if trace is None or trace.applied is None:
+            return None
+        trace.published = time.time()
+        del self._in_flight[valve_id]
+        self._finish(trace)
+        return trace
+
+    def settle(self) -> List[CommandTrace]:
+        """
+        Fine tick: i comandi applicati senza cambi di stato (es. stop di una valvola
+        già ferma) non verranno mai pubblicati e si chiudono qui.
+        """
+        settled = [trace for trace in self._in_flight.values() if trace.applied is not None]
+        for trace in settled:
+            del self._in_flight[trace.valve_id]
+            self._finish(trace)
+        return settled
+
+    def discard(self, valve_id: str):
+        """Valvola rimossa dall'installazione"""
+        trace = self._in_flight.pop(valve_id, None)
+        if trace is not None:
+            self._finish(trace)
+
+    def _finish(self, trace: CommandTrace):
+        self.records.append(trace)
+        self.completed += 1
+        latency = trace.end_to_end_ms()
+        if latency is not None:
+            self._latencies.append(latency)
+            self._percentiles = None
+
+    def percentiles(self) -> Tuple[float, float, float]:
+        """p50, p95, p99 (ms) degli ultimi comandi; ricalcolati solo se ne sono arrivati di nuovi"""
+        if self._percentiles is None:
+            ordered = sorted(self._latencies)
+            if not ordered:
+                self._percentiles = (0.0, 0.0, 0.0)
+            else:
+                last = len(ordered) - 1
+                self._percentiles = tuple(ordered[min(last, int(round(q * last)))] for q in (0.50, 0.95, 0.99))
+        return self._percentiles
+
+    def snapshot(self) -> List[CommandTrace]:
+        """Copia del ring buffer (da fare nel loop; la scrittura può avvenire altrove)"""
+        return list(self.records) + [copy.copy(trace) for trace in self._in_flight.values()]
+
+def dump_traces(traces: List[CommandTrace], filename: str) -> int:
+    """Scrive i record in JSON lines (pensato per girare in un thread)"""
+    with open(filename, "w", encoding="utf-8") as f:
+        for trace in traces:
+            f.write(json.dumps(trace.to_dict()) + "\n")
+    return len(traces)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Metriche di prestazione del server
+
+Contatori in memoria aggiornati in modo incrementale dal loop di aggiornamento
+(costo O(1) per evento): durata del tick con istogramma a bucket fissi,
+letture/scritture per tick, latenza dei comandi, ritardo dell'event loop.
+Il server li pubblica una volta per tick nell'oggetto IrrigationSystem/Diagnostics
+e, se richiesto, sull'endpoint OpenMetrics (MetricsExporter).
+"""
+
+import asyncio
+import time
+from typing import Dict
+
+from asyncua.server.internal_session import InternalSession
+
+from information_model import TICK_HISTOGRAM_BOUNDS_MS
+from openmetrics import Histogram, MetricsRegistry, labels
+
+def active_sessions() -> int:
+    """
+    Sessioni OPC-UA attive. asyncua non espone il conteggio con un'API pubblica:
+    si legge il suo contatore interno, con 0 se una versione futura lo rinomina.
+    """
+    return getattr(InternalSession, "_current_connections", 0)
+
+class ServerMetrics:
+    """Contatori del loop di aggiornamento del server"""
+
+    # Peso del nuovo campione nella media mobile esponenziale della latenza
+    LATENCY_SMOOTHING = 0.2
+
+    def __init__(self):
+        self.tick_histogram = Histogram(TICK_HISTOGRAM_BOUNDS_MS)
+        self.last_tick_ms = 0.0
+        self._tick_start = 0.0
+
+        # Letture/scritture di nodi: correnti, dell'ultimo tick completato e totali
+        self.tick_reads = 0
+        self.tick_writes = 0
+        self.last_reads = 0
+        self.last_writes = 0
+        self.total_reads = 0
+        self.total_writes = 0
+
+        # Latenza comandi: dalla lettura del comando sul nodo all'applicazione alla valvola
+        self._pending_commands: Dict[str, float] = {}
+        self.commands_applied = 0
+        self.command_latency_ms = 0.0
+        self.command_latency_max_ms = 0.0
+
+        self.loop_lag_ms = 0.0
+
+        # Notifiche delle sottoscrizioni (per il calcolo del rate)
+        self.notifications_per_second = 0.0
+        self._notifications_seen = 0
+        self._notifications_at = time.monotonic()
+
+    # ------------------------------------------------------------------
+    # Tick
+    # ------------------------------------------------------------------
+    def begin_tick(self):
+        self.tick_reads = 0
+        self.tick_writes = 0
+        self._tick_start = time.perf_counter()
+
+    def end_tick(self):
+        self.last_tick_ms = (time.perf_counter() - self._tick_start) * 1000.0
+        self.tick_histogram.observe(self.last_tick_ms)
+        self.last_reads = self.tick_reads
+        self.last_writes = self.tick_writes
+        self.total_reads += self.tick_reads
+        self.total_writes += self.tick_writes
+
+    # ------------------------------------------------------------------
+    # Comandi
+    # ------------------------------------------------------------------
+    def command_received(self, valve_id: str):
+        self._pending_commands.setdefault(valve_id, time.monotonic())
+
+    def command_applied(self, valve_id: str):
+        received = self._pending_commands.pop(valve_id, None)
+        if received is None:
+            return
+        latency = (time.monotonic() - received) * 1000.0
+        self.commands_applied += 1
+        if self.commands_applied == 1:
+            self.command_latency_ms = latency
+        else:
+            self.command_latency_ms += self.LATENCY_SMOOTHING * (latency - self.command_latency_ms)
+        self.command_latency_max_ms = max(self.command_latency_max_ms, latency)
+
+    # ------------------------------------------------------------------
+    # Sottoscrizioni
+    # ------------------------------------------------------------------
+    def update_notification_rate(self, subscriptions) -> float:
+        """
+        Messaggi di notifica pubblicati al secondo (dai numeri di sequenza delle sottoscrizioni).
+        Il numero di sequenza è un attributo interno di asyncua: se manca la sottoscrizione
+        non viene contata e il rate resta a 0 invece di interrompere la diagnostica.
+        """
+        now = time.monotonic()
+        seen = sum(getattr(sub, "_notification_seq", 1) - 1 for sub in subscriptions)
+        elapsed = now - self._notifications_at
+        if elapsed > 0:
+            # Sottoscrizioni cancellate fanno scendere il totale: non è un rate negativo
+            self.notifications_per_second = max(0, seen - self._notifications_seen) / elapsed
+        self._notifications_seen = seen
+        self._notifications_at = now
+        return self.notifications_per_second
+
+    # ------------------------------------------------------------------
+    # Event loop
+    # ------------------------------------------------------------------
+    async def watch_loop_lag(self, interval: float = 0.25):
+        """Misura di quanto il loop ritarda il risveglio di un task che dorme interval secondi"""
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(interval)
+            self.loop_lag_ms = max(0.0, (time.monotonic() - started - interval) * 1000.0)
+
+class MetricsExporter:
+    """
+    Metriche del server per l'endpoint OpenMetrics.
+    Le serie per valvola sono aggiornate solo quando arriva un delta di stato;
+    l'acqua erogata viene accumulata tra un delta e il successivo di una valvola aperta.
+    """
+
+    # Servizi OPC-UA conteggiati (richieste dei client esterni)
+    OPCUA_SERVICES = ("read", "write", "create_monitored_items", "modify_monitored_items",
+                      "delete_monitored_items")
+
+    def __init__(self, metrics: ServerMetrics):
+        self.metrics = metrics
+        registry = self.registry = MetricsRegistry()
+
+        self.irrigating = registry.gauge("irrigation_valve_irrigating", "Valvola in irrigazione (1) o ferma (0)")
+        self.remaining = registry.gauge("irrigation_valve_remaining_seconds", "Tempo di irrigazione rimanente",
+                                        unit="seconds")
+        self.water = registry.counter("irrigation_valve_water_liters", "Acqua erogata dalla valvola",
+                                      unit="liters")
+        registry.histogram("irrigation_tick_duration_seconds", "Durata del tick di aggiornamento",
+                           metrics.tick_histogram, unit="seconds", scale=0.001)
+        registry.counter_callback("irrigation_node_reads", "Letture di nodi nel loop di aggiornamento",
+                                  lambda: metrics.total_reads)
+        registry.counter_callback("irrigation_node_writes", "Scritture di nodi nel loop di aggiornamento",
+                                  lambda: metrics.total_writes)
+        registry.gauge_callback("irrigation_command_latency_seconds", "Latenza media dei comandi (EWMA)",
+                                lambda: metrics.command_latency_ms / 1000.0, unit="seconds")
+        registry.gauge_callback("irrigation_event_loop_lag_seconds", "Ritardo dell'event loop",
+                                lambda: metrics.loop_lag_ms / 1000.0, unit="seconds")
+        self.sessions = registry.gauge("irrigation_opcua_sessions", "Sessioni OPC-UA attive")
+        self.requests = registry.counter("irrigation_opcua_requests", "Richieste OPC-UA dei client per servizio")
+
+        self._request_counts: Dict[str, int] = {}
+        self._request_labels: Dict[str, str] = {}
+        for service in self.OPCUA_SERVICES:
+            self._request_counts[service] = 0
+            self._request_labels[service] = labels(service=service)
+            self.requests.set(self._request_labels[service], 0)
+
+        # full_valve_id → (etichette, portata l/min, litri erogati, istante dell'ultimo delta se aperta)
+        self._valves: Dict[str, list] = {}
+
+    def add_valve(self, full_valve_id: str, flow_rate: float):
+        if full_valve_id in self._valves:
+            return
+        station_id, valve_id = full_valve_id.split("_", 1)
+        label_set = labels(station=station_id, valve=valve_id)
+        self._valves[full_valve_id] = [label_set, flow_rate, 0.0, None]
+        self.irrigating.set(label_set, 0)
+        self.remaining.set(label_set, 0)
+        self.water.set(label_set, 0.0)
+
+    def remove_valve(self, full_valve_id: str):
+        entry = self._valves.pop(full_valve_id, None)
+        if entry is not None:
+            for family in (self.irrigating, self.remaining, self.water):
+                family.remove(entry[0])
+
+    def valve_changed(self, full_valve_id: str, is_irrigating: bool, remaining_time: int):
+        entry = self._valves.get(full_valve_id)
+        if entry is None:
+            return
+        label_set, flow_rate, liters, opened_at = entry
+        now = time.monotonic()
+        if opened_at is not None:
+            entry[2] = liters + flow_rate * (now - opened_at) / 60.0
+            self.water.set(label_set, round(entry[2], 3))
+        entry[3] = now if is_irrigating else None
+        self.irrigating.set(label_set, is_irrigating)
+        self.remaining.set(label_set, remaining_time)
+
+    def add_command_queue(self, queue):
+        """Profondità e contatori della coda dei comandi (letti al momento dello scrape)"""
+        registry = self.registry
+        registry.gauge_callback("irrigation_command_queue_depth", "Valvole con un comando in coda",
+                                lambda: queue.depth)
+        registry.counter_callback("irrigation_commands_coalesced", "Comandi sostituiti da uno successivo in coda",
+                                  lambda: queue.coalesced)
+        registry.counter_callback("irrigation_commands_rejected_busy", "Comandi rifiutati a coda piena",
+                                  lambda: queue.rejected_busy)
+        registry.counter_callback("irrigation_commands_rejected_rate", "Comandi rifiutati per limite di frequenza",
+                                  lambda: queue.rejected_rate)
+
+    def set_sessions(self, count: int):
+        self.sessions.set("", count)
+
+    def count_request(self, service: str):
+        self._request_counts[service] += 1
+        self.requests.set(self._request_labels[service], self._request_counts[service])
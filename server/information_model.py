@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Information model dichiarativo del sistema di irrigazione
+
+Unica definizione degli ObjectTypes e delle istanze, usata sia dal server
+(AddNodes in batch) sia da export_nodeset.py (NodeSet2 XML). Ogni tipo viene
+compilato una sola volta in una lista piatta di membri; un'istanza si ottiene
+istanziando il tipo con NodeId stringa derivati dal percorso:
+
+    ns=<ns>;i=1001..1003                                  ObjectTypes
+    ns=<ns>;s=IrrigationValveType.Status.IsIrrigating     membri dei tipi
+    ns=<ns>;s=IrrigationSystem.Stations.Station1.Valve1.Status.IsIrrigating
+"""
+
+from functools import lru_cache
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+from asyncua import ua
+
+NAMESPACE_URI = "http://mvlabs.it/irrigation"
+
+# NodeId numerici degli ObjectTypes (vedi docs/addressspace_design.md)
+TYPE_NODEIDS = {
+    "IrrigationSystemType": 1001,
+    "IrrigationStationType": 1002,
+    "IrrigationValveType": 1003,
+}
+
+SYSTEM_PATH = "IrrigationSystem"
+STATIONS_PATH = "IrrigationSystem.Stations"
+
+# Limiti superiori (ms) dei bucket dell'istogramma della durata del tick; l'ultimo bucket è +Inf
+TICK_HISTOGRAM_BOUNDS_MS = (1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0, 1000.0)
+
+# Membri dei tipi: (percorso, classe, tipo dato, valore di default, scrivibile)
+# Il suffisso "[]" sul tipo dato indica un array monodimensionale
+TYPE_MEMBERS = {
+    "IrrigationValveType": [
+        ("Description", "Variable", "String", "", False),
+        ("Status", "Object", None, None, False),
+        ("Status.IsIrrigating", "Variable", "Boolean", False, False),
+        ("Status.Mode", "Variable", "String", "Off", False),
+        ("Status.RemainingTime", "Variable", "Int32", 0, False),
+        ("Status.NextScheduledStart", "Variable", "DateTime", None, False),
+        # Id di correlazione dell'ultimo comando completato (stato pubblicato)
+        ("Status.LastCommandId", "Variable", "String", "", False),
+        ("Commands", "Object", None, None, False),
+        ("Commands.CommandDuration", "Variable", "Int32", 0, True),
+        ("Commands.CommandStart", "Variable", "Boolean", False, True),
+        ("Commands.CommandStop", "Variable", "Boolean", False, True),
+        ("Commands.CommandId", "Variable", "String", "", True),
+    ],
+    "IrrigationStationType": [
+        ("StationInfo", "Object", None, None, False),
+        ("StationInfo.StationId", "Variable", "String", "", False),
+        ("StationInfo.Description", "Variable", "String", "", False),
+        ("StationInfo.StationType", "Variable", "String", "", False),
+        ("StationInfo.ValveCount", "Variable", "Int32", 0, False),
+        ("SoilMoisture", "Variable", "Double", 0.0, False),
+    ],
+    "IrrigationSystemType": [
+        ("Controller", "Object", None, None, False),
+        ("Controller.SystemState", "Variable", "Boolean", True, True),
+        ("Stations", "Object", None, None, False),
+        # Metriche del server (vedi server/diagnostics.py)
+        ("Diagnostics", "Object", None, None, False),
+        ("Diagnostics.TickCount", "Variable", "UInt32", 0, False),
+        ("Diagnostics.TickDurationMs", "Variable", "Double", 0.0, False),
+        ("Diagnostics.TickDurationBucketsMs", "Variable", "Double[]", list(TICK_HISTOGRAM_BOUNDS_MS), False),
+        ("Diagnostics.TickDurationCounts", "Variable", "UInt32[]", [0] * (len(TICK_HISTOGRAM_BOUNDS_MS) + 1), False),
+        ("Diagnostics.ReadsPerTick", "Variable", "Int32", 0, False),
+        ("Diagnostics.WritesPerTick", "Variable", "Int32", 0, False),
+        ("Diagnostics.CommandLatencyMs", "Variable", "Double", 0.0, False),
+        ("Diagnostics.CommandLatencyMaxMs", "Variable", "Double", 0.0, False),
+        # Percentili mobili end-to-end (timestamp del client → stato pubblicato)
+        ("Diagnostics.CommandLatencyP50Ms", "Variable", "Double", 0.0, False),
+        ("Diagnostics.CommandLatencyP95Ms", "Variable", "Double", 0.0, False),
+        ("Diagnostics.CommandLatencyP99Ms", "Variable", "Double", 0.0, False),
+        ("Diagnostics.ActiveSessions", "Variable", "Int32", 0, False),
+        ("Diagnostics.NotificationsPerSecond", "Variable", "Double", 0.0, False),
+        ("Diagnostics.EventLoopLagMs", "Variable", "Double", 0.0, False),
+        # Coda dei comandi (vedi server/command_queue.py)
+        ("Diagnostics.CommandQueueDepth", "Variable", "UInt32", 0, False),
+        ("Diagnostics.CommandsCoalesced", "Variable", "UInt32", 0, False),
+        ("Diagnostics.CommandsRejectedBusy", "Variable", "UInt32", 0, False),
+        ("Diagnostics.CommandsRejectedRate", "Variable", "UInt32", 0, False),
+    ],
+}
+
+class Member(NamedTuple):
+    """Membro compilato di un tipo"""
+    path: str
+    parent: str          # percorso del genitore, "" = radice del tipo o dell'istanza
+    name: str
+    node_class: str
+    data_type: Optional[str]
+    default: object
+    writable: bool
+
+class Instance(NamedTuple):
+    """Istanza di un tipo nel modello"""
+    path: str
+    parent: Optional[str]  # None = cartella Objects
+    name: str
+    type_name: str
+    values: Dict
+
+@lru_cache(maxsize=None)
+def compile_type(type_name: str) -> tuple:
+    """Membri del tipo in ordine di creazione (i genitori prima dei figli)"""
+    members = []
+    for path, node_class, data_type, default, writable in TYPE_MEMBERS[type_name]:
+        parent, _, name = path.rpartition(".")
+        members.append(Member(path, parent, name, node_class, data_type, default, writable))
+    return tuple(members)
+
+def valve_count(config: Dict) -> int:
+    """Numero di valvole di una stazione (chiave "valves" del server o "valve_count" della config)"""
+    return int(config.get("valves", config.get("valve_count", 0)))
+
+def station_type(count: int) -> str:
+    return "DoubleValve" if count > 1 else "SingleValve"
+
+def valve_description(station_description: str, valve_num: int) -> str:
+    return f"{station_description} - Valvola {valve_num}"
+
+def system_instance() -> Instance:
+    return Instance(SYSTEM_PATH, None, "IrrigationSystem", "IrrigationSystemType", {})
+
+def valve_instance(station_id: str, station_description: str, valve_num: int) -> Instance:
+    base = f"{STATIONS_PATH}.{station_id}"
+    return Instance(f"{base}.Valve{valve_num}", base, f"Valve{valve_num}", "IrrigationValveType",
+                    {"Description": valve_description(station_description, valve_num)})
+
+def station_instances(config: Dict) -> List[Instance]:
+    """La stazione e le sue valvole come istanze dei rispettivi tipi"""
+    count = valve_count(config)
+    description = config.get("description", "")
+    instances = [Instance(f"{STATIONS_PATH}.{config['id']}", STATIONS_PATH, config["id"], "IrrigationStationType", {
+        "StationInfo.StationId": config["id"],
+        "StationInfo.Description": description,
+        "StationInfo.StationType": config.get("type", station_type(count)),
+        "StationInfo.ValveCount": count,
+    })]
+    instances.extend(valve_instance(config["id"], description, num) for num in range(1, count + 1))
+    return instances
+
+def iter_instances(stations) -> Iterator[List[Instance]]:
+    """Istanze del modello a blocchi: il sistema, poi una stazione (con valvole) per blocco"""
+    yield [system_instance()]
+    for config in stations:
+        yield station_instances(config)
+
+# =============================================================================
+# Compilazione in AddNodes per il server
+# =============================================================================
+
+_FOLDER_TYPE = ua.NodeId(ua.ObjectIds.FolderType)
+_BASE_DATA_VARIABLE_TYPE = ua.NodeId(ua.ObjectIds.BaseDataVariableType)
+_HAS_COMPONENT = ua.NodeId(ua.ObjectIds.HasComponent)
+_READ = ua.AccessLevel.CurrentRead.mask
+_READ_WRITE = ua.AccessLevel.CurrentRead.mask | ua.AccessLevel.CurrentWrite.mask
+
+class NodeBatch:
+    """Accumula AddNodesItem e AddReferencesItem del modello da inviare al server in un'unica chiamata"""
+
+    def __init__(self, ns_idx: int):
+        self.ns_idx = ns_idx
+        self.nodes: List[ua.AddNodesItem] = []
+        self.references: List[ua.AddReferencesItem] = []
+
+    def nodeid(self, path) -> ua.NodeId:
+        return ua.NodeId(path, self.ns_idx)
+
+    def type_nodeid(self, type_name: str) -> ua.NodeId:
+        return ua.NodeId(TYPE_NODEIDS[type_name], self.ns_idx)
+
+    def _item(self, nodeid: ua.NodeId, parent: ua.NodeId, reference: ua.NodeId, name: str,
+              node_class: ua.NodeClass, attributes, type_definition: ua.NodeId) -> ua.AddNodesItem:
+        item = ua.AddNodesItem()
+        item.RequestedNewNodeId = nodeid
+        item.ParentNodeId = parent
+        item.ReferenceTypeId = reference
+        item.BrowseName = ua.QualifiedName(name, self.ns_idx)
+        item.NodeClass = node_class
+        item.NodeAttributes = attributes
+        item.TypeDefinition = type_definition
+        self.nodes.append(item)
+        return item
+
+    def _object(self, nodeid, parent, reference, name, type_definition):
+        attrs = ua.ObjectAttributes()
+        attrs.DisplayName = ua.LocalizedText(name)
+        attrs.Description = ua.LocalizedText(name)
+        attrs.EventNotifier = 0
+        return self._item(nodeid, parent, reference, name, ua.NodeClass.Object, attrs, type_definition)
+
+    def _variable(self, nodeid, parent, member: Member, value):
+        is_array = member.data_type.endswith("[]")
+        variant_type = getattr(ua.VariantType, member.data_type.rstrip("[]"))
+        attrs = ua.VariableAttributes()
+        attrs.DisplayName = ua.LocalizedText(member.name)
+        attrs.Description = ua.LocalizedText(member.name)
+        attrs.DataType = ua.NodeId(variant_type.value)
+        if is_array:
+            attrs.Value = ua.Variant(list(value), variant_type, is_array=True)
+            attrs.ValueRank = ua.ValueRank.OneDimension
+            attrs.ArrayDimensions = [0]
+        else:
+            attrs.Value = ua.Variant(value, variant_type)
+            attrs.ValueRank = ua.ValueRank.Scalar
+        attrs.AccessLevel = attrs.UserAccessLevel = _READ_WRITE if member.writable else _READ
+        return self._item(nodeid, parent, _HAS_COMPONENT, member.name, ua.NodeClass.Variable, attrs,
+                          _BASE_DATA_VARIABLE_TYPE)
+
+    def _members(self, base: str, root: ua.NodeId, type_name: str, values: Dict):
+        for member in compile_type(type_name):
+            nodeid = self.nodeid(f"{base}.{member.path}")
+            parent = self.nodeid(f"{base}.{member.parent}") if member.parent else root
+            if member.node_class == "Object":
+                self._object(nodeid, parent, _HAS_COMPONENT, member.name, _FOLDER_TYPE)
+            else:
+                self._variable(nodeid, parent, member, values.get(member.path, member.default))
+
+    def add_types(self):
+        """ObjectTypes con i membri obbligatori (HasModellingRule Mandatory)"""
+        base_object_type = ua.NodeId(ua.ObjectIds.BaseObjectType)
+        for type_name in TYPE_NODEIDS:
+            attrs = ua.ObjectTypeAttributes()
+            attrs.DisplayName = ua.LocalizedText(type_name)
+            attrs.Description = ua.LocalizedText(type_name)
+            attrs.IsAbstract = False
+            type_nodeid = self.type_nodeid(type_name)
+            self._item(type_nodeid, base_object_type, ua.NodeId(ua.ObjectIds.HasSubtype), type_name,
+                       ua.NodeClass.ObjectType, attrs, ua.NodeId())
+
+            first = len(self.nodes)
+            self._members(type_name, type_nodeid, type_name, {})
+            for item in self.nodes[first:]:
+                ref = ua.AddReferencesItem()
+                ref.SourceNodeId = item.RequestedNewNodeId
+                ref.ReferenceTypeId = ua.NodeId(ua.ObjectIds.HasModellingRule)
+                ref.IsForward = True
+                ref.TargetNodeId = ua.NodeId(ua.ObjectIds.ModellingRule_Mandatory)
+                ref.TargetNodeClass = ua.NodeClass.Object
+                self.references.append(ref)
+
+    def add_instance(self, instance: Instance):
+        """Istanzia un tipo: nodo radice tipizzato e copia dei membri con i valori dell'istanza"""
+        if instance.parent is None:
+            parent = ua.NodeId(ua.ObjectIds.ObjectsFolder)
+            reference = ua.NodeId(ua.ObjectIds.Organizes)
+        else:
+            parent = self.nodeid(instance.parent)
+            reference = _HAS_COMPONENT
+        root = self.nodeid(instance.path)
+        self._object(root, parent, reference, instance.name, self.type_nodeid(instance.type_name))
+        self._members(instance.path, root, instance.type_name, instance.values)
+
+    def add_station(self, config: Dict):
+        for instance in station_instances(config):
+            self.add_instance(instance)
+
+    async def commit(self, server) -> int:
+        """Invia il batch al server (un'unica AddNodes e AddReferences); restituisce i nodi creati"""
+        session = server.iserver.isession
+        for result in await session.add_nodes(self.nodes):
+            result.StatusCode.check()
+        if self.references:
+            for status in await session.add_references(self.references):
+                status.check()
+        count = len(self.nodes)
+        self.nodes, self.references = [], []
+        return count
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Configurazione dell'installazione (stazioni e valvole) da file JSON
+
+Formato (lo stesso di INSTALLATION_CONFIG in config/server_config.py):
+    {"stations": [{"id": "Station1", "description": "Giardino Anteriore", "valve_count": 2}]}
+È accettata anche la chiave "valves" al posto di "valve_count".
+
+Il server osserva il file e, quando cambia, applica solo le differenze
+rispetto alle stazioni correnti.
+"""
+
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+def load_installation(path: str) -> List[Dict]:
+    """Legge il file e restituisce le configurazioni delle stazioni normalizzate"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    configs = []
+    seen = set()
+    for entry in data["stations"]:
+        station_id = str(entry["id"])
+        if station_id in seen:
+            raise ValueError(f"Stazione {station_id} duplicata")
+        if "." in station_id or "_" in station_id:
+            raise ValueError(f"Id stazione non valido: {station_id}")
+        valves = int(entry.get("valves", entry.get("valve_count", 0)))
+        if valves < 1:
+            raise ValueError(f"La stazione {station_id} deve avere almeno una valvola")
+        seen.add(station_id)
+        configs.append({"id": station_id, "description": entry.get("description", ""), "valves": valves})
+    return configs
+
+def diff_installation(stations: Dict, configs: List[Dict]) -> Tuple[List[Dict], List[str], List[Dict]]:
+    """
+    Confronta le stazioni correnti (id → StationController) con la nuova configurazione.
+    Restituisce (aggiunte, id rimossi, modificate).
+    """
+    added, updated = [], []
+    wanted = set()
+    for config in configs:
+        wanted.add(config["id"])
+        station = stations.get(config["id"])
+        if station is None:
+            added.append(config)
+        elif (station.description, station.valve_count) != (config["description"], config["valves"]):
+            updated.append(config)
+    removed = [station_id for station_id in stations if station_id not in wanted]
+    return added, removed, updated
+
+class ConfigWatcher:
+    """Controlla periodicamente se il file di configurazione è cambiato (mtime e dimensione)"""
+
+    def __init__(self, path: str, interval: float = 2.0):
+        self.path = path
+        self.interval = interval
+        self._signature = self._stat()
+        self._last_check = time.monotonic()
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def changed(self) -> bool:
+        """True se il file è cambiato dall'ultima volta (al massimo un controllo per intervallo)"""
+        now = time.monotonic()
+        if now - self._last_check < self.interval:
+            return False
+        self._last_check = now
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        return True
@@ -7,11 +7,33 @@ Con ObjectTypes personalizzati e struttura gerarchica completa
 import asyncio
 import logging
 import os
+import time
+import xml.etree.ElementTree as ET
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 
 from asyncua import Server, ua
+from asyncua.common.methods import uamethod
+from asyncua.common.xmlparser import XMLParser
 from asyncua.common.node import Node
+from asyncua.common.callback import CallbackType
+
+import numpy as np
+
+from audit_log import AuditBuffer, AuditLog
+from clock import SYSTEM_CLOCK
+from command_queue import DEFAULT_CAPACITY, DEFAULT_RATE, CommandQueue, QueuedCommand
+from command_trace import CommandTracer, dump_traces, epoch, new_correlation_id
+from diagnostics import MetricsExporter, ServerMetrics, active_sessions
+from information_model import (STATIONS_PATH, SYSTEM_PATH, NodeBatch, compile_type, system_instance,
+                               valve_instance)
+from installation_config import ConfigWatcher, diff_installation, load_installation
+from nodeset_stream import StreamingNodeSetExporter
+from openmetrics import serve_metrics
+from profiler import SamplingProfiler
+from simulation_worker import SimulationPool, collect_deltas
+from soil_model import SoilMoistureModel, WeatherStream
+from state_journal import StateJournal
 
 # Configurazione logging
 logging.basicConfig(level=logging.WARNING)
@@ -20,16 +42,28 @@ logger = logging.getLogger(__name__)
 class ValveController:
     """Controlla un singolo rubinetto/valvola"""
     
-    def __init__(self, valve_id: str, description: str):
+    def __init__(self, valve_id: str, description: str, clock=SYSTEM_CLOCK,
+                 flow_rate: float = 5.0, audit: Optional[AuditBuffer] = None):
         self.valve_id = valve_id
         self.description = description
+        self.clock = clock
+        # Eventi di audit delle transizioni (solo enqueue, None = disattivato)
+        self.audit = audit
+        self.flow_rate = flow_rate  # litri/minuto
         self.is_irrigating = False
         self.mode = "Off"
         self.remaining_time = 0
         self.next_scheduled_start: Optional[datetime] = None
+        self.scheduled_duration = 0
         self.start_time: Optional[datetime] = None
         self.duration = 0
         
+        # Contatori di consumo
+        self.water_used = 0.0  # litri
+        self.irrigated_seconds = 0.0
+        self.irrigation_count = 0
+        self._accounted_until: Optional[datetime] = None
+        
         # Comandi tramite variabili
         self.command_duration = 0
         self.command_start = False
@@ -47,26 +81,66 @@ class ValveController:
         if self.command_stop:
             await self.stop_irrigation()
             self.command_stop = False
+    
+    def _begin(self, mode: str, duration_seconds: int, start_time: datetime):
+        """Porta la valvola in irrigazione"""
+        self.mode = mode
+        self.is_irrigating = True
+        self.remaining_time = duration_seconds
+        self.duration = duration_seconds
+        self.start_time = start_time
+        self._accounted_until = start_time
+        self.irrigation_count += 1
+    
+    def _account(self, now: datetime):
+        """Accumula acqua e tempo di irrigazione fino a now (senza superare la fine)"""
+        if not self.is_irrigating or self._accounted_until is None:
+            return
+        end_time = self.start_time + timedelta(seconds=self.duration)
+        until = min(now, end_time)
+        seconds = (until - self._accounted_until).total_seconds()
+        if seconds > 0:
+            self.irrigated_seconds += seconds
+            self.water_used += self.flow_rate * seconds / 60.0
+            self._accounted_until = until
         
     async def start_manual_irrigation(self, duration_seconds: int) -> bool:
         """Avvia irrigazione manuale"""
         if self.is_irrigating:
             return False
             
-        self.mode = "Manual"
-        self.is_irrigating = True
-        self.remaining_time = duration_seconds
-        self.duration = duration_seconds
-        self.start_time = datetime.now()
-        print(f"💧 {self.description}: Avviata irrigazione manuale per {duration_seconds}s")
+        now = self.clock.now()
+        self._begin("Manual", duration_seconds, now)
+        if self.audit is not None:
+            self.audit.record("start", now.timestamp(), valve=self.valve_id, mode="Manual",
+                              duration=duration_seconds)
         return True
+    
+    def resume_irrigation(self, mode: str, remaining_seconds: int):
+        """Riprende un'irrigazione interrotta (es. dopo un riavvio del server)"""
+        now = self.clock.now()
+        self._begin(mode, remaining_seconds, now)
+        if self.audit is not None:
+            self.audit.record("resume", now.timestamp(), valve=self.valve_id, mode=mode,
+                              remaining=remaining_seconds)
+    
+    def schedule_irrigation(self, start_at: datetime, duration_seconds: int):
+        """Programma un'irrigazione automatica"""
+        self.next_scheduled_start = start_at
+        self.scheduled_duration = duration_seconds
+        if not self.is_irrigating:
+            self.mode = "Automatic"
         
     async def stop_irrigation(self) -> bool:
         """Ferma l'irrigazione"""
         if self.is_irrigating:
+            now = self.clock.now()
+            self._account(now)
+            if self.audit is not None:
+                remaining = max(0, self.duration - int((now - self.start_time).total_seconds()))
+                self.audit.record("stop", now.timestamp(), valve=self.valve_id, remaining=remaining)
             self.is_irrigating = False
             self.remaining_time = 0
-            print(f"🛑 {self.description}: Irrigazione fermata")
         self.mode = "Off"
         self.next_scheduled_start = None
         return True
@@ -76,263 +150,703 @@ class ValveController:
         # Processa comandi
         await self.process_commands()
         
+        now = self.clock.now()
+        
+        # Avvio irrigazione programmata
+        if (self.next_scheduled_start is not None and not self.is_irrigating
+                and now >= self.next_scheduled_start):
+            self._begin("Automatic", self.scheduled_duration, self.next_scheduled_start)
+            if self.audit is not None:
+                self.audit.record("start", self.next_scheduled_start.timestamp(), valve=self.valve_id,
+                                  mode="Automatic", duration=self.scheduled_duration)
+            self.next_scheduled_start = None
+        
         # Aggiorna timer
         if self.is_irrigating and self.start_time:
-            elapsed = (datetime.now() - self.start_time).total_seconds()
+            self._account(now)
+            elapsed = (now - self.start_time).total_seconds()
             self.remaining_time = max(0, self.duration - int(elapsed))
             
             if self.remaining_time <= 0:
                 self.is_irrigating = False
                 self.remaining_time = 0
-                self.mode = "Off"
-                print(f"✅ {self.description}: Irrigazione completata")
+                self.mode = "Automatic" if self.next_scheduled_start else "Off"
+                if self.audit is not None:
+                    end_time = self.start_time + timedelta(seconds=self.duration)
+                    self.audit.record("complete", end_time.timestamp(), valve=self.valve_id)
 
 class StationController:
     """Controlla una stazione di irrigazione"""
     
-    def __init__(self, station_id: str, description: str, valve_count: int):
+    def __init__(self, station_id: str, description: str, valve_count: int,
+                 clock=SYSTEM_CLOCK, audit: Optional[AuditBuffer] = None):
         self.station_id = station_id
+        self.clock = clock
+        self.audit = audit
+        self.soil_moisture = 0.0
+        self.valves: Dict[str, ValveController] = {}
+        self.reconfigure(description, valve_count)
+    
+    def reconfigure(self, description: str, valve_count: int):
+        """Crea o adegua le valvole; quelle esistenti mantengono il loro stato"""
         self.description = description
         self.valve_count = valve_count
         self.station_type = "DoubleValve" if valve_count > 1 else "SingleValve"
-        self.valves: Dict[str, ValveController] = {}
         
-        # Crea le valvole
         for i in range(1, valve_count + 1):
             valve_id = f"Valve{i}"
             valve_description = f"{description} - Valvola {i}"
-            self.valves[valve_id] = ValveController(f"{station_id}_{valve_id}", valve_description)
+            if valve_id in self.valves:
+                self.valves[valve_id].description = valve_description
+            else:
+                self.valves[valve_id] = ValveController(f"{self.station_id}_{valve_id}", valve_description,
+                                                        self.clock, audit=self.audit)
+        for valve_id in list(self.valves)[valve_count:]:
+            del self.valves[valve_id]
     
     async def update(self):
         """Aggiorna tutte le valvole della stazione"""
         for valve in self.valves.values():
             await valve.update()
 
+# Configurazione stazioni di default
+DEFAULT_STATION_CONFIGS = [
+    {"id": "Station1", "description": "Giardino Anteriore", "valves": 2},
+    {"id": "Station2", "description": "Aiuole Laterali", "valves": 1},
+    {"id": "Station3", "description": "Giardino Posteriore", "valves": 2}
+]
+
 class IrrigationSystem:
     """Sistema principale di irrigazione con ObjectTypes"""
     
-    def __init__(self):
+    def __init__(self, station_configs: Optional[List[Dict]] = None, weather_csv: Optional[str] = None,
+                 clock=SYSTEM_CLOCK, audit: Optional[AuditBuffer] = None):
         self.system_on = True
+        self.clock = clock
+        self.audit = audit
         self.stations: Dict[str, StationController] = {}
         
-        # Configurazione stazioni
-        station_configs = [
-            {"id": "Station1", "description": "Giardino Anteriore", "valves": 2},
-            {"id": "Station2", "description": "Aiuole Laterali", "valves": 1},
-            {"id": "Station3", "description": "Giardino Posteriore", "valves": 2}
-        ]
+        if station_configs is None:
+            station_configs = DEFAULT_STATION_CONFIGS
         
         # Crea le stazioni
         for config in station_configs:
             self.stations[config["id"]] = StationController(
-                config["id"], config["description"], config["valves"]
+                config["id"], config["description"], config["valves"], clock, audit
             )
         
+        # Modello di umidità del suolo (un elemento per stazione)
+        weather = WeatherStream(weather_csv) if weather_csv else None
+        self.soil_model = SoilMoistureModel(
+            list(self.stations.keys()),
+            [station.valve_count for station in self.stations.values()],
+            weather,
+        )
+        self._last_soil_update: Optional[datetime] = None
+        # Secondi di irrigazione per stazione al passo del suolo precedente
+        self._soil_irrigated_seconds: Dict[str, float] = {}
+        
     async def update(self):
         """Aggiorna tutto il sistema"""
         if self.system_on:
             for station in self.stations.values():
                 await station.update()
+        
+        # Il suolo evolve anche a sistema spento (evapotraspirazione)
+        self.update_soil(self.clock.now())
+    
+    def update_soil(self, now: datetime):
+        """
+        Avanza il modello del suolo di tutte le stazioni in un solo passo vettoriale.
+        L'acqua del passo è quella dei secondi realmente irrigati nell'intervallo
+        (contatori delle valvole), non lo stato delle valvole alla fine del passo:
+        il risultato non dipende da come gli avvii cadono rispetto ai passi.
+        """
+        dt = 0.0
+        if self._last_soil_update is not None:
+            dt = (now - self._last_soil_update).total_seconds()
+        self._last_soil_update = now
+        
+        irrigated = np.zeros(len(self.stations), dtype=np.float64)
+        for i, (station_id, station) in enumerate(self.stations.items()):
+            total = sum(valve.irrigated_seconds for valve in station.valves.values())
+            # Valvole rimosse: il totale può scendere, mai acqua negativa
+            irrigated[i] = max(0.0, total - self._soil_irrigated_seconds.get(station_id, 0.0))
+            self._soil_irrigated_seconds[station_id] = total
+        if dt > 0:
+            # Numero medio di valvole in irrigazione nell'intervallo
+            self.soil_model.step(irrigated / dt, dt, now)
+    
+    def add_station(self, config: Dict) -> StationController:
+        """Aggiunge una stazione a runtime"""
+        station = StationController(config["id"], config["description"], config["valves"], self.clock,
+                                    self.audit)
+        self.stations[config["id"]] = station
+        self.soil_model.add_station(config["id"], config["valves"])
+        return station
+    
+    def update_station(self, config: Dict) -> StationController:
+        """Aggiorna descrizione e numero di valvole di una stazione esistente"""
+        station = self.stations[config["id"]]
+        station.reconfigure(config["description"], config["valves"])
+        self.soil_model.set_valve_count(config["id"], config["valves"])
+        return station
+    
+    def remove_station(self, station_id: str) -> Optional[StationController]:
+        """Rimuove una stazione a runtime"""
+        station = self.stations.pop(station_id, None)
+        if station is not None:
+            self.soil_model.remove_station(station_id)
+            self._soil_irrigated_seconds.pop(station_id, None)
+        return station
+    
+    def get_valve(self, full_valve_id: str) -> Optional[ValveController]:
+        """Restituisce la valvola dato l'id completo StationX_ValveY"""
+        station_id, _, valve_id = full_valve_id.partition("_")
+        station = self.stations.get(station_id)
+        if station is None:
+            return None
+        return station.valves.get(valve_id)
+
+NODESET_XMLNS = "http://opcfoundation.org/UA/2011/03/UANodeSet.xsd"
+
+# Riferimenti seguiti per individuare i figli di un nodo
+HIERARCHICAL_REFERENCES = {
+    ua.NodeId(ua.ObjectIds.HasComponent),
+    ua.NodeId(ua.ObjectIds.HasProperty),
+    ua.NodeId(ua.ObjectIds.Organizes),
+}
+
+# Verbi di ModelChangeStructureDataType
+MODEL_CHANGE_NODE_ADDED = 1
+MODEL_CHANGE_NODE_DELETED = 2
+
+# Nodi di una valvola aggiornati dal server: chiave → percorso relativo
+VALVE_NODE_PATHS = {
+    "irrigating": "Status.IsIrrigating",
+    "mode": "Status.Mode",
+    "remaining": "Status.RemainingTime",
+    "duration_cmd": "Commands.CommandDuration",
+    "start_cmd": "Commands.CommandStart",
+    "stop_cmd": "Commands.CommandStop",
+    "command_id": "Commands.CommandId",
+    "last_command_id": "Status.LastCommandId",
+}
+
+# Azioni accettate dai metodi ExecuteCommand/ExecuteCommands
+COMMAND_ACTIONS = ("start", "stop")
 
 class ProfessionalIrrigationServer:
     """Server OPC-UA professionale con ObjectTypes"""
     
-    def __init__(self):
+    def __init__(self, sim_workers: int = 1, station_configs: Optional[List[Dict]] = None,
+                 weather_csv: Optional[str] = None, state_dir: Optional[str] = "state",
+                 config_file: Optional[str] = None, metrics_port: Optional[int] = None,
+                 profile: bool = False, profile_dir: str = "profiles",
+                 endpoint: str = "opc.tcp://localhost:48400/irrigation",
+                 command_queue_size: int = DEFAULT_CAPACITY, command_rate: float = DEFAULT_RATE,
+                 audit_dir: Optional[str] = "audit"):
         self.server = Server()
-        self.irrigation_system = IrrigationSystem()
+        self.endpoint = endpoint
+        
+        # File dell'installazione osservato per il ricaricamento a caldo
+        self.config_watcher: Optional[ConfigWatcher] = None
+        if config_file is not None:
+            station_configs = load_installation(config_file)
+            self.config_watcher = ConfigWatcher(config_file)
+        self.station_configs = station_configs if station_configs is not None else DEFAULT_STATION_CONFIGS
+        
+        # Registro di audit di comandi e transizioni (None = disattivato); con i worker
+        # le valvole simulate sono nei processi figli e gli eventi arrivano con i delta
+        self.audit: Optional[AuditLog] = AuditLog(audit_dir) if audit_dir else None
+        self.irrigation_system = IrrigationSystem(self.station_configs, weather_csv,
+                                                  audit=self.audit if sim_workers <= 0 else None)
         self.nodes: Dict[str, Node] = {}
         self.object_types: Dict[str, Node] = {}
         self.ns_idx = None
+        self.namespace_uri = "http://mvlabs.it/irrigation"
+        self.irrigation_root: Optional[Node] = None
+        self.stations_folder: Optional[Node] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._export_task: Optional[asyncio.Task] = None
+        self._model_change_event = None
+        # Serializza aggiornamento dei nodi e modifiche del modello a runtime
+        self._model_lock = asyncio.Lock()
+        
+        # Simulazione in processi separati (0 = nello stesso loop del protocollo)
+        self.simulation_pool: Optional[SimulationPool] = None
+        if sim_workers > 0:
+            self.simulation_pool = SimulationPool(self.station_configs, sim_workers,
+                                                  weather_csv=weather_csv, audit=self.audit is not None)
+        self._published_states: Dict[str, tuple] = {}
+        
+        # Write-ahead log dello stato (None = persistenza disabilitata)
+        self.journal: Optional[StateJournal] = StateJournal(state_dir) if state_dir else None
+        self._journaled_valves: Dict[str, tuple] = {}
+        self._journaled_system_on: Optional[bool] = None
+        self._commands_in_flight: List[str] = []
+        # Comandi (scritture e metodi) accodati all'arrivo e prelevati dal tick
+        self.command_queue = CommandQueue(capacity=command_queue_size, rate=command_rate)
+        # NodeId delle variabili Commands.* → (valvola, chiave in VALVE_NODE_PATHS)
+        self._command_nodeids: Dict[ua.NodeId, tuple] = {}
+        self.tracer = CommandTracer()
+        # Comandi sostituiti in coda: il loro id va pubblicato in LastCommandId
+        self._coalesced_traces: List = []
+        
+        # Metriche di prestazione (pubblicate in IrrigationSystem/Diagnostics)
+        self.metrics = ServerMetrics()
+        self._diagnostics_nodeids: Dict[str, ua.NodeId] = {}
+        self._loop_lag_task: Optional[asyncio.Task] = None
+        
+        # Endpoint OpenMetrics opzionale (serie aggiornate in modo incrementale)
+        self.metrics_port = metrics_port
+        self.exporter: Optional[MetricsExporter] = MetricsExporter(self.metrics) if metrics_port is not None else None
+        self._metrics_http: Optional[asyncio.AbstractServer] = None
+        
+        # Profiler a campionamento del thread del loop (attivabile a runtime con SetProfiling)
+        self.profiler = SamplingProfiler(profile_dir)
+        self._profile_at_start = profile
         
     async def init_server(self):
         """Inizializza il server"""
         await self.server.init()
         
-        self.server.set_endpoint("opc.tcp://localhost:48400/irrigation")
+        self.server.set_endpoint(self.endpoint)
         self.server.set_server_name("Professional Irrigation Server")
         
-        namespace_uri = "http://mvlabs.it/irrigation"
-        self.ns_idx = await self.server.register_namespace(namespace_uri)
+        self.ns_idx = await self.server.register_namespace(self.namespace_uri)
         
         # Crea ObjectTypes prima dell'AddressSpace
         await self._create_object_types()
         await self._create_address_space()
+        self._model_change_event = await self.server.get_event_generator(ua.ObjectIds.GeneralModelChangeEventType)
+        # asyncua registra il campo Changes con il NodeId del tipo strutturato: va serializzato come ExtensionObject
+        self._model_change_event.event.data_types["Changes"] = ua.VariantType.ExtensionObject
         
-    async def _create_object_types(self):
-        """Crea gli ObjectTypes personalizzati"""
-        print("🏗️  Creazione ObjectTypes personalizzati...")
-        
-        base_object_type = self.server.get_node(ua.ObjectIds.BaseObjectType)
-        
-        # =============================================================================
-        # 1. IrrigationValveType
-        # =============================================================================
-        valve_type = await base_object_type.add_object_type(self.ns_idx, "IrrigationValveType")
-        
-        # Descrizione valvola
-        await valve_type.add_variable(self.ns_idx, "Description", "", ua.VariantType.String)
+        if self.exporter is not None:
+            self._subscribe_request_counters()
+            self.exporter.add_command_queue(self.command_queue)
+        self.server.subscribe_server_callback(CallbackType.PostWrite, self._on_command_write)
         
-        # Status folder
-        status_folder = await valve_type.add_object(self.ns_idx, "Status")
-        await status_folder.add_variable(self.ns_idx, "IsIrrigating", False, ua.VariantType.Boolean)
-        await status_folder.add_variable(self.ns_idx, "Mode", "Off", ua.VariantType.String)
-        await status_folder.add_variable(self.ns_idx, "RemainingTime", 0, ua.VariantType.Int32)
-        await status_folder.add_variable(self.ns_idx, "NextScheduledStart", None, ua.VariantType.DateTime)
-        
-        # Commands folder
-        commands_folder = await valve_type.add_object(self.ns_idx, "Commands")
-        duration_var = await commands_folder.add_variable(self.ns_idx, "CommandDuration", 0, ua.VariantType.Int32)
-        start_var = await commands_folder.add_variable(self.ns_idx, "CommandStart", False, ua.VariantType.Boolean)
-        stop_var = await commands_folder.add_variable(self.ns_idx, "CommandStop", False, ua.VariantType.Boolean)
+        if self.journal is not None:
+            await self._restore_state()
+    
+    def _subscribe_request_counters(self):
+        """Conta le richieste OPC-UA dei client (le operazioni interne del server sono escluse)"""
+        exporter = self.exporter
         
-        await duration_var.set_writable()
-        await start_var.set_writable()
-        await stop_var.set_writable()
+        def counter(service):
+            def count(event, dispatcher):
+                if event.is_external:
+                    exporter.count_request(service)
+            return count
         
-        self.object_types["valve_type"] = valve_type
+        callbacks = (
+            (CallbackType.PreRead, "read"),
+            (CallbackType.PreWrite, "write"),
+            (CallbackType.ItemSubscriptionCreated, "create_monitored_items"),
+            (CallbackType.ItemSubscriptionModified, "modify_monitored_items"),
+            (CallbackType.ItemSubscriptionDeleted, "delete_monitored_items"),
+        )
+        for event_type, service in callbacks:
+            self.server.subscribe_server_callback(event_type, counter(service))
+    
+    async def _restore_state(self):
+        """Ripristina lo stato salvato nel write-ahead log"""
+        state = self.journal.load()
         
-        # =============================================================================
-        # 2. IrrigationStationType
-        # =============================================================================
-        station_type = await base_object_type.add_object_type(self.ns_idx, "IrrigationStationType")
+        await self.nodes["system_state"].write_value(state["system_on"])
+        self.irrigation_system.system_on = state["system_on"]
+        self._journaled_system_on = state["system_on"]
         
-        # StationInfo
-        station_info = await station_type.add_object(self.ns_idx, "StationInfo")
-        await station_info.add_variable(self.ns_idx, "StationId", "", ua.VariantType.String)
-        await station_info.add_variable(self.ns_idx, "Description", "", ua.VariantType.String)
-        await station_info.add_variable(self.ns_idx, "StationType", "", ua.VariantType.String)
-        await station_info.add_variable(self.ns_idx, "ValveCount", 0, ua.VariantType.Int32)
+        # Irrigazioni in corso: riprendi con il tempo rimanente reale
+        resumed = 0
+        now = time.time()
+        for full_valve_id, entry in state["valves"].items():
+            valve = self.irrigation_system.get_valve(full_valve_id)
+            remaining = int(entry["deadline"] - now)
+            if valve is None or remaining <= 0:
+                self.journal.record_valve(full_valve_id, "Off", 0)
+                continue
+            valve.resume_irrigation(entry["mode"], remaining)
+            self._journaled_valves[full_valve_id] = (True, entry["mode"])
+            resumed += 1
         
-        self.object_types["station_type"] = station_type
+        # Comandi ricevuti ma non ancora applicati: di nuovo in coda
+        self.command_queue.submit_many([
+            QueuedCommand(full_valve_id, command["start"], command["stop"], command["duration"],
+                          new_correlation_id(), None, "journal", "journal")
+            for full_valve_id, command in state["pending"].items()
+            if self.irrigation_system.get_valve(full_valve_id) is not None], rate_limited=False)
         
-        # =============================================================================
-        # 3. IrrigationSystemType
-        # =============================================================================
-        system_type = await base_object_type.add_object_type(self.ns_idx, "IrrigationSystemType")
+        if resumed or state["pending"]:
+            print(f"♻️  Stato ripristinato: {resumed} irrigazioni riprese, "
+                  f"{len(state['pending'])} comandi in sospeso")
         
-        # Controller
-        controller_folder = await system_type.add_object(self.ns_idx, "Controller")
-        system_state_var = await controller_folder.add_variable(self.ns_idx, "SystemState", True, ua.VariantType.Boolean)
-        await system_state_var.set_writable()
+    def _nid(self, path) -> ua.NodeId:
+        """NodeId deterministico nel namespace del sistema (stringa = percorso, int = tipo)"""
+        return ua.NodeId(path, self.ns_idx)
+    
+    def _qn(self, name: str) -> ua.QualifiedName:
+        """BrowseName nel namespace del sistema"""
+        return ua.QualifiedName(name, self.ns_idx)
+    
+    async def _create_object_types(self):
+        """Crea gli ObjectTypes personalizzati dal modello dichiarativo (un solo batch AddNodes)"""
+        print("🏗️  Creazione ObjectTypes personalizzati...")
         
-        # Stations folder
-        await system_type.add_object(self.ns_idx, "Stations")
+        batch = NodeBatch(self.ns_idx)
+        batch.add_types()
+        await batch.commit(self.server)
         
-        self.object_types["system_type"] = system_type
+        self.object_types["valve_type"] = self.server.get_node(batch.type_nodeid("IrrigationValveType"))
+        self.object_types["station_type"] = self.server.get_node(batch.type_nodeid("IrrigationStationType"))
+        self.object_types["system_type"] = self.server.get_node(batch.type_nodeid("IrrigationSystemType"))
         
         print("✅ ObjectTypes creati: IrrigationSystemType, IrrigationStationType, IrrigationValveType")
         
     async def _create_address_space(self):
-        """Crea l'AddressSpace usando gli ObjectTypes"""
+        """Crea l'AddressSpace istanziando gli ObjectTypes (un solo batch AddNodes)"""
         print("🏗️  Creazione AddressSpace professionale...")
         
-        objects = self.server.get_objects_node()
-        
-        # Root del sistema usando il tipo personalizzato
-        irrigation_root = await objects.add_object(self.ns_idx, "IrrigationSystem", 
-                                                 objecttype=self.object_types["system_type"])
+        batch = NodeBatch(self.ns_idx)
+        batch.add_instance(system_instance())
+        for station_id, station_controller in self.irrigation_system.stations.items():
+            batch.add_station(self._station_config(station_controller))
+        count = await batch.commit(self.server)
         
-        # Controller
-        controller = await irrigation_root.add_object(self.ns_idx, "Controller")
-        system_state = await controller.add_variable(self.ns_idx, "SystemState", True, ua.VariantType.Boolean)
-        await system_state.set_writable()
-        self.nodes["system_state"] = system_state
+        self.irrigation_root = self.server.get_node(self._nid(SYSTEM_PATH))
+        self.stations_folder = self.server.get_node(self._nid(STATIONS_PATH))
+        self.nodes["system_state"] = self.server.get_node(self._nid(f"{SYSTEM_PATH}.Controller.SystemState"))
+        self._diagnostics_nodeids = {
+            member.name: self._nid(f"{SYSTEM_PATH}.{member.path}")
+            for member in compile_type("IrrigationSystemType") if member.parent == "Diagnostics"
+        }
+        for station_id, station_controller in self.irrigation_system.stations.items():
+            self._register_station_nodes(station_id, station_controller)
         
-        # Stations folder
-        stations_folder = await irrigation_root.add_object(self.ns_idx, "Stations")
+        # Metodi per esportare il NodeSet e applicare delta dal server in esecuzione
+        nid, qn = self._nid, self._qn
+        await self.irrigation_root.add_method(nid("IrrigationSystem.ExportNodeSet"), qn("ExportNodeSet"),
+                                              self._export_nodeset_method,
+                                              [ua.VariantType.String], [ua.VariantType.String])
+        await self.irrigation_root.add_method(nid("IrrigationSystem.ApplyNodeSetDelta"), qn("ApplyNodeSetDelta"),
+                                              self._apply_delta_method,
+                                              [ua.VariantType.String], [ua.VariantType.Int32])
+        await self.irrigation_root.add_method(nid("IrrigationSystem.SetProfiling"), qn("SetProfiling"),
+                                              self._set_profiling_method,
+                                              [ua.VariantType.Boolean], [ua.VariantType.String])
         
-        # Crea stazioni usando ObjectTypes
-        for station_id, station_controller in self.irrigation_system.stations.items():
-            station_node = await stations_folder.add_object(self.ns_idx, station_id,
-                                                          objecttype=self.object_types["station_type"])
-            
-            # StationInfo
-            station_info = await station_node.add_object(self.ns_idx, "StationInfo")
-            station_id_var = await station_info.add_variable(self.ns_idx, "StationId", station_id, ua.VariantType.String)
-            station_desc_var = await station_info.add_variable(self.ns_idx, "Description", station_controller.description, ua.VariantType.String)
-            station_type_var = await station_info.add_variable(self.ns_idx, "StationType", station_controller.station_type, ua.VariantType.String)
-            valve_count_var = await station_info.add_variable(self.ns_idx, "ValveCount", station_controller.valve_count, ua.VariantType.Int32)
-            
-            # Crea valvole usando ObjectTypes
-            for valve_id, valve_controller in station_controller.valves.items():
-                valve_node = await station_node.add_object(self.ns_idx, valve_id,
-                                                         objecttype=self.object_types["valve_type"])
-                
-                # Description
-                desc_var = await valve_node.add_variable(self.ns_idx, "Description", valve_controller.description, ua.VariantType.String)
-                
-                # Status folder
-                status_folder = await valve_node.add_object(self.ns_idx, "Status")
-                is_irrigating = await status_folder.add_variable(self.ns_idx, "IsIrrigating", False, ua.VariantType.Boolean)
-                mode = await status_folder.add_variable(self.ns_idx, "Mode", "Off", ua.VariantType.String)
-                remaining_time = await status_folder.add_variable(self.ns_idx, "RemainingTime", 0, ua.VariantType.Int32)
-                next_scheduled = await status_folder.add_variable(self.ns_idx, "NextScheduledStart", None, ua.VariantType.DateTime)
-                
-                # Commands folder
-                commands_folder = await valve_node.add_object(self.ns_idx, "Commands")
-                duration_cmd = await commands_folder.add_variable(self.ns_idx, "CommandDuration", 0, ua.VariantType.Int32)
-                start_cmd = await commands_folder.add_variable(self.ns_idx, "CommandStart", False, ua.VariantType.Boolean)
-                stop_cmd = await commands_folder.add_variable(self.ns_idx, "CommandStop", False, ua.VariantType.Boolean)
-                
-                await duration_cmd.set_writable()
-                await start_cmd.set_writable()
-                await stop_cmd.set_writable()
-                
-                # Salva riferimenti per aggiornamenti
-                full_valve_id = f"{station_id}_{valve_id}"
-                self.nodes[f"{full_valve_id}_irrigating"] = is_irrigating
-                self.nodes[f"{full_valve_id}_mode"] = mode
-                self.nodes[f"{full_valve_id}_remaining"] = remaining_time
-                self.nodes[f"{full_valve_id}_duration_cmd"] = duration_cmd
-                self.nodes[f"{full_valve_id}_start_cmd"] = start_cmd
-                self.nodes[f"{full_valve_id}_stop_cmd"] = stop_cmd
+        # Comandi con id di correlazione e timestamp del client: singolo, in blocco, dump delle tracce
+        await self.irrigation_root.add_method(nid("IrrigationSystem.ExecuteCommand"), qn("ExecuteCommand"),
+                                              self._execute_command_method,
+                                              [ua.VariantType.String, ua.VariantType.String, ua.VariantType.Int32,
+                                               ua.VariantType.String, ua.VariantType.DateTime],
+                                              [ua.VariantType.String])
+        await self.irrigation_root.add_method(nid("IrrigationSystem.ExecuteCommands"), qn("ExecuteCommands"),
+                                              self._execute_commands_method,
+                                              [ua.VariantType.String, ua.VariantType.String, ua.VariantType.Int32,
+                                               ua.VariantType.String, ua.VariantType.DateTime],
+                                              [ua.VariantType.Int32])
+        await self.irrigation_root.add_method(nid("IrrigationSystem.DumpCommandTraces"), qn("DumpCommandTraces"),
+                                              self._dump_traces_method,
+                                              [ua.VariantType.String], [ua.VariantType.String])
         
-        print("✅ AddressSpace professionale creato")
+        print(f"✅ AddressSpace professionale creato ({count} nodi)")
+    
+    @staticmethod
+    def _station_config(station: StationController) -> Dict:
+        return {"id": station.station_id, "description": station.description, "valves": station.valve_count}
+    
+    def _register_station_nodes(self, station_id: str, station_controller: StationController):
+        """Salva i riferimenti ai nodi della stazione usati negli aggiornamenti"""
+        base = f"{STATIONS_PATH}.{station_id}"
+        self.nodes[f"{station_id}_soil_moisture"] = self.server.get_node(self._nid(f"{base}.SoilMoisture"))
+        for valve_id in station_controller.valves:
+            full_valve_id = f"{station_id}_{valve_id}"
+            for key, path in VALVE_NODE_PATHS.items():
+                self.nodes[f"{full_valve_id}_{key}"] = self.server.get_node(self._nid(f"{base}.{valve_id}.{path}"))
+                if path.startswith("Commands."):
+                    self._command_nodeids[self.nodes[f"{full_valve_id}_{key}"].nodeid] = (full_valve_id, key)
+            if self.exporter is not None:
+                self.exporter.add_valve(full_valve_id, station_controller.valves[valve_id].flow_rate)
+    
+    def _unregister_station_nodes(self, station_id: str, valve_ids):
+        """Rimuove i riferimenti ai nodi di una stazione"""
+        self.nodes.pop(f"{station_id}_soil_moisture", None)
+        for valve_id in valve_ids:
+            full_valve_id = f"{station_id}_{valve_id}"
+            for key in VALVE_NODE_PATHS:
+                node = self.nodes.pop(f"{full_valve_id}_{key}", None)
+                if node is not None:
+                    self._command_nodeids.pop(node.nodeid, None)
+            self.command_queue.discard(full_valve_id)
+            self._published_states.pop(full_valve_id, None)
+            self._journaled_valves.pop(full_valve_id, None)
+            if self.exporter is not None:
+                self.exporter.remove_valve(full_valve_id)
+            self.tracer.discard(full_valve_id)
     
     async def update_nodes(self):
         """Aggiorna i nodi OPC-UA"""
-        # Aggiorna sistema
-        await self.irrigation_system.update()
+        async with self._model_lock:
+            self.metrics.begin_tick()
+            await self._update_nodes()
+            self.metrics.end_tick()
+            await self._publish_diagnostics()
+    
+    async def _publish_diagnostics(self):
+        """Pubblica le metriche nell'oggetto Diagnostics (scrittura diretta, fuori dal tempo del tick)"""
+        metrics = self.metrics
+        iserver = self.server.iserver
+        metrics.update_notification_rate(iserver.subscription_service.subscriptions.values())
+        sessions = active_sessions()
+        p50, p95, p99 = self.tracer.percentiles()
+        queue = self.command_queue
+        values = (
+            ("TickCount", ua.Variant(metrics.tick_histogram.count, ua.VariantType.UInt32)),
+            ("TickDurationMs", ua.Variant(metrics.last_tick_ms, ua.VariantType.Double)),
+            ("TickDurationCounts", ua.Variant(metrics.tick_histogram.counts, ua.VariantType.UInt32, is_array=True)),
+            ("ReadsPerTick", ua.Variant(metrics.last_reads, ua.VariantType.Int32)),
+            ("WritesPerTick", ua.Variant(metrics.last_writes, ua.VariantType.Int32)),
+            ("CommandLatencyMs", ua.Variant(metrics.command_latency_ms, ua.VariantType.Double)),
+            ("CommandLatencyMaxMs", ua.Variant(metrics.command_latency_max_ms, ua.VariantType.Double)),
+            ("CommandLatencyP50Ms", ua.Variant(p50, ua.VariantType.Double)),
+            ("CommandLatencyP95Ms", ua.Variant(p95, ua.VariantType.Double)),
+            ("CommandLatencyP99Ms", ua.Variant(p99, ua.VariantType.Double)),
+            ("ActiveSessions", ua.Variant(sessions, ua.VariantType.Int32)),
+            ("NotificationsPerSecond", ua.Variant(metrics.notifications_per_second, ua.VariantType.Double)),
+            ("EventLoopLagMs", ua.Variant(metrics.loop_lag_ms, ua.VariantType.Double)),
+            ("CommandQueueDepth", ua.Variant(queue.depth, ua.VariantType.UInt32)),
+            ("CommandsCoalesced", ua.Variant(queue.coalesced, ua.VariantType.UInt32)),
+            ("CommandsRejectedBusy", ua.Variant(queue.rejected_busy, ua.VariantType.UInt32)),
+            ("CommandsRejectedRate", ua.Variant(queue.rejected_rate, ua.VariantType.UInt32)),
+        )
+        if self.exporter is not None:
+            self.exporter.set_sessions(sessions)
+        for name, variant in values:
+            await self.server.write_attribute_value(self._diagnostics_nodeids[name], ua.DataValue(variant))
+    
+    async def _update_nodes(self):
+        # Comandi sostituiti in coda da chiamanti senza loop (es. benchmark)
+        await self._publish_coalesced()
+        
+        # Aggiorna sistema (solo se la simulazione è nello stesso processo)
+        if self.simulation_pool is None:
+            await self.irrigation_system.update()
+            # I comandi del tick precedente sono stati applicati
+            for full_valve_id in self._commands_in_flight:
+                self.metrics.command_applied(full_valve_id)
+                self.tracer.applied(full_valve_id)
+                if self.journal is not None:
+                    self.journal.record_applied(full_valve_id)
+                valve = self.irrigation_system.get_valve(full_valve_id)
+                if valve is not None:
+                    # Un comando non eseguibile (es. start a sistema spento) non si ripete al tick dopo
+                    valve.command_start = valve.command_stop = False
+                    valve.command_duration = 0
+            self._commands_in_flight.clear()
         
         # Leggi stato sistema
         system_on = await self.nodes["system_state"].read_value()
+        self.metrics.tick_reads += 1
         self.irrigation_system.system_on = system_on
+        if self.simulation_pool is not None:
+            self.simulation_pool.set_system_on(system_on)
+        if system_on != self._journaled_system_on:
+            if self.journal is not None:
+                self.journal.record_system(system_on)
+            if self.audit is not None and self._journaled_system_on is not None:
+                self.audit.record("system", on=system_on)
+            self._journaled_system_on = system_on
         
-        # Aggiorna ogni valvola
-        for station_id, station in self.irrigation_system.stations.items():
-            for valve_id, valve in station.valves.items():
-                full_valve_id = f"{station_id}_{valve_id}"
-                
-                # Leggi comandi 
+        # Comandi in coda: al più per_tick, a turno tra le sessioni
+        for command in self.command_queue.drain():
+            valve = self.irrigation_system.get_valve(command.valve_id)
+            if valve is not None:
+                self._submit_command(valve, command)
+        
+        # Pubblica solo le valvole cambiate
+        if self.simulation_pool is not None:
+            deltas = self.simulation_pool.drain_deltas()
+            if self.audit is not None:
+                self.audit.extend(deltas["audit"])
+            for full_valve_id in deltas["applied"]:
+                self.metrics.command_applied(full_valve_id)
+                self.tracer.applied(full_valve_id)
+                if self.journal is not None:
+                    self.journal.record_applied(full_valve_id)
+            self._commands_in_flight.clear()
+        else:
+            deltas = collect_deltas(self.irrigation_system, self._published_states)
+        await self.apply_deltas(deltas)
+        
+        # Comandi applicati senza cambi di stato: chiudili comunque
+        for trace in self.tracer.settle():
+            await self._publish_command_id(trace)
+    
+    def _submit_command(self, valve: ValveController, command: QueuedCommand):
+        """Inoltra un comando prelevato dalla coda alla simulazione e ne avvia il tracciamento"""
+        full_valve_id = command.valve_id
+        self.metrics.command_received(full_valve_id)
+        self.tracer.received(full_valve_id, "start" if command.start else "stop", command.source,
+                             command.correlation_id, command.client_time, command.received)
+        self._commands_in_flight.append(full_valve_id)
+        if self.simulation_pool is not None:
+            self.simulation_pool.send_command(full_valve_id, command.start, command.stop, command.duration)
+        else:
+            valve.command_duration = command.duration
+            valve.command_start = command.start
+            valve.command_stop = command.stop
+    
+    def _enqueue_command(self, full_valve_id: str, start: bool, stop: bool, duration: int, correlation_id: str,
+                         client_time: Optional[float], source: str, lane) -> str:
+        """Accoda un comando (UaStatusCodeError se rifiutato); restituisce l'id di correlazione"""
+        command = QueuedCommand(full_valve_id, start, stop, duration, correlation_id or new_correlation_id(),
+                                client_time, source, lane)
+        try:
+            replaced = self.command_queue.submit(command)
+        except ua.UaStatusCodeError as e:
+            self._audit_rejected(full_valve_id, start, source, e.code)
+            raise
+        if replaced is not None:
+            self._command_coalesced(replaced)
+        if self.journal is not None:
+            self.journal.record_command(full_valve_id, start, stop, duration)
+        self._audit_command(command)
+        return command.correlation_id
+    
+    def _command_coalesced(self, command: QueuedCommand):
+        """Comando sostituito da uno più recente sulla stessa valvola: tracciato e concluso col suo id"""
+        current = self.command_queue.pending(command.valve_id)
+        trace = self.tracer.coalesced(command.valve_id, "start" if command.start else "stop", command.source,
+                                      command.correlation_id, command.client_time, command.received,
+                                      current.correlation_id if current is not None else None)
+        self._coalesced_traces.append(trace)
+    
+    async def _publish_coalesced(self):
+        """Pubblica in LastCommandId gli id dei comandi sostituiti (il client che li attende non resta appeso)"""
+        traces, self._coalesced_traces = self._coalesced_traces, []
+        for trace in traces:
+            await self._publish_command_id(trace)
+    
+    def _audit_command(self, command: QueuedCommand):
+        if self.audit is not None:
+            self.audit.record("command", command.received, valve=command.valve_id,
+                              action="start" if command.start else "stop", duration=command.duration,
+                              id=command.correlation_id, source=command.source)
+    
+    def _audit_rejected(self, full_valve_id: str, start: bool, source: str, code: int):
+        if self.audit is not None:
+            self.audit.record("rejected", valve=full_valve_id, action="start" if start else "stop",
+                              source=source, status=ua.StatusCode(code).name)
+    
+    async def _on_command_write(self, event, dispatcher):
+        """
+        Scritture dei client sulle variabili Commands.*: il comando entra in coda subito,
+        con durata e id presi dalla stessa richiesta Write se presenti. Se la coda lo
+        rifiuta, lo stato del CommandStart/CommandStop scritto diventa BadServerTooBusy
+        o BadTooManyOperations.
+        """
+        if not event.is_external or not self._command_nodeids:
+            return
+        writes: Dict[str, Dict] = {}
+        for index, write in enumerate(event.request_params.NodesToWrite):
+            target = self._command_nodeids.get(write.NodeId)
+            if target is None or write.AttributeId != ua.AttributeIds.Value or not event.response_params[index].is_good():
+                continue
+            full_valve_id, key = target
+            writes.setdefault(full_valve_id, {})[key] = (index, write.Value)
+        for full_valve_id, values in writes.items():
+            flags = {key: values[key] for key in ("start_cmd", "stop_cmd")
+                     if key in values and values[key][1].Value.Value}
+            if not flags:
+                continue
+            if "duration_cmd" in values:
+                duration = values["duration_cmd"][1].Value.Value
+            else:
                 duration = await self.nodes[f"{full_valve_id}_duration_cmd"].read_value()
-                start = await self.nodes[f"{full_valve_id}_start_cmd"].read_value()
-                stop = await self.nodes[f"{full_valve_id}_stop_cmd"].read_value()
-                
-                # Imposta comandi nella valvola (con conversioni sicure)
-                valve.command_duration = int(duration) if duration else 0
-                valve.command_start = start
-                valve.command_stop = stop
-                
-                # Aggiorna status (con tipi OPC-UA corretti)
-                await self.nodes[f"{full_valve_id}_irrigating"].write_value(valve.is_irrigating)
-                await self.nodes[f"{full_valve_id}_mode"].write_value(valve.mode)
-                await self.nodes[f"{full_valve_id}_remaining"].write_value(ua.Variant(valve.remaining_time, ua.VariantType.Int32))
-                
-                # Reset comandi se eseguiti
-                if start:
-                    await self.nodes[f"{full_valve_id}_start_cmd"].write_value(False)
-                if stop:
-                    await self.nodes[f"{full_valve_id}_stop_cmd"].write_value(False)
+            if "command_id" in values:
+                correlation_id = values["command_id"][1].Value.Value
+            else:
+                correlation_id = await self.nodes[f"{full_valve_id}_command_id"].read_value()
+            start, stop = "start_cmd" in flags, "stop_cmd" in flags
+            duration = int(duration) if duration else 0
+            status = None
+            if start and not stop and duration <= 0:
+                status = ua.StatusCode(ua.StatusCodes.BadInvalidArgument)
+                self._audit_rejected(full_valve_id, start, "write", status.value)
+            else:
+                try:
+                    self._enqueue_command(full_valve_id, start, stop, duration, correlation_id or "",
+                                          epoch(next(iter(flags.values()))[1].SourceTimestamp), "write",
+                                          id(event.user))
+                except ua.UaStatusCodeError as e:
+                    status = ua.StatusCode(e.code)
+            # Il comando è stato preso (o rifiutato): la variabile torna a False
+            for key, (index, _) in flags.items():
+                if status is not None:
+                    event.response_params[index] = status
+                await self.nodes[f"{full_valve_id}_{key}"].write_value(False)
+        await self._publish_coalesced()
+    
+    async def _publish_command_id(self, trace):
+        """Espone l'id dell'ultimo comando completato: il client misura così il round trip"""
+        node = self.nodes.get(f"{trace.valve_id}_last_command_id")
+        if node is not None:
+            await node.write_value(trace.correlation_id)
+            self.metrics.tick_writes += 1
+    
+    async def apply_deltas(self, deltas: Dict[str, Dict]):
+        """Applica i delta di stato alle valvole, alle stazioni e ai nodi OPC-UA"""
+        for station_id, delta in deltas["stations"].items():
+            station = self.irrigation_system.stations.get(station_id)
+            if station is None:
+                continue
+            station.soil_moisture = delta["soil_moisture"]
+            await self.nodes[f"{station_id}_soil_moisture"].write_value(station.soil_moisture)
+            self.metrics.tick_writes += 1
+        
+        for full_valve_id, delta in deltas["valves"].items():
+            valve = self.irrigation_system.get_valve(full_valve_id)
+            if valve is None:
+                continue
+            
+            # Mantieni allineato lo stato locale quando la simulazione è remota
+            valve.is_irrigating = delta["is_irrigating"]
+            valve.mode = delta["mode"]
+            valve.remaining_time = delta["remaining_time"]
+            
+            # Aggiorna status (con tipi OPC-UA corretti)
+            await self.nodes[f"{full_valve_id}_irrigating"].write_value(valve.is_irrigating)
+            await self.nodes[f"{full_valve_id}_mode"].write_value(valve.mode)
+            await self.nodes[f"{full_valve_id}_remaining"].write_value(ua.Variant(valve.remaining_time, ua.VariantType.Int32))
+            self.metrics.tick_writes += 3
+            if self.exporter is not None:
+                self.exporter.valve_changed(full_valve_id, valve.is_irrigating, valve.remaining_time)
+            trace = self.tracer.published(full_valve_id)
+            if trace is not None:
+                await self._publish_command_id(trace)
+            
+            # Registra nel journal solo le transizioni (la scadenza non cambia durante l'irrigazione)
+            if self.journal is not None:
+                state = (valve.is_irrigating, valve.mode)
+                if self._journaled_valves.get(full_valve_id, (False, "Off")) != state:
+                    self._journaled_valves[full_valve_id] = state
+                    deadline = time.time() + valve.remaining_time if valve.is_irrigating else 0
+                    self.journal.record_valve(full_valve_id, valve.mode, deadline)
     
     async def export_addressspace(self, filename="irrigation_professional_nodeset.xml"):
-        """Esporta l'AddressSpace corrente come NodeSet XML"""
+        """Esporta l'AddressSpace corrente come NodeSet XML (in streaming)"""
         try:
             print(f"📤 Esportazione AddressSpace professionale in {filename}...")
             
-            # Esporta solo il namespace personalizzato
-            await self.server.export_xml([self.ns_idx], filename)
+            # Esporta solo il namespace personalizzato: tipi + istanze
+            roots = [node.nodeid for node in self.object_types.values()] + [self.irrigation_root.nodeid]
+            exporter = StreamingNodeSetExporter(self.server, self.ns_idx, self.namespace_uri)
+            count = await exporter.export(roots, filename)
             
-            print(f"✅ AddressSpace esportato in: {filename}")
+            print(f"✅ AddressSpace esportato in: {filename} ({count} nodi)")
             print(f"📁 Percorso completo: {os.path.abspath(filename)}")
             print("\n📋 Per importare in UAModeler:")
             print("   File → Import → NodeSet → Seleziona il file XML")
@@ -343,10 +857,427 @@ class ProfessionalIrrigationServer:
             print(f"❌ Errore durante l'esportazione: {e}")
             return False
     
+    def start_export(self, filename="irrigation_professional_nodeset.xml") -> bool:
+        """Avvia l'export in background (chiamare dal loop del server)"""
+        if self._export_task is not None and not self._export_task.done():
+            return False
+        self._export_task = asyncio.create_task(self.export_addressspace(filename))
+        return True
+    
+    @uamethod
+    async def _export_nodeset_method(self, parent, filename: str):
+        """Metodo OPC-UA ExportNodeSet: avvia l'export e restituisce il percorso del file"""
+        # Solo nomi di file nella directory del server
+        filename = os.path.basename(filename or "") or "irrigation_professional_nodeset.xml"
+        if not filename.endswith(".xml"):
+            filename += ".xml"
+        if not self.start_export(filename):
+            raise ua.UaStatusCodeError(ua.StatusCodes.BadInvalidState)
+        return os.path.abspath(filename)
+    
+    async def reload_installation(self, configs: List[Dict]) -> int:
+        """
+        Applica una nuova configurazione dell'installazione senza riavvio:
+        crea, rimuove o ridimensiona solo le stazioni cambiate. Sessioni,
+        sottoscrizioni e irrigazioni delle valvole esistenti non vengono toccate.
+        Restituisce il numero di stazioni modificate.
+        """
+        added, removed, updated = diff_installation(self.irrigation_system.stations, configs)
+        if not (added or removed or updated):
+            return 0
+        
+        changes = []
+        async with self._model_lock:
+            for station_id in removed:
+                station = self.irrigation_system.remove_station(station_id)
+                self._unregister_station_nodes(station_id, list(station.valves))
+                if self.simulation_pool is not None:
+                    self.simulation_pool.remove_station(station_id)
+                self._delete_subtrees([self._nid(f"{STATIONS_PATH}.{station_id}")])
+                changes.append((f"{STATIONS_PATH}.{station_id}", "station_type", MODEL_CHANGE_NODE_DELETED))
+                print(f"➖ Stazione {station_id} rimossa")
+            
+            for config in added:
+                station = self.irrigation_system.add_station(config)
+                if self.simulation_pool is not None:
+                    self.simulation_pool.add_station(config)
+                batch = NodeBatch(self.ns_idx)
+                batch.add_station(config)
+                await batch.commit(self.server)
+                self._register_station_nodes(config["id"], station)
+                changes.append((f"{STATIONS_PATH}.{config['id']}", "station_type", MODEL_CHANGE_NODE_ADDED))
+                print(f"➕ Stazione {config['id']} aggiunta ({config['valves']} valvole)")
+            
+            for config in updated:
+                changes.extend(await self._update_station_nodes(config))
+                print(f"🔧 Stazione {config['id']} aggiornata ({config['valves']} valvole)")
+            
+            self.station_configs = configs
+        
+        await self._emit_model_change(changes)
+        return len(added) + len(removed) + len(updated)
+    
+    async def _update_station_nodes(self, config: Dict) -> List[tuple]:
+        """Adegua controller e nodi di una stazione esistente; restituisce le modifiche al modello"""
+        station_id = config["id"]
+        base = f"{STATIONS_PATH}.{station_id}"
+        station = self.irrigation_system.stations[station_id]
+        old_valves = set(station.valves)
+        self.irrigation_system.update_station(config)
+        if self.simulation_pool is not None:
+            self.simulation_pool.update_station(config)
+        
+        changes = []
+        removed_valves = [valve_id for valve_id in old_valves if valve_id not in station.valves]
+        if removed_valves:
+            self._unregister_station_nodes(station_id, removed_valves)
+            self._delete_subtrees([self._nid(f"{base}.{valve_id}") for valve_id in removed_valves])
+            changes.extend((f"{base}.{valve_id}", "valve_type", MODEL_CHANGE_NODE_DELETED)
+                           for valve_id in removed_valves)
+        
+        batch = NodeBatch(self.ns_idx)
+        for valve_num, (valve_id, valve) in enumerate(station.valves.items(), start=1):
+            if valve_id in old_valves:
+                await self.server.get_node(self._nid(f"{base}.{valve_id}.Description")).write_value(valve.description)
+            else:
+                batch.add_instance(valve_instance(station_id, station.description, valve_num))
+                changes.append((f"{base}.{valve_id}", "valve_type", MODEL_CHANGE_NODE_ADDED))
+        await batch.commit(self.server)
+        
+        await self.server.get_node(self._nid(f"{base}.StationInfo.Description")).write_value(station.description)
+        await self.server.get_node(self._nid(f"{base}.StationInfo.StationType")).write_value(station.station_type)
+        await self.server.get_node(self._nid(f"{base}.StationInfo.ValveCount")).write_value(
+            ua.Variant(station.valve_count, ua.VariantType.Int32))
+        self._register_station_nodes(station_id, station)
+        return changes
+    
+    def _delete_subtrees(self, roots: List[ua.NodeId]):
+        """
+        Cancella i nodi indicati e i loro figli in tempo proporzionale ai nodi rimossi.
+        (Con DeleteTargetReferences asyncua scandisce l'intero address space per ogni
+        nodo: qui si puliscono solo i riferimenti dei nodi effettivamente collegati.)
+        """
+        aspace = self.server.iserver.aspace
+        doomed = []
+        seen = set()
+        stack = list(roots)
+        while stack:
+            nodeid = stack.pop()
+            if nodeid in seen or nodeid not in aspace:
+                continue
+            seen.add(nodeid)
+            doomed.append(nodeid)
+            for ref in aspace[nodeid].references:
+                if (ref.IsForward and ref.ReferenceTypeId in HIERARCHICAL_REFERENCES
+                        and ref.NodeId.NamespaceIndex == self.ns_idx):
+                    stack.append(ref.NodeId)
+        
+        for nodeid in doomed:
+            for ref in aspace[nodeid].references:
+                if ref.NodeId in seen or ref.NodeId not in aspace:
+                    continue
+                target = aspace[ref.NodeId]
+                target.references[:] = [r for r in target.references if r.NodeId != nodeid]
+        
+        params = ua.DeleteNodesParameters()
+        params.NodesToDelete = [ua.DeleteNodesItem(NodeId=nodeid, DeleteTargetReferences=False) for nodeid in doomed]
+        self.server.iserver.node_mgt_service.delete_nodes(params)
+    
+    async def _emit_model_change(self, changes: List[tuple]):
+        """Notifica ai client un GeneralModelChangeEvent con i nodi aggiunti/rimossi"""
+        if not changes:
+            return
+        self._model_change_event.event.Changes = [
+            ua.ModelChangeStructureDataType(
+                Affected=self._nid(path),
+                AffectedType=self.object_types[type_key].nodeid if type_key else ua.NodeId(),
+                Verb=verb,
+            )
+            for path, type_key, verb in changes
+        ]
+        self._model_change_event.event.Message = ua.LocalizedText(
+            f"Modello dell'installazione modificato ({len(changes)} nodi)")
+        await self._model_change_event.trigger()
+    
+    async def check_config_reload(self):
+        """Ricarica il file dell'installazione se è cambiato su disco"""
+        if self.config_watcher is None or not self.config_watcher.changed():
+            return
+        started = time.perf_counter()
+        try:
+            configs = load_installation(self.config_watcher.path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"⚠️  Configurazione non valida, mantengo quella corrente: {e}")
+            return
+        count = await self.reload_installation(configs)
+        if count:
+            print(f"🔄 Configurazione ricaricata in {(time.perf_counter() - started) * 1000:.1f} ms "
+                  f"({count} stazioni modificate)")
+    
+    async def apply_nodeset_delta(self, filename: str) -> int:
+        """
+        Applica a runtime un delta NodeSet generato da export_nodeset.py --diff:
+        variabili modificate scritte sul posto, oggetti modificati sostituiti,
+        nodi aggiunti importati e rimossi cancellati. Le stazioni coinvolte
+        vengono riallineate senza toccare le altre. Restituisce i nodi toccati.
+        """
+        parser = XMLParser()
+        await parser.parse(filename)
+        delta = parser.root.find(f"{{{NODESET_XMLNS}}}Extensions/{{{NODESET_XMLNS}}}Extension/"
+                                 f"{{{NODESET_XMLNS}}}IrrigationDelta")
+        if delta is None:
+            raise ValueError(f"{filename} non è un delta NodeSet")
+        
+        def node_ids(tag):
+            return [ua.NodeId.from_string(el.text).Identifier
+                    for el in delta.iterfind(f"{{{NODESET_XMLNS}}}{tag}/{{{NODESET_XMLNS}}}NodeId")]
+        added, changed, removed = node_ids("Added"), node_ids("Changed"), node_ids("Removed")
+        datas = {ua.NodeId.from_string(data.nodeid).Identifier: data for data in parser.get_node_datas()}
+        
+        # Oggetti modificati: sostituiti con il loro sottoalbero (incluso nel delta)
+        replaced = [path for path in changed if datas[path].nodetype != "UAVariable"]
+        in_place = [path for path in changed if path not in replaced
+                    and not any(path.startswith(root + ".") for root in replaced)]
+        
+        async with self._model_lock:
+            # Cancella solo le radici dei sottoalberi rimossi o sostituiti
+            doomed = set(removed) | set(replaced)
+            roots = [path for path in doomed if str(path).rpartition(".")[0] not in doomed]
+            self._delete_subtrees([self._nid(path) for path in roots])
+            
+            # Importa i nodi nuovi o sostituiti
+            for element in list(parser.root):
+                node_id = element.get("NodeId")
+                if node_id is not None and ua.NodeId.from_string(node_id).Identifier in in_place:
+                    parser.root.remove(element)
+            if len(added) + len(changed) > len(in_place):
+                await self.server.import_xml(xmlstring=ET.tostring(parser.root, encoding="unicode"))
+            
+            # Variabili modificate: nuovo valore e accesso sul posto
+            for path in in_place:
+                data = datas[path]
+                node = self.server.get_node(self._nid(path))
+                if data.value is not None:
+                    variant_type = getattr(ua.VariantType, data.valuetype)
+                    await node.write_value(ua.Variant(data.value, variant_type))
+                access = data.accesslevel if data.accesslevel is not None else ua.AccessLevel.CurrentRead.mask
+                await node.write_attribute(ua.AttributeIds.AccessLevel, ua.DataValue(ua.Variant(access, ua.VariantType.Byte)))
+                await node.write_attribute(ua.AttributeIds.UserAccessLevel, ua.DataValue(ua.Variant(access, ua.VariantType.Byte)))
+            
+            self._reconcile_stations(added + changed + removed, datas, set(removed))
+        
+        # Notifica solo le radici dei sottoalberi aggiunti o rimossi
+        new_nodes = set(added)
+        await self._emit_model_change(
+            [(path, None, MODEL_CHANGE_NODE_ADDED) for path in added
+             if str(path).rpartition(".")[0] not in new_nodes]
+            + [(path, None, MODEL_CHANGE_NODE_DELETED) for path in roots if path in removed])
+        
+        touched = len(added) + len(changed) + len(removed)
+        print(f"🧩 Delta NodeSet applicato: {len(added)} aggiunti, {len(changed)} modificati, {len(removed)} rimossi")
+        return touched
+    
+    def _reconcile_stations(self, paths: List[str], datas: Dict, removed: set):
+        """Allinea controller, simulazione e riferimenti ai nodi delle stazioni toccate dal delta"""
+        prefix = STATIONS_PATH + "."
+        station_ids = {str(path)[len(prefix):].partition(".")[0]
+                       for path in paths if str(path).startswith(prefix)}
+        
+        for station_id in station_ids:
+            base = f"{STATIONS_PATH}.{station_id}"
+            station = self.irrigation_system.stations.get(station_id)
+            if base in removed:
+                if station is not None:
+                    self._unregister_station_nodes(station_id, list(station.valves))
+                    self.irrigation_system.remove_station(station_id)
+                    if self.simulation_pool is not None:
+                        self.simulation_pool.remove_station(station_id)
+                    print(f"➖ Stazione {station_id} rimossa")
+                continue
+            
+            def info(name, current):
+                data = datas.get(f"{base}.StationInfo.{name}")
+                return data.value if data is not None and data.value is not None else current
+            
+            config = {
+                "id": station_id,
+                "description": info("Description", station.description if station else ""),
+                "valves": int(info("ValveCount", station.valve_count if station else 0)),
+            }
+            if station is None:
+                station = self.irrigation_system.add_station(config)
+                if self.simulation_pool is not None:
+                    self.simulation_pool.add_station(config)
+                print(f"➕ Stazione {station_id} aggiunta ({config['valves']} valvole)")
+            elif (config["description"], config["valves"]) != (station.description, station.valve_count):
+                old_valves = list(station.valves)
+                self.irrigation_system.update_station(config)
+                self._unregister_station_nodes(station_id, [v for v in old_valves if v not in station.valves])
+                if self.simulation_pool is not None:
+                    self.simulation_pool.update_station(config)
+                print(f"🔧 Stazione {station_id} aggiornata ({config['valves']} valvole)")
+            self._register_station_nodes(station_id, station)
+    
+    @uamethod
+    async def _apply_delta_method(self, parent, filename: str):
+        """Metodo OPC-UA ApplyNodeSetDelta: applica un delta dalla directory del server"""
+        filename = os.path.basename(filename or "")
+        if not os.path.isfile(filename):
+            raise ua.UaStatusCodeError(ua.StatusCodes.BadNotFound)
+        try:
+            return await self.apply_nodeset_delta(filename)
+        except (ValueError, ET.ParseError) as e:
+            print(f"❌ Delta NodeSet non valido: {e}")
+            raise ua.UaStatusCodeError(ua.StatusCodes.BadInvalidArgument)
+    
+    def start_profiling(self):
+        """Avvia il campionamento del thread dell'event loop"""
+        if not self.profiler.enabled:
+            self.profiler.start()
+            print(f"🔬 Profiling attivo: stack in {os.path.abspath(self.profiler.directory)}")
+    
+    async def stop_profiling(self):
+        """Ferma il campionamento (l'ultimo file viene scritto fuori dal loop)"""
+        if self.profiler.enabled:
+            await asyncio.to_thread(self.profiler.stop)
+            print(f"🔬 Profiling fermato ({self.profiler.samples} campioni)")
+    
+    @uamethod
+    async def _set_profiling_method(self, parent, enable: bool):
+        """Metodo OPC-UA SetProfiling: attiva/disattiva il profiler e restituisce la directory dei file"""
+        if enable:
+            try:
+                self.start_profiling()
+            except OSError as e:
+                print(f"❌ Impossibile avviare il profiling: {e}")
+                raise ua.UaStatusCodeError(ua.StatusCodes.BadResourceUnavailable)
+        else:
+            await self.stop_profiling()
+        return os.path.abspath(self.profiler.directory)
+    
+    def _check_command(self, full_valve_id: str, action: str, duration: int):
+        if self.irrigation_system.get_valve(full_valve_id) is None:
+            raise ua.UaStatusCodeError(ua.StatusCodes.BadNotFound)
+        if action not in COMMAND_ACTIONS or (action == "start" and duration <= 0):
+            raise ua.UaStatusCodeError(ua.StatusCodes.BadInvalidArgument)
+    
+    def queue_command(self, full_valve_id: str, action: str, duration: int, correlation_id: str,
+                      client_timestamp: Optional[datetime], source: str, lane=None) -> str:
+        """
+        Accoda un comando arrivato da un metodo; restituisce l'id di correlazione usato.
+        La corsia è quella della sessione chiamante (default: una per sorgente).
+        """
+        self._check_command(full_valve_id, action, duration)
+        return self._enqueue_command(full_valve_id, action == "start", action == "stop", int(duration),
+                                     correlation_id, epoch(client_timestamp), source,
+                                     source if lane is None else lane)
+    
+    @staticmethod
+    def _method_lane() -> int:
+        """
+        Corsia della sessione che chiama un metodo. asyncua non passa la sessione alle
+        callback dei metodi, ma serve le richieste di ogni connessione in un proprio task:
+        il task corrente identifica il chiamante (come id(event.user) per le scritture).
+        """
+        return id(asyncio.current_task())
+    
+    @uamethod
+    async def _execute_command_method(self, parent, valve_id: str, action: str, duration: int,
+                                      correlation_id: str, client_timestamp: datetime):
+        """Metodo OPC-UA ExecuteCommand(valvola, "start"|"stop", durata, id, timestamp client) → id"""
+        action = (action or "").lower()
+        try:
+            correlation_id = self.queue_command(valve_id, action, duration or 0, correlation_id or "",
+                                                client_timestamp, "method", self._method_lane())
+        except ua.UaStatusCodeError as e:
+            # Lo stato (coda piena, limite, argomenti) arriva al client così com'è
+            if e.code in (ua.StatusCodes.BadNotFound, ua.StatusCodes.BadInvalidArgument):
+                self._audit_rejected(valve_id, action == "start", "method", e.code)
+            return ua.StatusCode(e.code)
+        await self._publish_coalesced()
+        return correlation_id
+    
+    @uamethod
+    async def _execute_commands_method(self, parent, valve_ids: str, actions: str, duration: int,
+                                       correlation_id: str, client_timestamp: datetime):
+        """
+        Metodo OPC-UA ExecuteCommands: più valvole separate da virgola, azioni separate da
+        virgola (una sola = stessa azione per tutte). Ogni comando riceve l'id
+        "<id>/<indice>"; restituisce il numero di comandi accodati.
+        """
+        valves = [v.strip() for v in (valve_ids or "").split(",") if v.strip()]
+        action_list = [a.strip().lower() for a in (actions or "").split(",") if a.strip()]
+        if not valves or len(action_list) not in (1, len(valves)):
+            return ua.StatusCode(ua.StatusCodes.BadInvalidArgument)
+        if len(action_list) == 1:
+            action_list *= len(valves)
+        correlation_id = correlation_id or new_correlation_id()
+        client_time = epoch(client_timestamp)
+        # Il blocco è accettato o rifiutato per intero (validazione e coda)
+        lane = self._method_lane()
+        try:
+            for valve_id, action in zip(valves, action_list):
+                self._check_command(valve_id, action, duration or 0)
+            commands = [QueuedCommand(valve_id, action == "start", action == "stop", int(duration or 0),
+                                      f"{correlation_id}/{index}", client_time, "bulk", lane)
+                        for index, (valve_id, action) in enumerate(zip(valves, action_list))]
+            replaced = self.command_queue.submit_many(commands)
+        except ua.UaStatusCodeError as e:
+            for valve_id, action in zip(valves, action_list):
+                self._audit_rejected(valve_id, action == "start", "bulk", e.code)
+            return ua.StatusCode(e.code)
+        for command in replaced:
+            self._command_coalesced(command)
+        await self._publish_coalesced()
+        for command in commands:
+            if self.journal is not None:
+                self.journal.record_command(command.valve_id, command.start, command.stop, command.duration)
+            self._audit_command(command)
+        return len(valves)
+    
+    async def dump_command_traces(self, filename: str) -> str:
+        """Scarica il ring buffer delle tracce in JSON lines (scrittura fuori dal loop)"""
+        traces = self.tracer.snapshot()
+        count = await asyncio.to_thread(dump_traces, traces, filename)
+        p50, p95, p99 = self.tracer.percentiles()
+        print(f"🧭 {count} tracce di comandi in {filename} (p50 {p50:.0f}ms, p95 {p95:.0f}ms, p99 {p99:.0f}ms)")
+        return os.path.abspath(filename)
+    
+    @uamethod
+    async def _dump_traces_method(self, parent, filename: str):
+        """Metodo OPC-UA DumpCommandTraces: scrive le tracce nella directory del server"""
+        filename = os.path.basename(filename or "") or f"command_traces_{datetime.now():%Y%m%d_%H%M%S}.jsonl"
+        try:
+            return await self.dump_command_traces(filename)
+        except OSError as e:
+            print(f"❌ Impossibile scrivere le tracce: {e}")
+            raise ua.UaStatusCodeError(ua.StatusCodes.BadResourceUnavailable)
+    
     async def start_server(self):
         """Avvia il server"""
+        if self.simulation_pool is not None:
+            # Worker avviati prima del server: i processi non devono vedere il socket in ascolto
+            self.simulation_pool.start()
+            # Irrigazioni ripristinate dal journal: trasferiscile ai worker
+            for station_id, station in self.irrigation_system.stations.items():
+                for valve_id, valve in station.valves.items():
+                    if valve.is_irrigating:
+                        self.simulation_pool.resume_valve(f"{station_id}_{valve_id}",
+                                                          valve.mode, valve.remaining_time)
         await self.server.start()
-        print("🌱 Server OPC-UA Professionale avviato su opc.tcp://localhost:48400/irrigation")
+        self.loop = asyncio.get_running_loop()
+        if self._profile_at_start:
+            self.start_profiling()
+        self._loop_lag_task = asyncio.create_task(self.metrics.watch_loop_lag())
+        if self.exporter is not None:
+            self._metrics_http = await serve_metrics(self.exporter.registry, self.metrics_port)
+            print(f"📈 Metriche OpenMetrics su http://127.0.0.1:{self.metrics_port}/metrics")
+        if self.journal is not None:
+            self.journal.start()
+        if self.audit is not None:
+            self.audit.start()
+            print(f"📝 Registro di audit in {os.path.abspath(self.audit.path)}")
+        print(f"🌱 Server OPC-UA Professionale avviato su {self.endpoint}")
         print("📍 Stazioni e valvole disponibili:")
         
         for station_id, station in self.irrigation_system.stations.items():
@@ -359,6 +1290,9 @@ class ProfessionalIrrigationServer:
         print("   • IrrigationStationType → Station1, Station2, Station3 (istanze)")
         print("   • IrrigationValveType → Valve1, Valve2, etc. (istanze)")
         print("\n💡 Premi 'e' + INVIO per esportare AddressSpace in XML")
+        print("   Premi 'a FILE' + INVIO per applicare un delta NodeSet")
+        print("   Premi 'p' + INVIO per attivare/disattivare il profiling")
+        print("   Premi 't' + INVIO per scaricare le tracce dei comandi")
         print("   Premi 'q' + INVIO per uscire")
         print("")
         
@@ -369,17 +1303,40 @@ class ProfessionalIrrigationServer:
             def input_handler():
                 while True:
                     try:
-                        cmd = input().strip().lower()
+                        line = input().strip()
+                        cmd = line.lower()
                         if cmd == 'q':
                             print("🛑 Uscita...")
+                            if self.simulation_pool is not None:
+                                self.simulation_pool.stop()
+                            if self.journal is not None:
+                                self.journal.close()
+                            if self.audit is not None:
+                                self.audit.close()
                             os._exit(0)
+                        elif cmd.startswith('a '):
+                            # Applica un delta NodeSet nel loop del server
+                            # (nome del file dalla riga originale: i percorsi distinguono maiuscole)
+                            delta_file = line[2:].strip()
+                            future = asyncio.run_coroutine_threadsafe(
+                                self.apply_nodeset_delta(delta_file), self.loop)
+                            try:
+                                future.result()
+                            except Exception as e:
+                                print(f"❌ Errore applicando il delta: {e}")
+                        elif cmd == 't':
+                            # Scarica le tracce dei comandi
+                            filename = f"command_traces_{datetime.now():%Y%m%d_%H%M%S}.jsonl"
+                            asyncio.run_coroutine_threadsafe(self.dump_command_traces(filename), self.loop)
+                        elif cmd == 'p':
+                            # Attiva/disattiva il profiler nel loop del server
+                            if self.profiler.enabled:
+                                asyncio.run_coroutine_threadsafe(self.stop_profiling(), self.loop)
+                            else:
+                                self.loop.call_soon_threadsafe(self.start_profiling)
                         elif cmd == 'e':
-                            # Esporta in thread separato
-                            async def export():
-                                await self.export_addressspace()
-                            
-                            # Programma l'export nel loop asincrono
-                            asyncio.create_task(export())
+                            # Programma l'export nel loop del server (thread-safe)
+                            self.loop.call_soon_threadsafe(self.start_export)
                             print("📤 Export avviato...")
                             
                     except EOFError:
@@ -394,18 +1351,120 @@ class ProfessionalIrrigationServer:
             # Loop principale server
             while True:
                 await self.update_nodes()
+                await self.check_config_reload()
                 await asyncio.sleep(1)
                 
         except KeyboardInterrupt:
             print("\n🛑 Arresto server...")
         finally:
+            if self.simulation_pool is not None:
+                self.simulation_pool.stop()
+            if self.journal is not None:
+                self.journal.close()
+            if self.audit is not None:
+                self.audit.close()
+            if self._metrics_http is not None:
+                self._metrics_http.close()
+            self.profiler.stop()
             await self.server.stop()
 
 async def main():
     """Funzione principale"""
+    import sys
+    
+    args = sys.argv[1:]
+    
+    # Numero di processi per la simulazione (0 = stesso processo del server)
+    sim_workers = 1
+    if "--sim-workers" in args:
+        try:
+            sim_workers = int(args[args.index("--sim-workers") + 1])
+        except (ValueError, IndexError):
+            print("❌ Errore: numero di worker non valido dopo --sim-workers")
+            return
+    
+    # CSV meteo locale per l'evapotraspirazione
+    weather_csv = None
+    if "--weather" in args:
+        try:
+            weather_csv = args[args.index("--weather") + 1]
+        except IndexError:
+            print("❌ Errore: file CSV non specificato dopo --weather")
+            return
+    
+    # Directory del write-ahead log dello stato
+    state_dir = "state"
+    if "--state-dir" in args:
+        try:
+            state_dir = args[args.index("--state-dir") + 1]
+        except IndexError:
+            print("❌ Errore: directory non specificata dopo --state-dir")
+            return
+    if "--no-state" in args:
+        state_dir = None
+    
+    # File JSON dell'installazione, ricaricato a caldo quando cambia
+    config_file = None
+    if "--config" in args:
+        try:
+            config_file = args[args.index("--config") + 1]
+        except IndexError:
+            print("❌ Errore: file non specificato dopo --config")
+            return
+    
+    # Porta locale dell'endpoint OpenMetrics (disattivato se non indicata)
+    metrics_port = None
+    if "--metrics-port" in args:
+        try:
+            metrics_port = int(args[args.index("--metrics-port") + 1])
+        except (ValueError, IndexError):
+            print("❌ Errore: porta non valida dopo --metrics-port")
+            return
+    
+    # Profiler a campionamento attivo dall'avvio (file collapsed-stack in --profile-dir)
+    profile = "--profile" in args
+    profile_dir = "profiles"
+    if "--profile-dir" in args:
+        try:
+            profile_dir = args[args.index("--profile-dir") + 1]
+        except IndexError:
+            print("❌ Errore: directory non specificata dopo --profile-dir")
+            return
+    
+    # Coda dei comandi: valvole in attesa oltre le quali si risponde "occupato", comandi/s per sessione
+    command_queue_size = DEFAULT_CAPACITY
+    command_rate = DEFAULT_RATE
+    try:
+        if "--command-queue" in args:
+            command_queue_size = int(args[args.index("--command-queue") + 1])
+        if "--command-rate" in args:
+            command_rate = float(args[args.index("--command-rate") + 1])
+    except (ValueError, IndexError):
+        print("❌ Errore: valore non valido dopo --command-queue o --command-rate")
+        return
+    
+    # Directory del registro di audit (file JSON-lines ruotati e compressi)
+    audit_dir = "audit"
+    if "--audit-dir" in args:
+        try:
+            audit_dir = args[args.index("--audit-dir") + 1]
+        except IndexError:
+            print("❌ Errore: directory non specificata dopo --audit-dir")
+            return
+    if "--no-audit" in args:
+        audit_dir = None
+    
     print("🌱 Server OPC-UA Professionale - Sistema di Irrigazione")
     print("=" * 60)
-    server = ProfessionalIrrigationServer()
+    try:
+        server = ProfessionalIrrigationServer(sim_workers=sim_workers, weather_csv=weather_csv,
+                                              state_dir=state_dir, config_file=config_file,
+                                              metrics_port=metrics_port, profile=profile,
+                                              profile_dir=profile_dir, command_queue_size=command_queue_size,
+                                              command_rate=command_rate, audit_dir=audit_dir)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"❌ Configurazione dell'installazione non valida: {e}")
+        return
     await server.init_server()
     await server.start_server()
 
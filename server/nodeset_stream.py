@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Export NodeSet2 XML in streaming dal server in esecuzione
+
+Il namespace viene visitato a blocchi di nodi leggendo direttamente l'address
+space interno (nessuna lettura OPC-UA asincrona per attributo). Ogni blocco
+serializzato viene passato a un thread di scrittura tramite una coda limitata
+e tra un blocco e l'altro si restituisce il controllo all'event loop, così il
+traffico dei client non subisce picchi di latenza.
+"""
+
+import asyncio
+import base64
+import os
+import queue
+import threading
+from collections import deque
+from typing import Iterable, List, Optional
+from xml.sax.saxutils import escape, quoteattr
+
+from asyncua import ua
+
+# Alias standard usati nel NodeSet (ns=0)
+ALIASES = {
+    "Boolean": "i=1", "Int32": "i=6", "UInt32": "i=7", "Int64": "i=8", "Double": "i=11",
+    "String": "i=12", "DateTime": "i=13", "Argument": "i=296",
+    "Organizes": "i=35", "HasEventSource": "i=36", "HasModellingRule": "i=37",
+    "HasTypeDefinition": "i=40", "HasSubtype": "i=45", "HasProperty": "i=46",
+    "HasComponent": "i=47", "HasNotifier": "i=48", "GeneratesEvent": "i=41",
+}
+_ALIAS_BY_ID = {value: name for name, value in ALIASES.items()}
+
+_INVERSE = ' IsForward="false"'
+
+# Riferimenti che identificano il padre di un nodo
+_PARENT_REFERENCES = {35, 45, 46, 47}
+
+_NODECLASS_TAGS = {
+    ua.NodeClass.Object: "UAObject",
+    ua.NodeClass.ObjectType: "UAObjectType",
+    ua.NodeClass.Variable: "UAVariable",
+    ua.NodeClass.VariableType: "UAVariableType",
+    ua.NodeClass.Method: "UAMethod",
+    ua.NodeClass.DataType: "UADataType",
+    ua.NodeClass.ReferenceType: "UAReferenceType",
+}
+
+_NUMERIC_TYPES = {
+    ua.VariantType.SByte, ua.VariantType.Byte, ua.VariantType.Int16, ua.VariantType.UInt16,
+    ua.VariantType.Int32, ua.VariantType.UInt32, ua.VariantType.Int64, ua.VariantType.UInt64,
+    ua.VariantType.Float, ua.VariantType.Double,
+}
+
+class _ChunkWriter(threading.Thread):
+    """Thread che scrive su disco i blocchi XML ricevuti dalla coda"""
+
+    def __init__(self, path: str, max_chunks: int = 16):
+        super().__init__(name="nodeset-writer", daemon=True)
+        self.path = path
+        self.chunks: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=max_chunks)
+        self.error: Optional[BaseException] = None
+
+    def run(self):
+        tmp_path = self.path + ".tmp"
+        finished = False
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                while True:
+                    chunk = self.chunks.get()
+                    if chunk is None:
+                        finished = True
+                        break
+                    f.write(chunk)
+            os.replace(tmp_path, self.path)
+        except BaseException as e:  # Riportato al chiamante a fine export
+            self.error = e
+            # Svuota la coda per non bloccare il produttore, solo se il terminatore
+            # non è già stato letto (errore in chiusura o in os.replace)
+            while not finished and self.chunks.get() is not None:
+                pass
+
+class StreamingNodeSetExporter:
+    """Esporta un namespace del server come NodeSet2 XML a blocchi"""
+
+    def __init__(self, server, ns_idx: int, namespace_uri: str, chunk_nodes: int = 200):
+        self.aspace = server.iserver.aspace
+        self.ns_idx = ns_idx
+        self.namespace_uri = namespace_uri
+        self.chunk_nodes = chunk_nodes
+
+    # ------------------------------------------------------------------
+    # Formattazione
+    # ------------------------------------------------------------------
+    def _nodeid(self, nodeid: ua.NodeId) -> str:
+        """NodeId nel formato XML, con il namespace rimappato sull'indice 1"""
+        if nodeid.NamespaceIndex == 0:
+            prefix = ""
+        elif nodeid.NamespaceIndex == self.ns_idx:
+            prefix = "ns=1;"
+        else:
+            prefix = f"ns={nodeid.NamespaceIndex};"
+
+        if nodeid.NodeIdType == ua.NodeIdType.String:
+            return f"{prefix}s={nodeid.Identifier}"
+        if nodeid.NodeIdType == ua.NodeIdType.Guid:
+            return f"{prefix}g={nodeid.Identifier}"
+        if nodeid.NodeIdType == ua.NodeIdType.ByteString:
+            return f"{prefix}b={base64.b64encode(nodeid.Identifier).decode()}"
+        return f"{prefix}i={nodeid.Identifier}"
+
+    def _alias(self, nodeid: ua.NodeId) -> str:
+        text = self._nodeid(nodeid)
+        return _ALIAS_BY_ID.get(text, text)
+
+    def _browse_name(self, qname: ua.QualifiedName) -> str:
+        if qname.NamespaceIndex == self.ns_idx:
+            return f"1:{qname.Name}"
+        if qname.NamespaceIndex == 0:
+            return qname.Name
+        return f"{qname.NamespaceIndex}:{qname.Name}"
+
+    @staticmethod
+    def _attr(node, attribute: ua.AttributeIds):
+        value = node.attributes.get(attribute)
+        if value is None or value.value is None or value.value.Value is None:
+            return None
+        return value.value.Value.Value
+
+    @staticmethod
+    def _scalar_xml(vtype: ua.VariantType, value) -> Optional[str]:
+        name = vtype.name
+        if vtype == ua.VariantType.Boolean:
+            return f"<uax:{name}>{'true' if value else 'false'}</uax:{name}>"
+        if vtype in _NUMERIC_TYPES:
+            return f"<uax:{name}>{value}</uax:{name}>"
+        if vtype == ua.VariantType.String:
+            return f"<uax:{name}>{escape(value)}</uax:{name}>"
+        if vtype == ua.VariantType.DateTime:
+            return f"<uax:{name}>{value.strftime('%Y-%m-%dT%H:%M:%SZ')}</uax:{name}>"
+        if vtype == ua.VariantType.ExtensionObject and isinstance(value, ua.Argument):
+            return (
+                "<uax:ExtensionObject><uax:TypeId><uax:Identifier>i=297</uax:Identifier></uax:TypeId>"
+                f"<uax:Body><uax:Argument><uax:Name>{escape(value.Name or '')}</uax:Name>"
+                f"<uax:DataType><uax:Identifier>{value.DataType.to_string()}</uax:Identifier></uax:DataType>"
+                f"<uax:ValueRank>{value.ValueRank}</uax:ValueRank><uax:ArrayDimensions />"
+                "<uax:Description /></uax:Argument></uax:Body></uax:ExtensionObject>"
+            )
+        return None
+
+    def _value_xml(self, node) -> str:
+        value = node.attributes.get(ua.AttributeIds.Value)
+        if value is None or value.value is None or value.value.Value is None:
+            return ""
+        variant = value.value.Value
+        if variant.Value is None:
+            return ""
+        if isinstance(variant.Value, list):
+            items = [self._scalar_xml(variant.VariantType, item) for item in variant.Value]
+            if any(item is None for item in items):
+                return ""
+            return (f"<Value><uax:ListOf{variant.VariantType.name}>{''.join(items)}"
+                    f"</uax:ListOf{variant.VariantType.name}></Value>")
+        item = self._scalar_xml(variant.VariantType, variant.Value)
+        return f"<Value>{item}</Value>" if item is not None else ""
+
+    def node_xml(self, node) -> str:
+        """Serializza un nodo dell'address space"""
+        nodeclass = self._attr(node, ua.AttributeIds.NodeClass)
+        tag = _NODECLASS_TAGS.get(ua.NodeClass(nodeclass)) if nodeclass is not None else None
+        if tag is None:
+            return ""
+
+        browse_name = self._attr(node, ua.AttributeIds.BrowseName)
+        display_name = self._attr(node, ua.AttributeIds.DisplayName)
+        attrs = [f"NodeId={quoteattr(self._nodeid(node.nodeid))}",
+                 f"BrowseName={quoteattr(self._browse_name(browse_name))}"]
+
+        parent = next((ref.NodeId for ref in node.references
+                       if not ref.IsForward and ref.ReferenceTypeId.Identifier in _PARENT_REFERENCES
+                       and ref.ReferenceTypeId.NamespaceIndex == 0), None)
+        if parent is not None and tag != "UAObjectType":
+            attrs.append(f"ParentNodeId={quoteattr(self._nodeid(parent))}")
+
+        if tag in ("UAVariable", "UAVariableType"):
+            data_type = self._attr(node, ua.AttributeIds.DataType)
+            if data_type is not None:
+                attrs.append(f"DataType={quoteattr(self._alias(data_type))}")
+            value_rank = self._attr(node, ua.AttributeIds.ValueRank)
+            if value_rank not in (None, -1):
+                attrs.append(f'ValueRank="{value_rank}"')
+            access_level = self._attr(node, ua.AttributeIds.AccessLevel)
+            if access_level not in (None, 1):
+                attrs.append(f'AccessLevel="{access_level}"')
+            user_access_level = self._attr(node, ua.AttributeIds.UserAccessLevel)
+            if user_access_level not in (None, 1):
+                attrs.append(f'UserAccessLevel="{user_access_level}"')
+        elif tag == "UAObject":
+            notifier = self._attr(node, ua.AttributeIds.EventNotifier)
+            if notifier:
+                attrs.append(f'EventNotifier="{notifier}"')
+        elif tag == "UAObjectType" and self._attr(node, ua.AttributeIds.IsAbstract):
+            attrs.append('IsAbstract="true"')
+
+        references = "".join(
+            f"<Reference ReferenceType={quoteattr(self._alias(ref.ReferenceTypeId))}"
+            f"{'' if ref.IsForward else _INVERSE}>{escape(self._nodeid(ref.NodeId))}</Reference>"
+            for ref in node.references
+        )
+        name = display_name.Text if display_name is not None else browse_name.Name
+        return (f"  <{tag} {' '.join(attrs)}>\n"
+                f"    <DisplayName>{escape(name or '')}</DisplayName>\n"
+                f"    <References>{references}</References>\n"
+                f"    {self._value_xml(node)}\n"
+                f"  </{tag}>\n")
+
+    def header_xml(self) -> str:
+        aliases = "".join(f'    <Alias Alias="{name}">{nodeid}</Alias>\n' for name, nodeid in ALIASES.items())
+        return ('<?xml version="1.0" encoding="utf-8"?>\n'
+                '<UANodeSet xmlns="http://opcfoundation.org/UA/2011/03/UANodeSet.xsd" '
+                'xmlns:uax="http://opcfoundation.org/UA/2008/02/Types.xsd">\n'
+                f"  <NamespaceUris>\n    <Uri>{escape(self.namespace_uri)}</Uri>\n  </NamespaceUris>\n"
+                f"  <Aliases>\n{aliases}  </Aliases>\n")
+
+    # ------------------------------------------------------------------
+    # Visita ed export
+    # ------------------------------------------------------------------
+    async def iter_chunks(self, roots: Iterable[ua.NodeId]):
+        """Visita in ampiezza il namespace a partire dalle radici, a blocchi"""
+        pending = deque(root for root in roots if root in self.aspace)
+        visited = set(pending)
+        chunk: List[str] = []
+        count = 0
+
+        while pending:
+            node = self.aspace.get(pending.popleft())
+            if node is None:
+                continue
+            chunk.append(self.node_xml(node))
+            count += 1
+
+            for ref in node.references:
+                target = ref.NodeId
+                if (ref.IsForward and target.NamespaceIndex == self.ns_idx
+                        and target not in visited):
+                    visited.add(target)
+                    pending.append(target)
+
+            if len(chunk) >= self.chunk_nodes:
+                yield "".join(chunk), count
+                chunk = []
+
+        yield "".join(chunk), count
+
+    async def export(self, roots: Iterable[ua.NodeId], path: str) -> int:
+        """Esporta il namespace nel file indicato, restituisce il numero di nodi"""
+        writer = _ChunkWriter(path)
+        writer.start()
+        count = 0
+        try:
+            await self._put(writer, self.header_xml())
+            async for chunk, count in self.iter_chunks(roots):
+                if writer.error is not None:
+                    break  # Scrittura fallita: inutile serializzare il resto
+                await self._put(writer, chunk)
+                # Lascia servire le richieste dei client tra un blocco e l'altro
+                await asyncio.sleep(0)
+            await self._put(writer, "</UANodeSet>\n")
+        finally:
+            await self._put(writer, None)
+            await asyncio.get_running_loop().run_in_executor(None, writer.join)
+        if writer.error is not None:
+            raise writer.error
+        return count
+
+    @staticmethod
+    async def _put(writer: _ChunkWriter, chunk: Optional[str]):
+        """Accoda un blocco senza bloccare l'event loop se la coda è piena"""
+        while True:
+            try:
+                writer.chunks.put_nowait(chunk)
+                return
+            except queue.Full:
+                if not writer.is_alive():
+                    return
+                await asyncio.sleep(0.005)
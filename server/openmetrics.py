@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Esposizione delle metriche in formato OpenMetrics (testo, compatibile Prometheus)
+
+Le serie vengono aggiornate in modo incrementale da chi produce i valori: ogni
+set() riscrive solo la riga della serie interessata, e il testo di una famiglia
+viene ricomposto solo se qualcosa è cambiato dall'ultimo scrape. Uno scrape con
+10k valvole è quindi una concatenazione di stringhe già pronte.
+
+Modulo senza dipendenze dal resto del server: è usato anche da client/monitor_client.py.
+"""
+
+import asyncio
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+def labels(**values) -> str:
+    """Insieme di etichette già formattato (da calcolare una volta per serie e riusare)"""
+    if not values:
+        return ""
+    pairs = []
+    for name, value in values.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+def _number(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+class MetricFamily:
+    """Famiglia di serie gauge o counter con righe pre-renderizzate"""
+
+    def __init__(self, name: str, kind: str, help_text: str, unit: str = ""):
+        self.name = name
+        self.kind = kind
+        # I campioni di un counter hanno il suffisso _total
+        self.sample_name = f"{name}_total" if kind == "counter" else name
+        header = [f"# TYPE {name} {kind}\n"]
+        if unit:
+            header.append(f"# UNIT {name} {unit}\n")
+        header.append(f"# HELP {name} {help_text}\n")
+        self._header = "".join(header)
+        self._lines: Dict[str, str] = {}
+        self._text: Optional[str] = None
+
+    def set(self, label_set: str, value):
+        self._lines[label_set] = f"{self.sample_name}{label_set} {_number(value)}\n"
+        self._text = None
+
+    def remove(self, label_set: str):
+        if self._lines.pop(label_set, None) is not None:
+            self._text = None
+
+    def render(self) -> str:
+        if self._text is None:
+            self._text = self._header + "".join(self._lines.values())
+        return self._text
+
+class Histogram:
+    """Istogramma a bucket fissi (l'ultimo bucket raccoglie i valori oltre l'ultimo limite)"""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds: List[float] = list(bounds)
+        self.counts: List[int] = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+class CallbackFamily:
+    """Famiglia a serie singola letta al momento dello scrape (solo per valori O(1))"""
+
+    def __init__(self, name: str, kind: str, help_text: str, read: Callable[[], float], unit: str = ""):
+        self._family = MetricFamily(name, kind, help_text, unit)
+        self._read = read
+
+    def render(self) -> str:
+        self._family.set("", self._read())
+        return self._family.render()
+
+class HistogramFamily:
+    """
+    Istogramma renderizzato da un oggetto con bounds, counts (non cumulativi),
+    count e sum, come Histogram. scale converte l'unità dei limiti
+    (es. 0.001 per esporre in secondi un istogramma in millisecondi).
+    """
+
+    def __init__(self, name: str, help_text: str, histogram, unit: str = "", scale: float = 1.0):
+        self.name = name
+        self.histogram = histogram
+        self.scale = scale
+        header = [f"# TYPE {name} histogram\n"]
+        if unit:
+            header.append(f"# UNIT {name} {unit}\n")
+        header.append(f"# HELP {name} {help_text}\n")
+        self._header = "".join(header)
+        self._bucket_labels = [labels(le=_number(bound * scale)) for bound in histogram.bounds]
+        self._bucket_labels.append(labels(le="+Inf"))
+
+    def render(self) -> str:
+        lines = [self._header]
+        cumulative = 0
+        for label_set, count in zip(self._bucket_labels, self.histogram.counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{label_set} {cumulative}\n")
+        lines.append(f"{self.name}_count {self.histogram.count}\n")
+        lines.append(f"{self.name}_sum {_number(self.histogram.sum * self.scale)}\n")
+        return "".join(lines)
+
+class MetricsRegistry:
+    """Insieme ordinato di famiglie esposte da un endpoint"""
+
+    def __init__(self):
+        self._families: List = []
+
+    def gauge(self, name: str, help_text: str, unit: str = "") -> MetricFamily:
+        return self._add(MetricFamily(name, "gauge", help_text, unit))
+
+    def counter(self, name: str, help_text: str, unit: str = "") -> MetricFamily:
+        return self._add(MetricFamily(name, "counter", help_text, unit))
+
+    def gauge_callback(self, name: str, help_text: str, read: Callable[[], float], unit: str = "") -> CallbackFamily:
+        return self._add(CallbackFamily(name, "gauge", help_text, read, unit))
+
+    def counter_callback(self, name: str, help_text: str, read: Callable[[], float], unit: str = "") -> CallbackFamily:
+        return self._add(CallbackFamily(name, "counter", help_text, read, unit))
+
+    def histogram(self, name: str, help_text: str, histogram, unit: str = "", scale: float = 1.0) -> HistogramFamily:
+        return self._add(HistogramFamily(name, help_text, histogram, unit, scale))
+
+    def _add(self, family):
+        self._families.append(family)
+        return family
+
+    def render(self) -> str:
+        return "".join(family.render() for family in self._families) + "# EOF\n"
+
+async def _handle_scrape(registry: MetricsRegistry, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+        # Ignora gli header della richiesta
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/metrics", "/"):
+            body = registry.render().encode("utf-8")
+            status, content_type = "200 OK", CONTENT_TYPE
+        else:
+            body = b"Not Found\n"
+            status, content_type = "404 Not Found", "text/plain; charset=utf-8"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def serve_metrics(registry: MetricsRegistry, port: int, host: str = "127.0.0.1") -> asyncio.AbstractServer:
+    """Avvia l'endpoint HTTP locale (GET /metrics) nello stesso event loop"""
+    return await asyncio.start_server(lambda r, w: _handle_scrape(registry, r, w), host, port)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Profiler a campionamento del thread del server
+
+Un thread separato legge a intervalli regolari lo stack del thread dell'event loop
+(sys._current_frames) e conta gli stack osservati: copre update_nodes,
+IrrigationSystem.update e gli handler delle richieste asyncua, che girano tutti
+in quel thread. I campioni in cui il loop è fermo in attesa di I/O vengono scartati.
+
+Gli stack sono scritti in formato collapsed ("f1;f2;f3 N", una riga per stack),
+pronto per flamegraph.pl o speedscope, in file ruotati periodicamente:
+    profiles/profile-20250601-120000.folded
+Da disattivato non c'è nessun thread né hook: il costo è nullo.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+# Funzioni in cui il loop attende I/O (campioni di inattività)
+IDLE_FUNCTIONS = frozenset({"select"})
+
+class SamplingProfiler:
+    """Campiona lo stack di un thread e scrive file collapsed-stack ruotati"""
+
+    def __init__(self, directory: str = "profiles", interval: float = 0.005,
+                 rotate_seconds: float = 60.0, keep: int = 10):
+        self.directory = directory
+        self.interval = interval
+        self.rotate_seconds = rotate_seconds
+        self.keep = keep
+        self.samples = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._target_id: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None
+
+    def start(self, target_thread_id: Optional[int] = None):
+        """Avvia il campionamento del thread indicato (default: il thread chiamante)"""
+        if self._thread is not None:
+            return
+        self._target_id = target_thread_id if target_thread_id is not None else threading.get_ident()
+        self._stop.clear()
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Ferma il campionamento e scrive l'ultimo file"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        counts: Counter = Counter()
+        rotate_at = time.monotonic() + self.rotate_seconds
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target_id)
+            if frame is None or frame.f_code.co_name in IDLE_FUNCTIONS:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            counts[tuple(stack)] += 1
+            self.samples += 1
+            if time.monotonic() >= rotate_at:
+                self._write(counts)
+                counts = Counter()
+                rotate_at = time.monotonic() + self.rotate_seconds
+        self._write(counts)
+
+    @staticmethod
+    def _frame_name(code) -> str:
+        return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+    def _write(self, counts: Counter):
+        """Scrive un file collapsed-stack e rimuove i più vecchi oltre keep"""
+        if not counts:
+            return
+        names = {}
+        lines = []
+        for stack, count in counts.items():
+            frames = []
+            # Dalla radice alla foglia, come richiesto dal formato collapsed
+            for code in reversed(stack):
+                name = names.get(code)
+                if name is None:
+                    name = names[code] = self._frame_name(code)
+                frames.append(name)
+            lines.append(f"{';'.join(frames)} {count}\n")
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, f"profile-{stamp}.folded")
+        with open(path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+        self._rotate()
+
+    def _rotate(self):
+        files = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith("profile-") and name.endswith(".folded"))
+        for name in files[:-self.keep] if self.keep > 0 else []:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Simulazione accelerata a eventi discreti di una stagione di irrigazione
+
+Esegue IrrigationSystem senza server OPC-UA con un orologio virtuale che salta
+direttamente all'evento successivo (avvio programmato, fine irrigazione, passo
+del modello del suolo). Una stagione intera si valuta in pochi secondi.
+
+File programma (JSON):
+    {
+        "start": "2025-04-01T00:00:00",
+        "end": "2025-09-30T23:59:59",
+        "weather": "meteo.csv",                      (opzionale)
+        "stations": [{"id": "Station1", ...}],       (opzionale, default installazione standard)
+        "program": [
+            {"valve": "Station1_Valve1", "time": "06:00", "duration": 600, "days": [0, 2, 4]}
+        ]
+    }
+"days" usa 0 = lunedì ... 6 = domenica; se omesso il programma è giornaliero.
+"""
+
+import asyncio
+import heapq
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from clock import VirtualClock
+from irrigation_server import DEFAULT_STATION_CONFIGS, IrrigationSystem
+
+# Passo massimo del modello del suolo (secondi simulati)
+SOIL_STEP_SECONDS = 900
+
+def _program_occurrences(entry: Dict, start: datetime, end: datetime):
+    """Genera gli istanti di avvio di una voce del programma nel periodo"""
+    hours, minutes = (int(part) for part in entry["time"].split(":"))
+    days = set(entry.get("days", range(7)))
+    day = start.replace(hour=hours, minute=minutes, second=0, microsecond=0)
+    if day < start:
+        day += timedelta(days=1)
+    while day <= end:
+        if day.weekday() in days:
+            yield day
+        day += timedelta(days=1)
+
+class SeasonSimulator:
+    """Simulatore a eventi discreti per programmi di irrigazione"""
+
+    def __init__(self, program: Dict):
+        self.start = datetime.fromisoformat(program["start"])
+        self.end = datetime.fromisoformat(program["end"])
+        self.clock = VirtualClock(self.start)
+        self.system = IrrigationSystem(
+            program.get("stations", DEFAULT_STATION_CONFIGS),
+            program.get("weather"),
+            self.clock,
+        )
+        self.program = program.get("program", [])
+
+        # Coda eventi: (istante, progressivo, id valvola, durata, generatore)
+        self._events: List[Tuple] = []
+        self._sequence = 0
+        for entry in self.program:
+            if self.system.get_valve(entry["valve"]) is None:
+                raise ValueError(f"Valvola {entry['valve']} non presente nell'installazione")
+            self._push(_program_occurrences(entry, self.start, self.end), entry)
+
+        self.min_moisture = {station_id: 100.0 for station_id in self.system.stations}
+
+    def _push(self, occurrences, entry: Dict):
+        """Inserisce in coda la prossima occorrenza di una voce del programma"""
+        when = next(occurrences, None)
+        if when is not None:
+            self._sequence += 1
+            heapq.heappush(self._events, (when, self._sequence, entry, occurrences))
+
+    def _next_valve_end(self) -> Optional[datetime]:
+        """Fine dell'irrigazione in corso più vicina"""
+        ends = [
+            valve.start_time + timedelta(seconds=valve.duration)
+            for station in self.system.stations.values()
+            for valve in station.valves.values()
+            if valve.is_irrigating
+        ]
+        return min(ends) if ends else None
+
+    async def run(self) -> Dict:
+        """Esegue la simulazione e restituisce i risultati"""
+        wall_start = time.perf_counter()
+        steps = 0
+        now = self.start
+
+        while now < self.end:
+            # Programma le irrigazioni il cui avvio è arrivato
+            while self._events and self._events[0][0] <= now:
+                when, _, entry, occurrences = heapq.heappop(self._events)
+                self.system.get_valve(entry["valve"]).schedule_irrigation(when, entry["duration"])
+                self._push(occurrences, entry)
+
+            await self.system.update()
+            steps += 1
+            for station_id in self.system.stations:
+                moisture = self.system.soil_model.moisture_percent(station_id)
+                if moisture < self.min_moisture[station_id]:
+                    self.min_moisture[station_id] = moisture
+
+            # Prossimo evento: avvio, fine irrigazione o passo del suolo
+            candidates = [now + timedelta(seconds=SOIL_STEP_SECONDS), self.end]
+            if self._events:
+                candidates.append(self._events[0][0])
+            valve_end = self._next_valve_end()
+            if valve_end is not None:
+                candidates.append(valve_end)
+            now = max(min(candidates), now + timedelta(seconds=1))
+            self.clock.set(now)
+
+        await self.system.update()
+        wall_seconds = time.perf_counter() - wall_start
+        return self._results(steps, wall_seconds)
+
+    def _results(self, steps: int, wall_seconds: float) -> Dict:
+        """Risultati compatti: acqua usata e ore-valvola"""
+        valves = {}
+        for station_id, station in self.system.stations.items():
+            for valve_id, valve in station.valves.items():
+                valves[f"{station_id}_{valve_id}"] = {
+                    "water_liters": round(valve.water_used, 1),
+                    "valve_hours": round(valve.irrigated_seconds / 3600.0, 3),
+                    "irrigations": valve.irrigation_count,
+                }
+        stations = {
+            station_id: {
+                "final_soil_moisture": round(self.system.soil_model.moisture_percent(station_id), 1),
+                "min_soil_moisture": round(self.min_moisture[station_id], 1),
+            }
+            for station_id in self.system.stations
+        }
+        simulated_seconds = (self.end - self.start).total_seconds()
+        return {
+            "start": self.start.isoformat(),
+            "end": self.end.isoformat(),
+            "simulated_seconds": simulated_seconds,
+            "wall_seconds": round(wall_seconds, 3),
+            "speedup": round(simulated_seconds / wall_seconds) if wall_seconds > 0 else None,
+            "steps": steps,
+            "total_water_liters": round(sum(v["water_liters"] for v in valves.values()), 1),
+            "total_valve_hours": round(sum(v["valve_hours"] for v in valves.values()), 3),
+            "valves": valves,
+            "stations": stations,
+        }
+
+def print_help():
+    """Mostra l'help del programma"""
+    print("""
+🌱 Simulatore stagionale - Sistema di Irrigazione
+
+UTILIZZO:
+    python server/season_simulator.py PROGRAMMA.json [-o RISULTATI.json]
+
+OPZIONI:
+    -h, --help          Mostra questo messaggio di aiuto
+    -o FILE             File dei risultati (default: season_results.json)
+    """)
+
+async def main():
+    """Funzione principale"""
+    args = sys.argv[1:]
+
+    if not args or "-h" in args or "--help" in args:
+        print_help()
+        return
+
+    output_file = "season_results.json"
+    if "-o" in args:
+        try:
+            output_file = args[args.index("-o") + 1]
+        except IndexError:
+            print("❌ Errore: file non specificato dopo -o")
+            return
+
+    with open(args[0]) as f:
+        program = json.load(f)
+
+    print(f"🌱 Simulazione stagione {program['start']} → {program['end']}...")
+    simulator = SeasonSimulator(program)
+
+    results = await simulator.run()
+    simulator.system.soil_model.close()
+
+    with open(output_file, "w") as f:
+        json.dump(results, f, indent=1)
+
+    print(f"✅ Simulazione completata in {results['wall_seconds']}s (x{results['speedup']})")
+    print(f"💧 Acqua totale: {results['total_water_liters']} l")
+    print(f"⏱️  Ore-valvola: {results['total_valve_hours']}")
+    print(f"📁 Risultati: {os.path.abspath(output_file)}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
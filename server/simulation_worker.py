@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Simulazione del sistema di irrigazione in processi separati dal loop OPC-UA
+
+Ogni worker possiede una partizione delle stazioni, esegue i tick di
+simulazione con il proprio event loop e rimanda al server solo le variazioni
+di stato (delta) tramite una Pipe, insieme agli eventi di audit delle valvole.
+Il loop del protocollo si limita a inoltrare i comandi e ad applicare i delta
+ricevuti.
+
+I worker sono creati con lo start method "spawn": non ereditano i descrittori del
+server (socket in ascolto, estremità delle Pipe degli altri worker), quindi vedono
+EOF sulla propria Pipe appena il server termina, anche con os._exit o un crash.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+def valve_state(valve) -> Tuple:
+    """Stato pubblicato di una valvola (usato per calcolare i delta)"""
+    return (valve.is_irrigating, valve.mode, valve.remaining_time)
+
+def collect_deltas(system, last_states: Dict) -> Dict[str, Dict]:
+    """Restituisce solo le valvole e le stazioni il cui stato è cambiato dall'ultima chiamata"""
+    deltas = {"valves": {}, "stations": {}}
+    
+    # Umidità del suolo: confronto vettoriale con risoluzione 0.1%
+    soil = system.soil_model
+    moisture = np.round(soil.moisture * 100.0, 1)
+    last_moisture = last_states.get("__soil__")
+    if last_moisture is None or last_states.get("__soil_layout__") != soil.layout_version:
+        changed = range(moisture.size)
+    else:
+        changed = np.flatnonzero(moisture != last_moisture)
+    last_states["__soil__"] = moisture
+    last_states["__soil_layout__"] = soil.layout_version
+    for i in changed:
+        deltas["stations"][soil.station_ids[i]] = {"soil_moisture": float(moisture[i])}
+    
+    for station_id, station in system.stations.items():
+        for valve_id, valve in station.valves.items():
+            full_valve_id = f"{station_id}_{valve_id}"
+            state = valve_state(valve)
+            if last_states.get(full_valve_id) != state:
+                last_states[full_valve_id] = state
+                deltas["valves"][full_valve_id] = {
+                    "is_irrigating": valve.is_irrigating,
+                    "mode": valve.mode,
+                    "remaining_time": valve.remaining_time,
+                }
+    return deltas
+
+def _handle_message(system, message, applied: List[str]) -> bool:
+    """Applica un messaggio del server al sistema simulato. False = termina"""
+    kind = message[0]
+    if kind == "stop":
+        return False
+    if kind == "system_on":
+        system.system_on = message[1]
+    elif kind == "command":
+        _, full_valve_id, start, stop, duration = message
+        valve = system.get_valve(full_valve_id)
+        if valve is not None:
+            valve.command_start = start
+            valve.command_stop = stop
+            valve.command_duration = duration
+        applied.append(full_valve_id)
+    elif kind == "resume":
+        _, full_valve_id, mode, remaining = message
+        valve = system.get_valve(full_valve_id)
+        if valve is not None and not valve.is_irrigating:
+            valve.resume_irrigation(mode, remaining)
+    elif kind == "add_station":
+        system.add_station(message[1])
+    elif kind == "update_station":
+        system.update_station(message[1])
+    elif kind == "remove_station":
+        system.remove_station(message[1])
+    return True
+
+async def _worker_loop(conn, system, update_interval: float, audit=None):
+    """Loop di simulazione del worker"""
+    last_states: Dict = {}
+    parent_pid = os.getppid()
+
+    while True:
+        tick_start = time.monotonic()
+        applied: List[str] = []
+
+        if os.getppid() != parent_pid:
+            # Server terminato senza chiudere la Pipe: il worker è stato adottato da init
+            return
+
+        try:
+            while conn.poll():
+                if not _handle_message(system, conn.recv(), applied):
+                    return
+        except (EOFError, OSError):
+            # Il server è terminato (anche con os._exit): chiudi il worker
+            return
+
+        await system.update()
+
+        # Comandi a un solo colpo come nel processo del server: uno start non eseguibile
+        # (es. a sistema spento) non resta in attesa fino al tick successivo
+        for full_valve_id in applied:
+            valve = system.get_valve(full_valve_id)
+            if valve is not None:
+                valve.command_start = valve.command_stop = False
+                valve.command_duration = 0
+
+        deltas = collect_deltas(system, last_states)
+        deltas["applied"] = applied
+        deltas["audit"] = audit.drain() if audit is not None else []
+        if deltas["valves"] or deltas["stations"] or applied or deltas["audit"]:
+            try:
+                conn.send(deltas)
+            except (BrokenPipeError, OSError):
+                return
+
+        elapsed = time.monotonic() - tick_start
+        await asyncio.sleep(max(0.0, update_interval - elapsed))
+
+def _worker_main(conn, station_configs: List[Dict], update_interval: float,
+                 weather_csv: Optional[str] = None, audit: bool = False):
+    """Entry point del processo worker"""
+    # Import locale: con lo start method "spawn" il modulo del server
+    # viene caricato solo nel processo figlio quando serve
+    from audit_log import AuditBuffer
+    from irrigation_server import IrrigationSystem
+
+    buffer = AuditBuffer() if audit else None
+    system = IrrigationSystem(station_configs, weather_csv, audit=buffer)
+    try:
+        asyncio.run(_worker_loop(conn, system, update_interval, buffer))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        system.soil_model.close()
+        conn.close()
+
+class SimulationPool:
+    """Pool di processi che eseguono la simulazione delle stazioni"""
+
+    def __init__(self, station_configs: List[Dict], workers: int = 1,
+                 update_interval: float = 1.0, weather_csv: Optional[str] = None,
+                 audit: bool = False):
+        self.update_interval = update_interval
+        self.weather_csv = weather_csv
+        self.audit = audit
+        self.partitions: List[List[Dict]] = [[] for _ in range(max(1, workers))]
+        self.station_worker: Dict[str, int] = {}
+        self.connections = []
+        self.processes: List[multiprocessing.Process] = []
+        self._system_on: Optional[bool] = None
+
+        # Bilancia le stazioni sui worker in base al numero di valvole
+        loads = [0] * len(self.partitions)
+        for config in sorted(station_configs, key=lambda c: c["valves"], reverse=True):
+            index = loads.index(min(loads))
+            self.partitions[index].append(config)
+            self.station_worker[config["id"]] = index
+            loads[index] += config["valves"]
+
+    def start(self):
+        """Avvia i processi worker (prima del server OPC-UA: nessun socket da ereditare)"""
+        context = multiprocessing.get_context("spawn")
+        for partition in self.partitions:
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_worker_main,
+                args=(child_conn, partition, self.update_interval, self.weather_csv, self.audit),
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self.connections.append(parent_conn)
+            self.processes.append(process)
+        print(f"⚙️  Simulazione avviata su {len(self.processes)} processi worker")
+
+    def set_system_on(self, on: bool):
+        """Inoltra lo stato del sistema a tutti i worker (solo se cambiato)"""
+        if on == self._system_on:
+            return
+        self._system_on = on
+        for conn in self.connections:
+            try:
+                conn.send(("system_on", on))
+            except (BrokenPipeError, OSError):
+                pass
+
+    def send_command(self, full_valve_id: str, start: bool, stop: bool, duration: int):
+        """Inoltra un comando al worker che possiede la valvola"""
+        station_id = full_valve_id.partition("_")[0]
+        index = self.station_worker.get(station_id)
+        if index is None:
+            return
+        try:
+            self.connections[index].send(("command", full_valve_id, start, stop, duration))
+        except (BrokenPipeError, OSError):
+            print(f"⚠️  Impossibile inoltrare il comando per {full_valve_id}")
+
+    def resume_valve(self, full_valve_id: str, mode: str, remaining: int):
+        """Riprende nel worker un'irrigazione ripristinata dal journal"""
+        index = self.station_worker.get(full_valve_id.partition("_")[0])
+        if index is None:
+            return
+        try:
+            self.connections[index].send(("resume", full_valve_id, mode, remaining))
+        except (BrokenPipeError, OSError):
+            print(f"⚠️  Impossibile riprendere l'irrigazione di {full_valve_id}")
+
+    def add_station(self, config: Dict):
+        """Assegna una nuova stazione al worker meno carico"""
+        if config["id"] in self.station_worker:
+            return
+        loads = [sum(c["valves"] for c in partition) for partition in self.partitions]
+        index = loads.index(min(loads))
+        self.partitions[index].append(config)
+        self.station_worker[config["id"]] = index
+        self._send(index, ("add_station", config))
+
+    def update_station(self, config: Dict):
+        """Inoltra la nuova configurazione di una stazione al suo worker"""
+        index = self.station_worker.get(config["id"])
+        if index is None:
+            return
+        self.partitions[index] = [config if c["id"] == config["id"] else c for c in self.partitions[index]]
+        self._send(index, ("update_station", config))
+
+    def remove_station(self, station_id: str):
+        """Rimuove una stazione dal worker che la possiede"""
+        index = self.station_worker.pop(station_id, None)
+        if index is None:
+            return
+        self.partitions[index] = [c for c in self.partitions[index] if c["id"] != station_id]
+        self._send(index, ("remove_station", station_id))
+
+    def _send(self, index: int, message: Tuple):
+        if index >= len(self.connections):
+            return  # Worker non ancora avviati: la partizione basta
+        try:
+            self.connections[index].send(message)
+        except (BrokenPipeError, OSError):
+            print(f"⚠️  Impossibile inoltrare {message[0]} al worker {index}")
+
+    def drain_deltas(self) -> Dict[str, Dict]:
+        """Raccoglie senza bloccare tutti i delta disponibili dai worker"""
+        merged: Dict = {"valves": {}, "stations": {}, "applied": [], "audit": []}
+        for conn in self.connections:
+            if conn.closed:
+                continue
+            try:
+                while conn.poll():
+                    deltas = conn.recv()
+                    merged["valves"].update(deltas["valves"])
+                    merged["stations"].update(deltas["stations"])
+                    merged["applied"].extend(deltas["applied"])
+                    merged["audit"].extend(deltas["audit"])
+            except (EOFError, OSError):
+                print("⚠️  Worker di simulazione terminato inaspettatamente")
+                conn.close()
+        return merged
+
+    def stop(self):
+        """Ferma i worker"""
+        for conn in self.connections:
+            try:
+                conn.send(("stop",))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=2)
+            if process.is_alive():
+                process.terminate()
+        for conn in self.connections:
+            conn.close()
+        self.connections.clear()
+        self.processes.clear()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Modello di umidità del suolo per stazione, vettorializzato con NumPy
+
+Ogni tick avanza l'umidità di tutte le stazioni con operazioni su array:
+acqua in ingresso dall'irrigazione (e dalla pioggia) meno l'evapotraspirazione
+letta in streaming da un CSV meteo locale.
+
+Formato CSV meteo (una riga per intervallo, valori validi fino alla riga successiva):
+    timestamp,et0_mm_h,rain_mm_h
+    2025-06-01T00:00:00,0.05,0.0
+    2025-06-01T01:00:00,0.04,0.0
+"""
+
+import csv
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Parametri di default del suolo (franco-limoso, tappeto erboso)
+SOIL_DEFAULTS = {
+    "area_m2": 50.0,            # superficie irrigata per valvola
+    "root_depth_mm": 300.0,     # profondità radicale
+    "field_capacity": 0.35,     # capacità di campo (frazione volumetrica)
+    "wilting_point": 0.12,      # punto di appassimento
+    "saturation": 0.45,         # saturazione
+    "drainage_rate": 0.5,       # frazione dell'eccesso drenata per ora
+    "crop_coefficient": 0.8,    # Kc del prato
+    "initial_moisture": 0.25,
+    "water_flow_rate": 5.0,     # litri/minuto per valvola
+    "default_et0_mm_h": 0.2,    # ET0 usata senza CSV meteo
+}
+
+class WeatherStream:
+    """Legge un CSV meteo in streaming, senza caricarlo in memoria"""
+
+    def __init__(self, path: str, default_et0_mm_h: float = SOIL_DEFAULTS["default_et0_mm_h"]):
+        self.path = path
+        self._file = open(path, newline="")
+        self._reader = csv.DictReader(self._file)
+        self.et0_mm_h = default_et0_mm_h
+        self.rain_mm_h = 0.0
+        self._next_row: Optional[Dict] = None
+        self._next_time: Optional[datetime] = None
+        self._read_next()
+
+    def _read_next(self):
+        """Legge la prossima riga valida del CSV"""
+        self._next_row = None
+        self._next_time = None
+        for row in self._reader:
+            try:
+                self._next_time = datetime.fromisoformat(row["timestamp"])
+                self._next_row = row
+                return
+            except (KeyError, ValueError):
+                continue  # Riga malformata
+        self._file.close()
+
+    def advance(self, now: datetime):
+        """Avanza lo stream fino all'istante indicato"""
+        while self._next_time is not None and self._next_time <= now:
+            row = self._next_row
+            self.et0_mm_h = float(row.get("et0_mm_h") or 0.0)
+            self.rain_mm_h = float(row.get("rain_mm_h") or 0.0)
+            self._read_next()
+
+    def close(self):
+        """Chiude il file"""
+        if not self._file.closed:
+            self._file.close()
+
+class SoilMoistureModel:
+    """Bilancio idrico semplificato del suolo per tutte le stazioni"""
+
+    def __init__(self, station_ids: List[str], valve_counts: List[int],
+                 weather: Optional[WeatherStream] = None, **params):
+        self.params = {**SOIL_DEFAULTS, **params}
+        self.weather = weather
+        self.station_ids = list(station_ids)
+        self.index = {station_id: i for i, station_id in enumerate(self.station_ids)}
+
+        # Superficie servita da ogni stazione (m²)
+        self.area = np.asarray(valve_counts, dtype=np.float64) * self.params["area_m2"]
+        self.moisture = np.full(len(self.station_ids), self.params["initial_moisture"], dtype=np.float64)
+        # Incrementato quando cambia l'elenco delle stazioni (indici non più confrontabili)
+        self.layout_version = 0
+
+    def step(self, irrigating: np.ndarray, dt_seconds: float, now: datetime):
+        """
+        Avanza il modello di dt_seconds.
+        irrigating: numero medio di valvole in irrigazione nell'intervallo per stazione
+                    (stesso ordine di station_ids)
+        """
+        if dt_seconds <= 0 or self.moisture.size == 0:
+            return
+
+        p = self.params
+        et0_mm_h = p["default_et0_mm_h"]
+        rain_mm_h = 0.0
+        if self.weather is not None:
+            self.weather.advance(now)
+            et0_mm_h = self.weather.et0_mm_h
+            rain_mm_h = self.weather.rain_mm_h
+
+        hours = dt_seconds / 3600.0
+        fc = p["field_capacity"]
+        wp = p["wilting_point"]
+
+        # Acqua in ingresso: litri / m² = mm
+        irrigation_mm = irrigating * p["water_flow_rate"] * (dt_seconds / 60.0) / np.maximum(self.area, 1.0)
+        rain_mm = rain_mm_h * hours
+
+        # Evapotraspirazione ridotta dallo stress idrico sotto capacità di campo
+        stress = np.clip((self.moisture - wp) / (fc - wp), 0.0, 1.0)
+        et_mm = p["crop_coefficient"] * et0_mm_h * hours * stress
+
+        self.moisture += (irrigation_mm + rain_mm - et_mm) / p["root_depth_mm"]
+
+        # Drenaggio dell'eccesso sopra la capacità di campo
+        excess = np.maximum(self.moisture - fc, 0.0)
+        self.moisture -= excess * min(1.0, p["drainage_rate"] * hours)
+
+        np.clip(self.moisture, 0.0, p["saturation"], out=self.moisture)
+
+    def add_station(self, station_id: str, valve_count: int):
+        """Aggiunge una stazione al modello (umidità iniziale di default)"""
+        if station_id in self.index:
+            return
+        self.index[station_id] = len(self.station_ids)
+        self.station_ids.append(station_id)
+        self.area = np.append(self.area, valve_count * self.params["area_m2"])
+        self.moisture = np.append(self.moisture, self.params["initial_moisture"])
+        self.layout_version += 1
+
+    def set_valve_count(self, station_id: str, valve_count: int):
+        """Aggiorna la superficie servita dopo una modifica delle valvole"""
+        self.area[self.index[station_id]] = valve_count * self.params["area_m2"]
+
+    def remove_station(self, station_id: str):
+        """Rimuove una stazione dal modello"""
+        i = self.index.pop(station_id, None)
+        if i is None:
+            return
+        del self.station_ids[i]
+        self.area = np.delete(self.area, i)
+        self.moisture = np.delete(self.moisture, i)
+        self.index = {sid: j for j, sid in enumerate(self.station_ids)}
+        self.layout_version += 1
+
+    def moisture_percent(self, station_id: str) -> float:
+        """Umidità volumetrica della stazione in percentuale"""
+        return float(self.moisture[self.index[station_id]] * 100.0)
+
+    def close(self):
+        """Rilascia lo stream meteo"""
+        if self.weather is not None:
+            self.weather.close()
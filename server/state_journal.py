@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Persistenza crash-safe dello stato con write-ahead log
+
+Il loop di aggiornamento accoda i record in memoria (O(1)); un thread di
+scrittura li appende in batch a un log JSON-lines e periodicamente compatta
+lo stato in uno snapshot. Al riavvio snapshot + log vengono riprodotti per
+riprendere le irrigazioni in corso con il tempo rimanente corretto.
+
+Record del log (chiavi compatte):
+    {"t": "s", "on": true}                                   stato sistema
+    {"t": "v", "id": "...", "m": "Manual", "d": 1718000000.0} valvola (d = scadenza epoch, 0 = ferma)
+    {"t": "c", "id": "...", "a": 1, "o": 0, "n": 300}         comando ricevuto (start, stop, durata)
+    {"t": "k", "id": "..."}                                   comando applicato
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+def _empty_state() -> Dict:
+    return {"system_on": True, "valves": {}, "pending": {}}
+
+def _apply_record(state: Dict, record: Dict):
+    """Applica un record allo stato materializzato"""
+    kind = record.get("t")
+    if kind == "s":
+        state["system_on"] = record["on"]
+    elif kind == "v":
+        if record["d"]:
+            state["valves"][record["id"]] = {"mode": record["m"], "deadline": record["d"]}
+        else:
+            state["valves"].pop(record["id"], None)
+    elif kind == "c":
+        state["pending"][record["id"]] = {"start": bool(record["a"]), "stop": bool(record["o"]),
+                                          "duration": record["n"]}
+    elif kind == "k":
+        state["pending"].pop(record["id"], None)
+
+class StateJournal:
+    """Write-ahead log con snapshot compattati e scrittura in background"""
+
+    def __init__(self, directory: str = "state", flush_interval: float = 0.2,
+                 snapshot_interval: float = 60.0):
+        self.directory = directory
+        self.log_path = os.path.join(directory, "journal.log")
+        self.snapshot_path = os.path.join(directory, "snapshot.json")
+        self.flush_interval = flush_interval
+        self.snapshot_interval = snapshot_interval
+
+        # deque: append/popleft atomici, nessun lock nel loop di aggiornamento
+        self._queue = collections.deque()
+        self._state = _empty_state()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._log_file = None
+        self._records_since_snapshot = 0
+        self._last_snapshot = time.monotonic()
+        # Ultima scrittura fallita (disco pieno, EIO): i record restano in coda
+        self._failing = False
+
+    # ------------------------------------------------------------------
+    # Lettura all'avvio
+    # ------------------------------------------------------------------
+    def load(self) -> Dict:
+        """Ricostruisce lo stato da snapshot + log"""
+        state = _empty_state()
+        if os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                print("⚠️  Snapshot dello stato illeggibile, uso solo il log")
+
+        replayed = 0
+        if os.path.exists(self.log_path):
+            with open(self.log_path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Riga troncata da un crash o da una scrittura fallita (poi ripetuta)
+                        continue
+                    _apply_record(state, record)
+                    replayed += 1
+
+        self._state = state
+        self._records_since_snapshot = replayed
+        return state
+
+    # ------------------------------------------------------------------
+    # Scrittura (chiamate dal loop di aggiornamento: solo enqueue)
+    # ------------------------------------------------------------------
+    def record_system(self, on: bool):
+        self._queue.append({"t": "s", "on": on})
+
+    def record_valve(self, valve_id: str, mode: str, deadline: float):
+        self._queue.append({"t": "v", "id": valve_id, "m": mode, "d": deadline})
+
+    def record_command(self, valve_id: str, start: bool, stop: bool, duration: int):
+        self._queue.append({"t": "c", "id": valve_id, "a": int(start), "o": int(stop), "n": duration})
+
+    def record_applied(self, valve_id: str):
+        self._queue.append({"t": "k", "id": valve_id})
+
+    # ------------------------------------------------------------------
+    # Thread di scrittura
+    # ------------------------------------------------------------------
+    def start(self):
+        """Avvia il thread di scrittura"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._log_file = open(self.log_path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._writer_loop, name="state-journal", daemon=True)
+        self._thread.start()
+
+    def _writer_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self._flush()
+                if (self._records_since_snapshot
+                        and time.monotonic() - self._last_snapshot >= self.snapshot_interval):
+                    self._snapshot()
+            except OSError as e:
+                self._write_failed(e)
+        try:
+            self._flush()
+        except OSError as e:
+            self._write_failed(e)
+
+    def _write_failed(self, error: OSError):
+        """Scrittura fallita: i record restano in coda, si riprova al giro dopo con un file riaperto"""
+        if not self._failing:
+            print(f"⚠️  Journal dello stato non scrivibile, record in attesa: {error}")
+        self._failing = True
+        # Il prossimo snapshot si ritenta dopo un intervallo intero, non a ogni giro
+        self._last_snapshot = time.monotonic()
+        if self._log_file is not None and not self._log_file.closed:
+            try:
+                self._log_file.close()
+            except OSError:
+                pass
+
+    def _flush(self):
+        """Scrive in un unico batch tutti i record accodati (in coda finché il batch non è su disco)"""
+        records = list(self._queue)
+        if not records:
+            return
+        data = "\n".join(json.dumps(record, separators=(",", ":")) for record in records) + "\n"
+        if self._log_file.closed:
+            self._log_file = open(self.log_path, "a", encoding="utf-8")
+        if self._failing:
+            # Chiude l'eventuale riga scritta a metà: al caricamento viene scartata
+            data = "\n" + data
+        self._log_file.write(data)
+        self._log_file.flush()
+        os.fsync(self._log_file.fileno())
+        for record in records:
+            self._queue.popleft()
+            _apply_record(self._state, record)
+        self._records_since_snapshot += len(records)
+        if self._failing:
+            print("✅ Journal dello stato di nuovo scrivibile")
+            self._failing = False
+
+    def _snapshot(self):
+        """Compatta lo stato in uno snapshot e azzera il log"""
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._state, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        self._log_file.close()
+        self._log_file = open(self.log_path, "w", encoding="utf-8")
+        self._records_since_snapshot = 0
+        self._last_snapshot = time.monotonic()
+
+    def close(self):
+        """Scrive i record pendenti e ferma il thread"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+        self._log_file.close()
@@ -0,0 +1,75 @@
+"""Test delle regole di allarme incrementali"""
+
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "client"))
+
+from alert_rules import (AlertEngine, AlertRule, OpenValvesRule, StationNotWateredRule,  # noqa: E402
+                         ValveRuntimeRule)
+
+def test_open_valves_counts_only_transitions():
+    notified = []
+    engine = AlertEngine([OpenValvesRule(2)], on_alert=notified.append)
+    for valve_id in ("S1_V1", "S1_V2", "S2_V1"):
+        engine.observe(valve_id, "irrigating", True, now=100)
+    # Stesso valore ripetuto (rilettura): nessun effetto sul contatore
+    engine.observe("S2_V1", "irrigating", True, now=101)
+    alert = engine.active[("open_valves", "system")]
+    assert alert.message.startswith("3 valvole aperte") and alert.raised_at == 100
+
+    engine.observe("S1_V1", "irrigating", False, now=200)
+    assert not engine.active
+    assert [a.cleared_at for a in engine.history] == [200]
+    assert len(notified) == 2
+
+def test_first_closed_observation_is_not_a_close():
+    engine = AlertEngine([OpenValvesRule(0)])
+    engine.observe("S1_V1", "irrigating", False, now=0)
+    engine.observe("S1_V2", "irrigating", True, now=1)
+    assert ("open_valves", "system") in engine.active
+    engine.observe("S1_V2", "irrigating", False, now=2)
+    assert not engine.active
+
+def test_valve_runtime_timer():
+    async def scenario():
+        engine = AlertEngine([ValveRuntimeRule(0.05)])
+        engine.start()
+        engine.observe("S1_V1", "irrigating", True)
+        engine.observe("S1_V2", "irrigating", True)
+        engine.observe("S1_V2", "irrigating", False)
+        await asyncio.sleep(0.2)
+        assert list(engine.active) == [("valve_runtime", "S1_V1")]
+        engine.observe("S1_V1", "irrigating", False)
+        assert not engine.active
+        engine.stop()
+    asyncio.run(scenario())
+
+def test_station_not_watered_at_deadline():
+    async def scenario():
+        rule = StationNotWateredRule("06:00")
+        engine = AlertEngine([rule])
+        now = datetime(2025, 6, 1, 5, 0).timestamp()
+        engine.start(now)
+        engine.observe("S1_V1", "irrigating", False, now=now)
+        engine.observe("S2_V1", "irrigating", True, now=now)
+        engine.observe("S2_V1", "irrigating", False, now=now + 600)
+        # Ora limite raggiunta
+        rule._check(datetime(2025, 6, 1, 6, 0).timestamp())
+        assert list(engine.active) == [("station_not_watered", "S1")]
+        engine.observe("S1_V1", "irrigating", True, now=time.time())
+        assert not engine.active
+        engine.stop()
+    asyncio.run(scenario())
+
+def test_rule_without_on_change_cannot_be_created():
+    class Incomplete(AlertRule):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
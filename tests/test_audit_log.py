@@ -0,0 +1,63 @@
+"""Test del registro di audit: scrittura in batch, rotazione compressa, file conservati"""
+
+import glob
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"))
+
+from audit_log import AuditBuffer, AuditLog  # noqa: E402
+
+def read_all(directory: str) -> list:
+    """Eventi di tutti i file, ruotati (in ordine) e corrente"""
+    records = []
+    for path in sorted(glob.glob(os.path.join(directory, "audit-*.jsonl.gz")), key=os.path.getmtime):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            records += [json.loads(line) for line in f]
+    current = os.path.join(directory, "audit.jsonl")
+    if os.path.exists(current):
+        with open(current, encoding="utf-8") as f:
+            records += [json.loads(line) for line in f]
+    return records
+
+def test_buffer_drain_and_extend():
+    buffer = AuditBuffer()
+    buffer.record("start", ts=1.0, valve="S1_V1", duration=60)
+    events = buffer.drain()
+    assert events == [{"valve": "S1_V1", "duration": 60, "ts": 1.0, "ev": "start"}]
+    assert buffer.drain() == []
+    buffer.extend(events)
+    assert buffer.drain() == events
+
+def test_events_are_written_on_close(tmp_path):
+    log = AuditLog(str(tmp_path), flush_interval=10)
+    log.start()
+    log.record("system", on=False)
+    log.record("stop", valve="S1_V1", remaining=80)
+    log.close()
+    assert [r["ev"] for r in read_all(str(tmp_path))] == ["system", "stop"]
+    assert log.written == 2
+
+def test_rotation_by_size_keeps_backup_count(tmp_path):
+    log = AuditLog(str(tmp_path), flush_interval=0.01, max_bytes=200, backup_count=2)
+    log.start()
+    for i in range(30):
+        log.record("complete", valve=f"S1_V{i}")
+        time.sleep(0.02)
+    log.close()
+    rotated = glob.glob(str(tmp_path / "audit-*.jsonl.gz"))
+    assert len(rotated) == 2
+    # Gli eventi conservati sono gli ultimi, in ordine
+    valves = [r["valve"] for r in read_all(str(tmp_path))]
+    assert valves == [f"S1_V{i}" for i in range(30 - len(valves), 30)]
+
+def test_leftover_file_is_rotated_at_start(tmp_path):
+    (tmp_path / "audit.jsonl").write_text('{"ts":1,"ev":"system","on":true}\n', encoding="utf-8")
+    log = AuditLog(str(tmp_path))
+    log.start()
+    log.close()
+    assert len(glob.glob(str(tmp_path / "audit-*.jsonl.gz"))) == 1
+    assert [r["ev"] for r in read_all(str(tmp_path))] == ["system"]
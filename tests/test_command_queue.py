@@ -0,0 +1,120 @@
+"""Test della coda dei comandi: coalescenza, equità tra sessioni, limiti; integrazione col server"""
+
+import asyncio
+import contextlib
+import os
+import sys
+from datetime import datetime, timezone
+
+import pytest
+from asyncua import Client, ua
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"))
+
+from command_queue import CommandQueue, QueuedCommand  # noqa: E402
+
+def command(valve_id: str, lane="A", start: bool = True, correlation_id: str = "") -> QueuedCommand:
+    return QueuedCommand(valve_id, start, not start, 60 if start else 0, correlation_id or valve_id, None,
+                         "test", lane)
+
+def test_coalescing_keeps_last_command_and_position():
+    queue = CommandQueue(rate=1000)
+    assert queue.submit(command("V1", correlation_id="a")) is None
+    queue.submit(command("V2"))
+    replaced = queue.submit(command("V1", start=False, correlation_id="b"))
+    assert replaced.correlation_id == "a"
+    assert queue.pending("V1").correlation_id == "b"
+    assert queue.depth == 2 and queue.coalesced == 1
+    drained = queue.drain()
+    assert [(c.valve_id, c.stop) for c in drained] == [("V1", True), ("V2", False)]
+
+def test_lanes_are_served_in_turn():
+    queue = CommandQueue(rate=1000, per_tick=4)
+    for i in range(10):
+        queue.submit(command(f"A{i}", lane="noisy"))
+    queue.submit(command("B0", lane="quiet"))
+    first = [c.valve_id for c in queue.drain()]
+    assert "B0" in first[:2]
+    assert queue.depth == 7
+
+def test_capacity_and_rate_limits():
+    queue = CommandQueue(capacity=2, rate=1000)
+    queue.submit(command("V1"))
+    queue.submit(command("V2"))
+    # Una valvola già in coda si sostituisce anche a coda piena
+    queue.submit(command("V1", start=False))
+    with pytest.raises(ua.UaStatusCodeError) as busy:
+        queue.submit(command("V3"))
+    assert busy.value.code == ua.StatusCodes.BadServerTooBusy
+
+    limited = CommandQueue(rate=1, burst=2)
+    limited.submit(command("V1"))
+    limited.submit(command("V2"))
+    with pytest.raises(ua.UaStatusCodeError) as rate:
+        limited.submit(command("V3"))
+    assert rate.value.code == ua.StatusCodes.BadTooManyOperations
+    # Il limite è per corsia
+    limited.submit(command("V3", lane="B"))
+
+def test_submit_many_is_all_or_nothing_and_returns_replaced():
+    queue = CommandQueue(capacity=3, rate=1000)
+    queue.submit(command("V1", correlation_id="old"))
+    replaced = queue.submit_many([command("V1", correlation_id="new"), command("V2")])
+    assert [c.correlation_id for c in replaced] == ["old"]
+    with pytest.raises(ua.UaStatusCodeError):
+        queue.submit_many([command("V3"), command("V4")])
+    assert queue.depth == 2
+
+# ----------------------------------------------------------------------
+# Integrazione con il server (simulazione nello stesso processo)
+# ----------------------------------------------------------------------
+@contextlib.asynccontextmanager
+async def running_server():
+    from irrigation_server import ProfessionalIrrigationServer
+
+    srv = ProfessionalIrrigationServer(sim_workers=0, state_dir=None, audit_dir=None,
+                                       endpoint="opc.tcp://127.0.0.1:0/irrigation")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        await srv.init_server()
+        await srv.server.start()
+    try:
+        yield srv, f"opc.tcp://127.0.0.1:{srv.server.bserver.port}/irrigation"
+    finally:
+        await srv.server.stop()
+
+def test_coalesced_command_id_is_published():
+    async def scenario():
+        async with running_server() as (srv, url):
+            async with Client(url) as client:
+                node = lambda key: client.get_node(srv.nodes[f"Station1_Valve1_{key}"].nodeid)
+                await node("duration_cmd").write_value(ua.Variant(60, ua.VariantType.Int32))
+                await node("command_id").write_value("first")
+                await node("start_cmd").write_value(True)
+                # Prima del tick: lo stop sostituisce lo start in coda
+                await node("command_id").write_value("second")
+                await node("stop_cmd").write_value(True)
+                assert await node("last_command_id").read_value() == "first"
+                trace = next(t for t in srv.tracer.snapshot() if t.correlation_id == "first")
+                assert trace.coalesced_by == "second"
+
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    await srv.update_nodes()
+                    await srv.update_nodes()
+                assert await node("last_command_id").read_value() == "second"
+    asyncio.run(scenario())
+
+def test_method_callers_get_their_own_lanes():
+    async def scenario():
+        async with running_server() as (srv, url):
+            async with Client(url) as first, Client(url) as second:
+                now = datetime.now(timezone.utc)
+                for client, valve_id in ((first, "Station1_Valve1"), (first, "Station1_Valve2"),
+                                         (second, "Station2_Valve1")):
+                    system = client.get_node(srv.irrigation_root.nodeid)
+                    method = await system.get_child([f"{srv.ns_idx}:ExecuteCommand"])
+                    await system.call_method(method, valve_id, "start", 60, "", now)
+                lanes = {}
+                for queued in srv.command_queue.drain():
+                    lanes.setdefault(queued.lane, []).append(queued.valve_id)
+                assert sorted(lanes.values()) == [["Station1_Valve1", "Station1_Valve2"], ["Station2_Valve1"]]
+    asyncio.run(scenario())
@@ -0,0 +1,68 @@
+"""Test del controller di flotta: i rifiuti del server non chiudono la sessione del sito"""
+
+import asyncio
+import contextlib
+import os
+import sys
+
+from asyncua import ua
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "server"))
+sys.path.insert(0, os.path.join(ROOT, "client"))
+
+from fleet_controller import FleetController  # noqa: E402
+
+@contextlib.asynccontextmanager
+async def running_server(**options):
+    from irrigation_server import ProfessionalIrrigationServer
+
+    srv = ProfessionalIrrigationServer(sim_workers=0, state_dir=None, audit_dir=None,
+                                       endpoint="opc.tcp://127.0.0.1:0/irrigation", **options)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        await srv.init_server()
+        await srv.server.start()
+    try:
+        yield srv, f"opc.tcp://127.0.0.1:{srv.server.bserver.port}/irrigation"
+    finally:
+        await srv.server.stop()
+
+def test_partial_stop_all_reports_rejected_valves():
+    async def scenario():
+        # Raffica di 2 comandi per sessione: dei 5 stop solo 2 entrano in coda
+        async with running_server(command_rate=1.0) as (srv, url):
+            fleet = FleetController({"site": url}, health_interval=0)
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                await fleet.connect()
+            try:
+                result = (await fleet.stop_all())["site"]
+                assert result["ok"]
+                assert result["result"]["stopped"] == 2
+                assert set(result["result"]["failed"].values()) == {"BadTooManyOperations"}
+                assert len(result["result"]["failed"]) == 3
+                session = fleet.sessions["site"]
+                assert session.healthy and session.connects == 1
+            finally:
+                await fleet.close()
+    asyncio.run(scenario())
+
+def test_server_rejection_keeps_session():
+    async def scenario():
+        async with running_server() as (srv, url):
+            fleet = FleetController({"site": url}, health_interval=0)
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                await fleet.connect()
+            try:
+                async def busy(session, controller):
+                    raise ua.UaStatusCodeError(ua.StatusCodes.BadServerTooBusy)
+
+                result = (await fleet.run(busy))["site"]
+                assert not result["ok"] and result["error"] == "BadServerTooBusy"
+                session = fleet.sessions["site"]
+                assert session.healthy
+                # L'operazione successiva riusa la stessa sessione
+                assert (await fleet.status())["site"]["ok"]
+                assert session.connects == 1
+            finally:
+                await fleet.close()
+    asyncio.run(scenario())
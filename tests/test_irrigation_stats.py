@@ -0,0 +1,60 @@
+"""Test delle statistiche incrementali: duty cycle su finestre mobili per valvola e stazione"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "client"))
+
+from irrigation_stats import IrrigationStatistics, SlidingRunWindow  # noqa: E402
+
+def statistics() -> IrrigationStatistics:
+    stats = IrrigationStatistics()
+    stats.started_at = 0.0
+    return stats
+
+def run(stats: IrrigationStatistics, full_valve_id: str, start: float, end: float):
+    stats.observe(full_valve_id, True, start)
+    stats.observe(full_valve_id, False, end)
+
+def test_window_trims_run_crossing_the_edge():
+    window = SlidingRunWindow(3600)
+    window.add(0, 5000)
+    assert window.busy(6000) == pytest.approx(2600)
+    assert window.busy(9000) == 0.0
+
+def test_station_duty_with_overlapping_runs():
+    stats = statistics()
+    run(stats, "Station1_Valve1", 4000, 4100)
+    stats.observe("Station1_Valve2", True, 0)
+    stats.observe("Station1_Valve2", False, 5000)
+    # Concluse in ordine di fine: B (4000-4100) prima di A (0-5000)
+    summary = stats.station_summary("Station1", now=6000)
+    # (2600 + 100) s su 1 h e 2 valvole
+    assert summary["duty_1h"] == pytest.approx(2700 / 7200)
+    assert summary["count"] == 2
+    assert summary["runtime"] == pytest.approx(5100)
+    assert stats.valve_summary("Station1_Valve2", now=6000)["duty_1h"] == pytest.approx(2600 / 3600)
+
+def test_open_run_counts_until_now():
+    stats = statistics()
+    run(stats, "Station1_Valve1", 0, 600)
+    stats.observe("Station1_Valve1", True, 3000)
+    summary = stats.valve_summary("Station1_Valve1", now=3600)
+    assert summary["count"] == 2
+    assert summary["runtime"] == pytest.approx(1200)
+    assert summary["duty_1h"] == pytest.approx(1200 / 3600)
+    assert summary["average_duration"] == pytest.approx(600)
+
+def test_repeated_state_is_not_a_transition():
+    stats = statistics()
+    stats.observe("Station1_Valve1", False, 0)
+    stats.observe("Station1_Valve1", True, 10)
+    stats.observe("Station1_Valve1", True, 20)
+    stats.observe("Station1_Valve1", False, 70)
+    summary = stats.valve_summary("Station1_Valve1", now=100)
+    assert summary["count"] == 1
+    assert summary["runtime"] == pytest.approx(60)
+    # Finestra limitata al periodo osservato (100 s)
+    assert summary["duty_1h"] == pytest.approx(0.6)
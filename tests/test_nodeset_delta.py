@@ -0,0 +1,85 @@
+"""Test dell'export NodeSet senza server e del delta applicato al server in esecuzione"""
+
+import asyncio
+import contextlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "server"))
+sys.path.insert(0, ROOT)
+
+from export_nodeset import PreviousIndex, index_path, write_nodeset, write_nodeset_delta  # noqa: E402
+
+OLD = [
+    {"id": "Station1", "description": "Prato", "valve_count": 2, "type": "DoubleValve"},
+    {"id": "Station2", "description": "Aiuole", "valve_count": 1, "type": "SingleValve"},
+    {"id": "Station3", "description": "Orto", "valve_count": 2, "type": "DoubleValve"},
+]
+NEW = [
+    {"id": "Station1", "description": "Prato grande", "valve_count": 2, "type": "DoubleValve"},
+    {"id": "Station2", "description": "Aiuole", "valve_count": 1, "type": "SingleValve"},
+    {"id": "Station4", "description": "Serra", "valve_count": 1, "type": "SingleValve"},
+]
+
+def delta(stations, previous_file: str, output_file: str) -> dict:
+    previous = PreviousIndex(index_path(previous_file))
+    try:
+        return write_nodeset_delta(stations, output_file, previous)
+    finally:
+        previous.close()
+
+def test_index_is_written_only_on_request(tmp_path):
+    plain, indexed = str(tmp_path / "plain.xml"), str(tmp_path / "indexed.xml")
+    write_nodeset(OLD, plain)
+    write_nodeset(OLD, indexed, with_index=True)
+    assert not os.path.exists(index_path(plain))
+    assert os.path.exists(index_path(indexed))
+    with open(plain, encoding="utf-8") as a, open(indexed, encoding="utf-8") as b:
+        assert a.read() == b.read()
+
+def test_delta_chain(tmp_path):
+    full, first, second = (str(tmp_path / name) for name in ("full.xml", "d1.xml", "d2.xml"))
+    write_nodeset(OLD, full, with_index=True)
+    counts = delta(NEW, full, first)
+    assert counts["added"] > 0 and counts["changed"] > 0 and counts["removed"] > 0
+    # Il delta scrive il nuovo indice: base del delta successivo
+    assert delta(NEW, first, second) == {"added": 0, "changed": 0, "removed": 0}
+
+def test_stale_index_format_is_rejected(tmp_path):
+    stale = tmp_path / "old.xml.index"
+    stale.write_text('{"namespace_uri": "x", "format": 1}\n', encoding="utf-8")
+    with pytest.raises(ValueError):
+        PreviousIndex(str(stale))
+
+def test_delta_applied_to_running_server(tmp_path):
+    from irrigation_server import ProfessionalIrrigationServer
+
+    full, delta_file = str(tmp_path / "full.xml"), str(tmp_path / "delta.xml")
+    write_nodeset(OLD, full, with_index=True)
+    delta(NEW, full, delta_file)
+
+    async def scenario():
+        configs = [{"id": s["id"], "description": s["description"], "valves": s["valve_count"]} for s in OLD]
+        srv = ProfessionalIrrigationServer(sim_workers=0, station_configs=configs, state_dir=None, audit_dir=None,
+                                           endpoint="opc.tcp://127.0.0.1:0/irrigation")
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            await srv.init_server()
+            await srv.server.start()
+            try:
+                await srv.apply_nodeset_delta(delta_file)
+                stations = srv.irrigation_system.stations
+                assert sorted(stations) == ["Station1", "Station2", "Station4"]
+                assert stations["Station1"].description == "Prato grande"
+                assert list(stations["Station4"].valves) == ["Valve1"]
+                assert "Station3_Valve1_irrigating" not in srv.nodes
+                # I nodi aggiunti sono usabili: il tick pubblica la nuova valvola
+                srv.queue_command("Station4_Valve1", "start", 60, "", None, "test")
+                await srv.update_nodes()
+                await srv.update_nodes()
+                assert await srv.nodes["Station4_Valve1_irrigating"].read_value() is True
+            finally:
+                await srv.server.stop()
+    asyncio.run(scenario())
@@ -0,0 +1,43 @@
+"""Test dell'export NodeSet in streaming dal server: errori di scrittura senza blocchi"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+from asyncua import Server, ua
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"))
+
+from nodeset_stream import StreamingNodeSetExporter  # noqa: E402
+
+NAMESPACE = "http://example.org/test"
+
+async def export_to(path: str, valves: int = 50) -> int:
+    server = Server()
+    await server.init()
+    ns_idx = await server.register_namespace(NAMESPACE)
+    root = await server.nodes.objects.add_object(ns_idx, "Root")
+    for i in range(valves):
+        await root.add_variable(ns_idx, f"Valve{i}", True)
+    exporter = StreamingNodeSetExporter(server, ns_idx, NAMESPACE, chunk_nodes=5)
+    return await asyncio.wait_for(exporter.export([root.nodeid], path), timeout=10)
+
+def test_export_writes_all_nodes(tmp_path):
+    path = str(tmp_path / "out.xml")
+    assert asyncio.run(export_to(path)) == 51
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    assert text.count("<UAVariable ") == 50
+    assert text.rstrip().endswith("</UANodeSet>")
+
+def test_failed_rename_raises_instead_of_hanging(tmp_path):
+    # Destinazione occupata da una directory: fallisce os.replace, dopo il terminatore
+    path = tmp_path / "out.xml"
+    path.mkdir()
+    with pytest.raises(OSError):
+        asyncio.run(export_to(str(path)))
+
+def test_unwritable_file_raises(tmp_path):
+    with pytest.raises(OSError):
+        asyncio.run(export_to(str(tmp_path / "missing" / "out.xml")))
@@ -0,0 +1,82 @@
+"""Test del formato OpenMetrics e dell'endpoint HTTP"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"))
+
+from openmetrics import CONTENT_TYPE, Histogram, MetricsRegistry, labels, serve_metrics  # noqa: E402
+
+def test_label_escaping():
+    assert labels() == ""
+    assert labels(station="S1", note='a "b"\\c\nd') == '{station="S1",note="a \\"b\\"\\\\c\\nd"}'
+
+def test_families_render_incrementally():
+    registry = MetricsRegistry()
+    gauge = registry.gauge("valve_irrigating", "Valvola in irrigazione")
+    counter = registry.counter("valve_water_liters", "Acqua erogata", unit="liters")
+    gauge.set(labels(valve="V1"), True)
+    gauge.set(labels(valve="V2"), False)
+    counter.set(labels(valve="V1"), 1.5)
+    assert registry.render() == (
+        "# TYPE valve_irrigating gauge\n"
+        "# HELP valve_irrigating Valvola in irrigazione\n"
+        'valve_irrigating{valve="V1"} 1\n'
+        'valve_irrigating{valve="V2"} 0\n'
+        "# TYPE valve_water_liters counter\n"
+        "# UNIT valve_water_liters liters\n"
+        "# HELP valve_water_liters Acqua erogata\n"
+        'valve_water_liters_total{valve="V1"} 1.5\n'
+        "# EOF\n"
+    )
+    gauge.set(labels(valve="V1"), False)
+    gauge.remove(labels(valve="V2"))
+    text = registry.render()
+    assert 'valve_irrigating{valve="V1"} 0\n' in text
+    assert "V2" not in text
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram([1.0, 10.0])
+    for value in (0.5, 5.0, 5.0, 50.0):
+        histogram.observe(value)
+    registry = MetricsRegistry()
+    registry.histogram("tick_seconds", "Durata del tick", histogram, unit="seconds", scale=0.001)
+    lines = registry.render().splitlines()
+    assert 'tick_seconds_bucket{le="0.001"} 1' in lines
+    assert 'tick_seconds_bucket{le="0.01"} 3' in lines
+    assert 'tick_seconds_bucket{le="+Inf"} 4' in lines
+    assert "tick_seconds_count 4" in lines
+    assert "tick_seconds_sum 0.0605" in lines
+
+def test_callback_family_reads_at_scrape():
+    state = {"depth": 3}
+    registry = MetricsRegistry()
+    registry.gauge_callback("queue_depth", "Profondità", lambda: state["depth"])
+    assert "queue_depth 3\n" in registry.render()
+    state["depth"] = 7
+    assert "queue_depth 7\n" in registry.render()
+
+def test_http_endpoint():
+    async def scenario():
+        registry = MetricsRegistry()
+        registry.gauge("up", "Server attivo").set("", 1)
+        server = await serve_metrics(registry, 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            responses = []
+            for path in ("/metrics", "/missing"):
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+                responses.append((await reader.read()).decode())
+                writer.close()
+            return responses
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    metrics, missing = asyncio.run(scenario())
+    assert metrics.startswith("HTTP/1.1 200 OK\r\n")
+    assert f"Content-Type: {CONTENT_TYPE}" in metrics
+    assert metrics.endswith("up 1\n# EOF\n")
+    assert missing.startswith("HTTP/1.1 404")
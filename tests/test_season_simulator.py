@@ -0,0 +1,36 @@
+"""Test del simulatore stagionale: bilancio idrico indipendente dal passo del suolo"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"))
+
+from season_simulator import SeasonSimulator  # noqa: E402
+
+STATIONS = [{"id": "Station1", "description": "Prato", "valves": 1}]
+
+def simulate(program_entries: list) -> tuple:
+    """Mezza giornata simulata; restituisce (risultati, umidità finale non arrotondata)"""
+    simulator = SeasonSimulator({
+        "start": "2025-06-01T00:00:00",
+        "end": "2025-06-01T12:00:00",
+        "stations": STATIONS,
+        "program": program_entries,
+    })
+    results = asyncio.run(simulator.run())
+    return results, simulator.system.soil_model.moisture_percent("Station1")
+
+def test_moisture_does_not_depend_on_step_alignment():
+    # 06:00 cade su un passo del suolo (900 s), 06:05 no: stessa acqua, stessa umidità
+    aligned, aligned_moisture = simulate([{"valve": "Station1_Valve1", "time": "06:00", "duration": 600}])
+    shifted, shifted_moisture = simulate([{"valve": "Station1_Valve1", "time": "06:05", "duration": 600}])
+    assert aligned["total_water_liters"] == shifted["total_water_liters"] == 50.0
+    # Resta solo l'effetto (minimo) dell'evapotraspirazione su 5 minuti di differenza
+    assert aligned_moisture == pytest.approx(shifted_moisture, abs=1e-3)
+
+    _, dry_moisture = simulate([])
+    # 50 l su 50 m² = 1 mm su 300 mm di radici: +0.33 punti di umidità
+    assert aligned_moisture - dry_moisture == pytest.approx(1.0 / 300.0 * 100.0, rel=0.05)
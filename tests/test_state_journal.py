@@ -0,0 +1,79 @@
+"""Test del write-ahead log dello stato: replay, snapshot, errori di scrittura"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"))
+
+import state_journal  # noqa: E402
+from state_journal import StateJournal  # noqa: E402
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condizione non raggiunta"
+        time.sleep(0.01)
+
+def record_sample(journal: StateJournal):
+    journal.record_system(False)
+    journal.record_valve("Station1_Valve1", "Manual", 2000000000.0)
+    journal.record_valve("Station1_Valve2", "Automatic", 2000000000.0)
+    journal.record_valve("Station1_Valve2", "Off", 0)
+    journal.record_command("Station2_Valve1", True, False, 300)
+    journal.record_command("Station3_Valve1", False, True, 0)
+    journal.record_applied("Station3_Valve1")
+
+EXPECTED = {
+    "system_on": False,
+    "valves": {"Station1_Valve1": {"mode": "Manual", "deadline": 2000000000.0}},
+    "pending": {"Station2_Valve1": {"start": True, "stop": False, "duration": 300}},
+}
+
+def test_log_replay(tmp_path):
+    journal = StateJournal(str(tmp_path), flush_interval=0.01)
+    journal.start()
+    record_sample(journal)
+    journal.close()
+    assert StateJournal(str(tmp_path)).load() == EXPECTED
+
+def test_snapshot_compacts_log(tmp_path):
+    journal = StateJournal(str(tmp_path), flush_interval=0.01, snapshot_interval=0.0)
+    journal.start()
+    record_sample(journal)
+    wait_until(lambda: os.path.exists(journal.snapshot_path) and os.path.getsize(journal.log_path) == 0)
+    journal.record_valve("Station4_Valve1", "Manual", 2000000100.0)
+    journal.close()
+    state = StateJournal(str(tmp_path)).load()
+    assert state["valves"]["Station4_Valve1"]["deadline"] == 2000000100.0
+    assert state["pending"] == EXPECTED["pending"]
+
+def test_write_errors_keep_records_queued(tmp_path, monkeypatch):
+    failures = {"left": 3}
+    real_fsync = os.fsync
+
+    def flaky_fsync(fd):
+        if failures["left"]:
+            failures["left"] -= 1
+            raise OSError(28, "No space left on device")
+        real_fsync(fd)
+
+    monkeypatch.setattr(state_journal.os, "fsync", flaky_fsync)
+    journal = StateJournal(str(tmp_path), flush_interval=0.01)
+    journal.start()
+    record_sample(journal)
+    wait_until(lambda: failures["left"] == 0 and os.path.getsize(journal.log_path) > 0)
+    # Il thread di scrittura è sopravvissuto agli errori e scrive ancora
+    journal.record_valve("Station4_Valve1", "Manual", 2000000100.0)
+    journal.close()
+    state = StateJournal(str(tmp_path)).load()
+    assert state["valves"]["Station4_Valve1"]["mode"] == "Manual"
+    assert state["pending"] == EXPECTED["pending"]
+    assert state["system_on"] is False
+
+def test_truncated_line_is_skipped(tmp_path):
+    with open(tmp_path / "journal.log", "w", encoding="utf-8") as f:
+        f.write('{"t":"s","on":false}\n{"t":"v","id":"Sta\n{"t":"c","id":"S_V","a":1,"o":0,"n":60}\n')
+    state = StateJournal(str(tmp_path)).load()
+    assert state["system_on"] is False
+    assert state["pending"] == {"S_V": {"start": True, "stop": False, "duration": 60}}